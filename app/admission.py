@@ -0,0 +1,211 @@
+#admission.py
+
+import time
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+from flask import g, jsonify, request
+from flask_login import current_user
+from config import Config
+from auth import has_replication_token
+from metrics import registry
+
+ADMISSION_QUEUE_DEPTH = registry.gauge('admission_queue_depth', 'Requests waiting for admission by class')
+ADMISSION_ACTIVE = registry.gauge('admission_active', 'Requests being served by class')
+ADMISSION_REJECTED = registry.counter('admission_rejected_total', 'Requests rejected by class and reason')
+ADMISSION_WAIT = registry.histogram('admission_wait_seconds', 'Time requests waited for admission by class')
+
+# Lower number is served first
+PRIORITIES = {'interactive': 0, 'write': 1, 'replication': 2, 'bulk': 3, 'long_poll': 4}
+
+# Classes that spend their slot waiting on a condition, not working; they do not count towards max_active
+IDLE_CLASSES = {'long_poll'}
+
+# Endpoints whose class does not follow from the HTTP method
+ROUTE_CLASSES = {
+    'api.handle_replicate': 'replication',
+    'api.replication_status': 'replication',
+    'api.get_changes': 'long_poll',
+    'api.ack_changes': 'replication',
+    'api.get_patients': 'bulk',
+    'api.display_patients': 'bulk',
+    'api.display_doctors': 'bulk',
+    'api.get_revenue_report': 'bulk',
+    'api.rebuild_revenue_rollups': 'bulk',
+    'api.run_archive': 'bulk',
+    'api.archive_status': 'bulk',
+}
+
+EXEMPT_ENDPOINTS = {'static', 'api.metrics'}
+
+
+def route_class(endpoint, method):
+    if endpoint in ROUTE_CLASSES:
+        return ROUTE_CLASSES[endpoint]
+    return 'interactive' if method in ('GET', 'HEAD', 'OPTIONS') else 'write'
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Returns 0 if a token was taken, else the seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per (client, route class), kept in a bounded LRU."""
+
+    def __init__(self, limits, max_clients):
+        self.limits = limits
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, client, request_class):
+        rate, burst = self.limits[request_class]
+        key = (client, request_class)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, burst)
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(key)
+        return bucket.take()
+
+
+class AdmissionController:
+    """
+    Bounds the requests served at once and admits waiters by priority.
+
+    Every class has its own cap on active requests, so bulk listings and
+    replication can never take all of the slots, a bounded wait queue and a
+    maximum wait. When a slot frees up the waiter with the best priority
+    (then the oldest) goes first, so interactive reads overtake queued bulk
+    work. Requests that cannot be queued or wait too long are shed. Long
+    polls hold a slot of their own class only, so idle subscribers can never
+    starve /replicate of slots.
+    """
+
+    def __init__(self, max_active, class_limits):
+        self.max_active = max_active
+        self.class_limits = class_limits  # class -> (max active, max queued, max wait seconds)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._active_by_class = {name: 0 for name in class_limits}
+        self._queued_by_class = {name: 0 for name in class_limits}
+        self._waiters = {name: [] for name in class_limits}  # class -> heap of (priority, seq, class)
+        self._seq = itertools.count()
+
+    def _first_runnable(self):
+        # The best waiter of a class is its heap head; the overall head may be blocked by its
+        # class cap, so the first runnable is the best head among the classes with room
+        heads = [
+            waiters[0] for request_class, waiters in self._waiters.items()
+            if waiters and self._active_by_class[request_class] < self.class_limits[request_class][0]
+            and (request_class in IDLE_CLASSES or self._active < self.max_active)
+        ]
+        return min(heads) if heads else None
+
+    def acquire(self, request_class):
+        """Returns None once admitted, or the reason ('queue_full' or 'timeout') the request was shed."""
+        max_active, max_queued, max_wait = self.class_limits[request_class]
+        with self._cond:
+            if self._queued_by_class[request_class] >= max_queued:
+                return 'queue_full'
+            entry = (PRIORITIES[request_class], next(self._seq), request_class)
+            waiters = self._waiters[request_class]
+            heapq.heappush(waiters, entry)
+            self._queued_by_class[request_class] += 1
+            ADMISSION_QUEUE_DEPTH.set(self._queued_by_class[request_class], **{'class': request_class})
+            deadline = time.monotonic() + max_wait
+            try:
+                while self._first_runnable() is not entry:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return 'timeout'
+                    self._cond.wait(remaining)
+                if request_class not in IDLE_CLASSES:
+                    self._active += 1
+                self._active_by_class[request_class] += 1
+                ADMISSION_ACTIVE.set(self._active_by_class[request_class], **{'class': request_class})
+                return None
+            finally:
+                if waiters[0] is entry:
+                    heapq.heappop(waiters)
+                else:
+                    # Timed out behind others of its class
+                    waiters.remove(entry)
+                    heapq.heapify(waiters)
+                self._queued_by_class[request_class] -= 1
+                ADMISSION_QUEUE_DEPTH.set(self._queued_by_class[request_class], **{'class': request_class})
+                # Whoever is now first may be able to run
+                self._cond.notify_all()
+
+    def release(self, request_class):
+        with self._cond:
+            if request_class not in IDLE_CLASSES:
+                self._active -= 1
+            self._active_by_class[request_class] -= 1
+            ADMISSION_ACTIVE.set(self._active_by_class[request_class], **{'class': request_class})
+            self._cond.notify_all()
+
+
+rate_limiter = RateLimiter(Config.ADMISSION_RATE_LIMITS, Config.ADMISSION_MAX_CLIENTS)
+admission = AdmissionController(Config.ADMISSION_MAX_ACTIVE, Config.ADMISSION_CLASS_LIMITS)
+
+
+def _client_key():
+    if has_replication_token(request.headers):
+        return f"peer:{request.remote_addr}"
+    if current_user.is_authenticated:
+        return f"user:{current_user.get_id().partition(':')[0]}"
+    return f"ip:{request.remote_addr}"
+
+
+def _shed(status, message, retry_after):
+    response = jsonify({'message': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response
+
+
+def init_admission(app):
+    @app.before_request
+    def _admit():
+        if request.endpoint in EXEMPT_ENDPOINTS or request.endpoint is None:
+            return None
+        request_class = route_class(request.endpoint, request.method)
+
+        retry_after = rate_limiter.check(_client_key(), request_class)
+        if retry_after:
+            ADMISSION_REJECTED.inc(**{'class': request_class, 'reason': 'rate_limited'})
+            return _shed(429, 'Rate limit exceeded', retry_after)
+
+        started = time.perf_counter()
+        reason = admission.acquire(request_class)
+        ADMISSION_WAIT.observe(time.perf_counter() - started, **{'class': request_class})
+        if reason is not None:
+            ADMISSION_REJECTED.inc(**{'class': request_class, 'reason': reason})
+            return _shed(503, 'Server busy, retry shortly', Config.ADMISSION_CLASS_LIMITS[request_class][2])
+        g.admission_class = request_class
+        return None
+
+    @app.teardown_request
+    def _release(exc):
+        if request_class := g.pop('admission_class', None):
+            admission.release(request_class)
@@ -0,0 +1,57 @@
+#aio.py
+
+import asyncio
+import functools
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from metrics import registry
+
+DB_EXECUTOR_IN_FLIGHT = registry.gauge('db_executor_in_flight', 'Database calls submitted from async views and not yet finished')
+
+
+class DatabaseExecutor:
+    """
+    Dedicated thread pool for blocking SQLite work called from async views.
+
+    Keeping database calls off the default executor means a burst of slow
+    queries cannot starve other blocking work (such as peer I/O without
+    httpx), and bounds how many connections async views hold at once.
+    """
+
+    def __init__(self, workers):
+        self._workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def _get_executor(self):
+        # Created on first use so importing this module starts no threads
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='db')
+        return self._executor
+
+    def _track(self, delta):
+        with self._lock:
+            self._in_flight += delta
+            DB_EXECUTOR_IN_FLIGHT.set(self._in_flight)
+
+    async def run(self, func, *args, **kwargs):
+        """Awaits func(*args, **kwargs) on the pool, with the caller's app and request context."""
+        # Flask's contexts live in context variables, so the copy carries them to the worker thread
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        self._track(1)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), call)
+        finally:
+            self._track(-1)
+
+
+db_executor = DatabaseExecutor(Config.DB_EXECUTOR_WORKERS)
+
+
+def run_db(func, *args, **kwargs):
+    return db_executor.run(func, *args, **kwargs)
@@ -0,0 +1,303 @@
+#analytics.py
+
+import sys
+import bisect
+import logging
+import datetime
+import threading
+import time
+from array import array
+from collections import Counter
+from sqlalchemy import text
+from config import Config
+from metrics import registry
+
+ANALYTICS_ROWS = registry.gauge('analytics_snapshot_rows', 'Rows held in the columnar analytics snapshot by table')
+ANALYTICS_BYTES = registry.gauge('analytics_snapshot_bytes', 'Approximate memory of the columnar analytics snapshot by table')
+ANALYTICS_LOADS = registry.counter('analytics_snapshot_loads_total', 'Full loads of a snapshot table from the database')
+
+# Stored for a NULL or unparseable date
+NO_DATE = -1
+
+
+def _day(value):
+    """Date (or ISO date string) as a proleptic ordinal day, NO_DATE if missing."""
+    if value is None:
+        return NO_DATE
+    if isinstance(value, datetime.date):
+        return value.toordinal()
+    try:
+        return datetime.date.fromisoformat(str(value)[:10]).toordinal()
+    except ValueError:
+        return NO_DATE
+
+
+class ColumnarTable:
+    """
+    One table as parallel typed arrays, one 4-byte slot per row and column.
+
+    String-like columns are dictionary encoded (each distinct value is stored
+    once and rows hold its code) and date columns hold ordinal days. Deleted
+    rows are replaced by the last row, so the arrays stay dense and every
+    aggregate is a single pass over them.
+    """
+
+    def __init__(self, name, key, columns):
+        self.name = name
+        self.key = key
+        self.kinds = dict(columns)  # column -> 'category' or 'date'
+        self.columns = {column: array('i') for column in self.kinds}
+        self.values = {column: [] for column, kind in self.kinds.items() if kind == 'category'}
+        self._codes = {column: {} for column in self.values}
+        self._ids = []
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _encode(self, column, value):
+        if self.kinds[column] == 'date':
+            return _day(value)
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values[column])
+            self.values[column].append(value)
+        return code
+
+    def upsert(self, row_id, row):
+        position = self._positions.get(row_id)
+        if position is None:
+            self._positions[row_id] = len(self._ids)
+            self._ids.append(row_id)
+            for column, values in self.columns.items():
+                values.append(self._encode(column, row.get(column)))
+            return
+        for column, values in self.columns.items():
+            if column in row:
+                values[position] = self._encode(column, row[column])
+
+    def delete(self, row_id):
+        position = self._positions.pop(row_id, None)
+        if position is None:
+            return
+        last_id = self._ids.pop()
+        for values in self.columns.values():
+            last = values.pop()
+            if position < len(values):
+                values[position] = last
+        if last_id != row_id:
+            self._ids[position] = last_id
+            self._positions[last_id] = position
+
+    def counts(self, columns):
+        """Counter of row counts keyed by the tuple of encoded values of `columns`."""
+        if not columns:
+            return Counter({(): len(self._ids)})
+        return Counter(zip(*(self.columns[column] for column in columns)))
+
+    def nbytes(self):
+        """Approximate memory of the columns, dictionaries and row id index."""
+        columns = sum(values.buffer_info()[1] * values.itemsize for values in self.columns.values())
+        dictionaries = sum(sys.getsizeof(codes) + sys.getsizeof(self.values[column]) for column, codes in self._codes.items())
+        ids = sys.getsizeof(self._ids) + sys.getsizeof(self._positions) + sum(sys.getsizeof(row_id) for row_id in self._ids)
+        return columns + dictionaries + ids
+
+
+# name -> (key column, {column: kind}, load query)
+TABLES = {
+    'patients': ('PatientID', {'Gender': 'category', 'DateOfBirth': 'date'},
+                 'SELECT "PatientID", "Gender", "DateOfBirth" FROM patients'),
+    'doctors': ('DoctorID', {'DepartmentID': 'category', 'Specialization': 'category'},
+                'SELECT "DoctorID", "DepartmentID", "Specialization" FROM doctors'),
+}
+PATIENT_FIELDS = ('gender', 'age_band')
+DOCTOR_FIELDS = ('department', 'specialization')
+
+
+def age_bands(today=None):
+    """Labels of the configured age bands and the ordinal birth day that starts each band after the first."""
+    today = today or datetime.date.today()
+    limits = Config.ANALYTICS_AGE_BANDS
+    labels = [f"{low}-{high - 1}" for low, high in zip((0,) + limits, limits)] + [f"{limits[-1]}+"]
+    cutoffs = []
+    for years in limits:
+        # Born on or before this day means at least `years` old today
+        try:
+            cutoffs.append(today.replace(year=today.year - years).toordinal())
+        except ValueError:
+            cutoffs.append(today.replace(year=today.year - years, day=28).toordinal())
+    return labels, sorted(cutoffs)
+
+
+class AnalyticsSnapshot:
+    """
+    Per-node columnar copy of the patient and doctor columns used by dashboards.
+
+    A table is loaded from SQLite on its first query and then kept current by
+    the change log listener, which sees local writes as well as replicated
+    ones, so aggregates never materialize ORM objects. Loads run outside
+    the lock the listener needs and are swapped in once the changes
+    published meanwhile have been replayed onto them. With
+    ANALYTICS_SNAPSHOT disabled every query loads a throwaway copy instead
+    and nothing is kept between requests.
+    """
+
+    def __init__(self, db_manager, live=True):
+        self.db_manager = db_manager
+        self.live = live
+        self._tables = {}
+        self._loading = {}  # table -> changes published while it is being loaded
+        self._lock = threading.Lock()
+        if live:
+            db_manager.change_log.subscribe(self.on_changes)
+
+    def _load(self, name):
+        key, columns, query = TABLES[name]
+        started = time.perf_counter()
+        table = ColumnarTable(name, key, columns)
+        names = [key] + list(columns)
+        with self.db_manager.engine.connect() as conn:
+            result = conn.execute(text(query))
+            while rows := result.fetchmany(10000):
+                for row in rows:
+                    table.upsert(row[0], dict(zip(names, row)))
+        ANALYTICS_LOADS.inc(table=name)
+        logging.info(f"Loaded {len(table)} {name} into the analytics snapshot in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return table
+
+    def _update_gauges(self, table):
+        ANALYTICS_ROWS.set(len(table), table=table.name)
+        ANALYTICS_BYTES.set(table.nbytes(), table=table.name)
+
+    def _table(self, name):
+        if not self.live:
+            return self._load(name)
+        with self._lock:
+            if (table := self._tables.get(name)) is not None:
+                return table
+            # Registered before the load reads, so every change it might miss is buffered
+            missed = []
+            self._loading.setdefault(name, []).append(missed)
+
+        # Scanned without the lock, so on_changes on the writer thread never waits for it
+        try:
+            table = self._load(name)
+        except Exception:
+            with self._lock:
+                self._stop_loading(name, missed)
+            raise
+
+        with self._lock:
+            self._stop_loading(name, missed)
+            complete = all(self._apply(table, change) for change in missed)
+            if (current := self._tables.get(name)) is not None:
+                # Another query loaded it first and has been kept current since
+                return current
+            if complete:
+                self._tables[name] = table
+                self._update_gauges(table)
+            # Otherwise a change without an image arrived meanwhile; this copy serves one query only
+            return table
+
+    def _stop_loading(self, name, missed):
+        # By identity: buffers of concurrent loads can be equal
+        buffers = [buffer for buffer in self._loading[name] if buffer is not missed]
+        if buffers:
+            self._loading[name] = buffers
+        else:
+            del self._loading[name]
+
+    @staticmethod
+    def _apply(table, change):
+        """Applies one change; False if it carries no row image to apply."""
+        if change['operation'] == 'delete':
+            table.delete(change['row_id'])
+        elif change['row'] is not None:
+            table.upsert(change['row_id'], change['row'])
+        else:
+            return False
+        return True
+
+    def on_changes(self, changes):
+        # Change log listener: inserts and updates carry the row image, deletes only the id
+        with self._lock:
+            touched = set()
+            for change in changes:
+                for missed in self._loading.get(change['table'], ()):
+                    missed.append(change)
+                table = self._tables.get(change['table'])
+                if table is None:
+                    continue
+                if not self._apply(table, change):
+                    # No image to apply; reload on the next query
+                    del self._tables[change['table']]
+                    continue
+                touched.add(table)
+            # Runs on the writer thread, so the O(rows) byte estimate waits for the next stats()
+            for table in touched:
+                ANALYTICS_ROWS.set(len(table), table=table.name)
+
+    def _aggregate(self, name, group_by, decoders):
+        started = time.perf_counter()
+        table = self._table(name)
+        with self._lock:
+            columns = [decoders[field][0] for field in group_by]
+            counts = table.counts(columns)
+            values = {column: list(table.values.get(column, ())) for column in columns}
+            total = len(table)
+
+        # Few distinct keys remain after counting, so decoding them is cheap
+        grouped = Counter()
+        for codes, count in counts.items():
+            grouped[tuple(decoders[field][1](values[column], code)
+                          for field, column, code in zip(group_by, columns, codes))] += count
+        rows = [dict(zip(group_by, labels), count=count) for labels, count in sorted(grouped.items(), key=lambda item: tuple(map(str, item[0])))]
+        return {
+            'group_by': list(group_by),
+            'rows': rows,
+            'total': total,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+        }
+
+    def patient_distribution(self, group_by=('gender',)):
+        """Patient counts grouped by any of gender and age_band."""
+        labels, cutoffs = age_bands()
+
+        def band(_, day):
+            if day == NO_DATE:
+                return 'unknown'
+            return labels[len(cutoffs) - bisect.bisect_left(cutoffs, day)]
+
+        decoders = {
+            'gender': ('Gender', lambda values, code: values[code] or 'unknown'),
+            'age_band': ('DateOfBirth', band),
+        }
+        return self._aggregate('patients', group_by, decoders)
+
+    def doctor_distribution(self, group_by=('department',)):
+        """Doctor counts grouped by any of department and specialization."""
+        department_names = self.db_manager.get_department_names()
+
+        def department(values, code):
+            return department_names.get(values[code], 'Unassigned')
+
+        decoders = {
+            'department': ('DepartmentID', department),
+            'specialization': ('Specialization', lambda values, code: values[code] or 'unknown'),
+        }
+        return self._aggregate('doctors', group_by, decoders)
+
+    def stats(self):
+        with self._lock:
+            tables = {}
+            for name, table in self._tables.items():
+                nbytes = table.nbytes()
+                self._update_gauges(table)
+                tables[name] = {
+                    'rows': len(table),
+                    'bytes': nbytes,
+                    'bytes_per_row': round(nbytes / len(table), 1) if len(table) else None,
+                    'distinct': {column: len(values) for column, values in table.values.items()}
+                }
+        return {'live': self.live, 'tables': tables}
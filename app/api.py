@@ -1,34 +1,59 @@
 #api.py
 
 import datetime
+import json
+import time
 from sqlite3 import IntegrityError
-from flask import Blueprint, request, jsonify, render_template
+from flask import Blueprint, Response, current_app, request, jsonify, render_template, stream_with_context
+from config import Config
 from flask_login import login_required, current_user
-from exceptions import PatientDeletionError, PatientNotFoundException, InvalidRequestException, DatabaseIntegrityError, InternalServerError
+from functools import wraps
+from exceptions import PatientDeletionError, PatientNotFoundException, InvalidRequestException, DatabaseIntegrityError, InternalServerError, AppointmentConflictError, ArchivedRecordError
 from models import Patient, Doctor, Nurse, Department, Appointment, Prescription, Billing, User
-from database import DatabaseManager
-from utils import ReplicationStrategy
+from metrics import registry
+from profiler import profiler
+from auth import AuthBusyError, has_replication_token
+from cache import cached_response
+from rendering import render_rows
+from migrations import MigrationRunner, verify_query_plans
+from aio import run_db
+from writer import WriteBusyError
+from services import get_db_manager, get_replication_strategy, get_replication_receiver, get_scheduler, get_analytics
+from analytics import PATIENT_FIELDS, DOCTOR_FIELDS
+from werkzeug.local import LocalProxy
 from uuid import uuid4
 import logging
 
 api = Blueprint('api', __name__)
-db_manager = DatabaseManager()
-replication_strategy = ReplicationStrategy()
+# Resolved on first use and shared with app.py, so importing the blueprint does no I/O
+db_manager = LocalProxy(get_db_manager)
+replication_strategy = LocalProxy(get_replication_strategy)
+replication_receiver = LocalProxy(get_replication_receiver)
+scheduler = LocalProxy(get_scheduler)
+analytics = LocalProxy(get_analytics)
+
+@api.app_errorhandler(WriteBusyError)
+def write_busy(e):
+    # Raised before the write was committed, so the client can safely retry it
+    return jsonify({'message': 'Server busy, retry shortly'}), 503, {'Retry-After': '1'}
 
 #USER MANAGEMENT
 @api.route('/users', methods=['POST'])
 @login_required
-def create_user():
+async def create_user():
     user_data = request.get_json()
     if not user_data:
         return jsonify({'message': 'Missing user data'}), 400
     try:
-        user_id = db_manager.insert_user(user_data)        
+        # Hash once here so peers receive the hash instead of the plaintext password
+        if 'Password' in user_data:
+            user_data['PasswordHash'] = await run_db(db_manager.hash_password, user_data.pop('Password'))
+        user_id = await run_db(db_manager.insert_user, user_data)
         
         # Replicate the data to other nodes
         user_data['UserID'] = user_id
         request_id = uuid4().hex
-        replication_strategy.replicate('insert', user_data, 'user', request_id)
+        await replication_strategy.replicate_async('insert', user_data, 'user', request_id)
         
         logging.info(f"User created successfully. ID: {user_id}")
         return jsonify({'UserID': user_id}), 201
@@ -41,13 +66,26 @@ def create_user():
     except InternalServerError as e:
         logging.error(f"Internal server error: {str(e)}")
         return jsonify({'message': 'Failed to create user'}), 502
+    except AuthBusyError:
+        return jsonify({'message': 'Server busy, retry shortly'}), 503, {'Retry-After': '1'}
+    except WriteBusyError:
+        raise
     except Exception as e:
         logging.error(f"Unexpected error: {str(e)}")
         return jsonify({'message': 'Internal server error'}), 503
 
+def replication_auth_required(view):
+    # Peers authenticate with the shared replication token; users with a session are also accepted
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if has_replication_token(request.headers):
+            return current_app.ensure_sync(view)(*args, **kwargs)
+        return login_required(view)(*args, **kwargs)
+    return wrapper
+
 @api.route('/replicate', methods=['POST'])
-@login_required
-def handle_replicate():
+@replication_auth_required
+async def handle_replicate():
     try:
         data = request.get_json()
         if not data:
@@ -58,12 +96,24 @@ def handle_replicate():
         object_type = data.pop('object_type', None)
         db_data = data.pop('data', None)
         request_id = data.pop('request_id', None)
+        origin = data.pop('origin', None)
+        seq = data.pop('seq', None)
 
         if not db_data:
             logging.warning(f"Missing data to process for action: {action}, object_type: {object_type}")
             return jsonify({'message': 'Missing data to process'}), 400
 
-        logging.info(f"Processing action {action} for object_type {object_type}")
+        if origin is not None and isinstance(seq, int):
+            # Sequenced message: applied in origin order, exactly once
+            if object_type == 'batch':
+                operations = db_data['operations']
+            else:
+                operations = [{'action': action, 'object_type': object_type, 'data': db_data}]
+            result = await run_db(replication_receiver.receive, origin, seq, operations)
+            # The sender reads the status and high water mark from the body to repair gaps; only an
+            # operation that could not be applied and was skipped is an error reply
+            status_codes = {'applied': 201, 'duplicate': 200, 'buffered': 202, 'failed': 422, 'busy': 202}
+            return jsonify(result), status_codes[result['status']]
 
         action_method_map = {
             'user': {
@@ -80,6 +130,16 @@ def handle_replicate():
                 'update': db_manager.update_doctor,  
                 'delete': db_manager.delete_doctor,
             },
+            'appointment': {
+                'insert': db_manager.insert_appointment,
+            },
+            'batch': {
+                'apply': lambda batch: db_manager.apply_batch(batch['operations']),
+            },
+            'billing': {
+                'insert': db_manager.insert_billing,
+                'update': lambda billing: db_manager.update_billing(billing['BillingID'], billing),
+            },
         }
 
         action_method = action_method_map.get(object_type, {}).get(action)
@@ -87,20 +147,48 @@ def handle_replicate():
             logging.error(f"Unsupported action-object type combination: {action} with {object_type}")
             return jsonify({'message': 'Unsupported action-object type combination'}), 400
 
-        logging.info(f"Executing {action} for {object_type} with request ID {request_id}")
-        action_method(db_data)  # Call the appropriate database method
+        logging.debug("Executing %s for %s with request ID %s", action, object_type, request_id)
+        await run_db(action_method, db_data)  # Call the appropriate database method
 
-        logging.info(f"{object_type} {action}d successfully")
         return jsonify({'message': f'{object_type} {action}d successfully'}), 201
 
+    except WriteBusyError:
+        raise
     except Exception as e:
         logging.error(f"Unexpected error while replicating data: {str(e)}")
         return jsonify({'message': 'Failed to replicate data'}), 500
 
+async def apply_and_replicate(operations):
+    """Applies a compound operation locally, then replicates it to peers as a single message."""
+    await run_db(db_manager.apply_batch, operations)
+    await replication_strategy.replicate_async('apply', {'operations': operations}, 'batch', uuid4().hex)
+
+async def create_account_with_profile(role, id_field, profile_data):
+    """Creates a login and its patient or doctor profile as one compound operation; returns the new id."""
+    user_id = await run_db(db_manager.generate_user_id, role)
+    password_hash = await run_db(db_manager.hash_password, profile_data.pop('Password'))
+    account = {'UserID': user_id, 'Username': profile_data.pop('Username'), 'PasswordHash': password_hash, 'Role': role}
+    profile_data[id_field] = user_id
+    await apply_and_replicate([
+        {'action': 'insert', 'object_type': 'user', 'data': account},
+        {'action': 'insert', 'object_type': role, 'data': profile_data},
+    ])
+    return user_id
+
+@api.route('/replication/status', methods=['GET'])
+@replication_auth_required
+def replication_status():
+    status = replication_receiver.status()
+    status.update({
+        'origin': replication_strategy.log.origin,
+        'last_seq': replication_strategy.log.latest_seq(),
+    })
+    return jsonify(status), 200
+
 #PATIENT MANAGEMENT
 @api.route('/patients', methods=['POST'])
 @login_required
-def create_patient():
+async def create_patient():
     patient_data = request.get_json()
     required_fields = ["Name", "DateOfBirth", "Gender", "PhoneNumber"]
 
@@ -110,14 +198,24 @@ def create_patient():
         return jsonify({'message': f'Missing required fields: {", ".join(missing_fields)}'}), 400
 
     try: 
-        patient_id = db_manager.insert_patient(patient_data)
+        if 'Username' in patient_data and 'PatientID' not in patient_data:
+            # Login and patient are created together, locally and on every peer
+            if 'Password' not in patient_data:
+                return jsonify({'message': 'Missing required fields: Password'}), 400
+            patient_id = await create_account_with_profile('patient', 'PatientID', patient_data)
+            return jsonify({'redirect': '/dashboard/admin', 'PatientID': patient_id}), 201
+        patient_id = await run_db(db_manager.insert_patient, patient_data)
         # Replicate the data to other nodes
         patient_data['PatientID'] = patient_id
         request_id = uuid4().hex
-        replication_strategy.replicate('insert', patient_data, 'patient', request_id)
+        await replication_strategy.replicate_async('insert', patient_data, 'patient', request_id)
         return jsonify({'redirect': '/dashboard/admin'}), 201
+    except DatabaseIntegrityError as e:
+        return jsonify({'message': str(e)}), 400
     except IntegrityError as e:
         return jsonify({'message': 'Failed to create patient (data integrity issue)'}), 500
+    except WriteBusyError:
+        raise
     except Exception as e:
         print(f"Error creating patient: {e}")
         return jsonify({'message': 'Failed to create patient'}), 500
@@ -142,6 +240,8 @@ def update_patient(patient_id):
         return jsonify({'message': 'Patient updated successfully'}), 200
     except PatientNotFoundException as e:
         return jsonify({'message': str(e)}), 404
+    except WriteBusyError:
+        raise
     except Exception as e:
         print(f"Error updating patient: {e}")
         return jsonify({'message': 'Failed to update patient'}), 500
@@ -150,15 +250,18 @@ def update_patient(patient_id):
 @login_required
 def delete_patient(patient_id):  # sourcery skip: do-not-use-bare-except
   try:
-    patient = db_manager.get_patient_by_id(patient_id)
-    if not patient:
+    if not db_manager.patient_exists(patient_id):
+      return jsonify({'message': 'Patient not found'}), 404
+    # The patient row references its user, so it goes first; peers apply both or neither
+    operations = [
+        {'action': 'delete', 'object_type': 'patient', 'data': patient_id},
+        {'action': 'delete', 'object_type': 'user', 'data': patient_id},
+    ]
+    patient_deleted, _ = db_manager.apply_batch(operations)
+    if not patient_deleted:
+      # Deleted by a concurrent request since the lookup; that request replicated it
       return jsonify({'message': 'Patient not found'}), 404
-    db_manager.delete_user(patient_id)
-    request_id = uuid4().hex
-    replication_strategy.replicate('delete', patient_id, 'user', request_id)
-    db_manager.delete_patient(patient_id)
-    request_id = uuid4().hex
-    replication_strategy.replicate('delete', patient_id, 'patient', request_id)
+    replication_strategy.replicate('apply', {'operations': operations}, 'batch', uuid4().hex)
     return jsonify({'message': 'Patient deleted successfully'}), 200
 
   except PatientNotFoundException as e:
@@ -167,6 +270,8 @@ def delete_patient(patient_id):  # sourcery skip: do-not-use-bare-except
   except (IntegrityError, PatientDeletionError) as e:
     return jsonify({'message': f"Error deleting patient: {str(e)}"}), 400
 
+  except WriteBusyError:
+    raise
   except Exception as e:  
     print(f"Error deleting patient: {e}")
     return jsonify({'message': 'Internal server error'}), 500
@@ -177,37 +282,64 @@ def delete_patient(patient_id):  # sourcery skip: do-not-use-bare-except
 
 @api.route('/patients/display', methods=["GET"])
 @login_required
+@cached_response('patients')
 def display_patients():
-  patients = db_manager.get_all_patients()
-  return render_template('display_patients.html', patients=patients)
+  return render_rows('display_patients.html', patients=db_manager.iter_patients())
 
 @api.route('/patients/search', methods=["GET"])
 @login_required
+@cached_response('patients')
 def search_patients():
     query = request.args.get('query', '')
     with db_manager.get_db() as conn:
         patients = conn.query(Patient).filter(Patient.Name.ilike(f'%{query}%')).all()
-    return render_template('display_patients.html', patients=patients)
+    return render_rows('display_patients.html', patients=patients)
+
+def own_patient_record_required(view):
+    # Patients may only read their own records; checked before a cached response can be served
+    @wraps(view)
+    def wrapper(patient_id, *args, **kwargs):
+        if current_user.Role == 'patient' and current_user.UserID != patient_id:
+            return jsonify({'message': 'Access denied'}), 403
+        return current_app.ensure_sync(view)(*args, patient_id=patient_id, **kwargs)
+    return wrapper
+
+@api.route('/patients/<string:patient_id>/chart', methods=['GET'])
+@login_required
+@own_patient_record_required
+@cached_response('patients', 'appointments', 'prescriptions', 'billings')
+async def get_patient_chart(patient_id):
+    fields = request.args.get('fields')
+    requested = [field.strip() for field in fields.split(',')] if fields else None
+    sections = [field for field in requested if field != 'demographics'] if requested else None
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, Config.CHART_MAX_PAGE_SIZE))
+    offsets = {
+        name: max(0, request.args.get(f'{name}_offset', 0, type=int))
+        for name in db_manager.CHART_SECTIONS
+    }
+
+    chart = await run_db(db_manager.get_patient_chart, patient_id, sections, limit, offsets)
+    if chart is None:
+        return jsonify({'message': f'Patient with ID {patient_id} not found'}), 404
+    if requested and 'demographics' not in requested:
+        chart['patient'] = {'PatientID': patient_id}
+    return jsonify(chart), 200
 
 @api.route("/patients/recent", methods=["GET"])
 @login_required
 def get_recent_patients():
   doctor_id = current_user.UserID
-  appointments = db_manager.get_appointments_by_doctor_id(doctor_id)
-  today = datetime.today()
-
-  recent_patients = []
-  for appointment in appointments:
-    if datetime.strptime(appointment["dateTime"], "%Y-%m-%dT%H:%M:%S") < today:
-      patient = db_manager.get_patient_by_id(appointment['PatientID'])
-      recent_patients.append({"name": patient.Name})
-
+  recent_patients = db_manager.get_recent_patients(doctor_id, datetime.datetime.now())
   return jsonify(recent_patients), 200
+
 @api.route('/patients')
 @login_required
-def get_patients():
+@cached_response('patients')
+async def get_patients():
     try:
-        patients = db_manager.get_all_patients()
+        patients = await run_db(db_manager.get_all_patients)
         return jsonify(patients)
     except Exception as e:
         logging.error(f'Error retrieving patients: {str(e)}')
@@ -216,7 +348,7 @@ def get_patients():
 #DOCTOR MANAGEMENT
 @api.route('/doctors', methods=['POST'])
 @login_required
-def create_doctor():
+async def create_doctor():
     doctor_data = request.get_json()
     required_fields = ["DoctorName", "Specialization", "PhoneNumber", "DepartmentName"]
     
@@ -227,14 +359,22 @@ def create_doctor():
         return jsonify({'message': f'Missing required fields: {", ".join(missing_fields)}'}), 400
 
     try:
-        doctor_id = db_manager.insert_doctor(doctor_data)
+        if 'Username' in doctor_data and 'DoctorID' not in doctor_data:
+            if 'Password' not in doctor_data:
+                return jsonify({'message': 'Missing required fields: Password'}), 400
+            doctor_id = await create_account_with_profile('doctor', 'DoctorID', doctor_data)
+            logging.info(f'Doctor created with ID: {doctor_id}')
+            return jsonify({'redirect': '/dashboard/admin', 'doctor_id': doctor_id}), 201
+        doctor_id = await run_db(db_manager.insert_doctor, doctor_data)
         # Replicate the data to other nodes
         doctor_data.update({'DoctorID': doctor_id})
         request_id = uuid4().hex
-        replication_strategy.replicate('insert', doctor_data, 'doctor', request_id)
+        await replication_strategy.replicate_async('insert', doctor_data, 'doctor', request_id)
         logging.info(f'Doctor created with ID: {doctor_id}')
         return jsonify({'redirect': '/dashboard/admin', 'doctor_id': doctor_id}), 201
 
+    except DatabaseIntegrityError as e:
+        return jsonify({'message': str(e)}), 400
     except (IntegrityError, Exception) as e: 
         logging.error(f"Error creating doctor: {e}")
         return jsonify({'message': 'Failed to create doctor'}), 505
@@ -249,9 +389,9 @@ def search_doctors():
 
 @api.route('/doctors/display', methods=["GET"])
 @login_required
+@cached_response('doctors', 'departments')
 def display_doctors():
-  doctors = db_manager.get_all_doctors()
-  return render_template('display_doctors.html', doctors=doctors)
+  return render_rows('display_doctors.html', doctors=db_manager.iter_doctors())
 
 @api.route('/doctor/name', methods=['GET'])
 @login_required
@@ -259,7 +399,6 @@ def get_doctor_name():
     try:
         doctor = db_manager.get_doctor_by_id(current_user.UserID)
         doctor_name = doctor.Name
-        print(doctor_name)
         return jsonify({'name': doctor_name}), 200
     except Exception as e:
         error_message = f"Error fetching doctor name: {str(e)}"
@@ -294,16 +433,246 @@ def add_prescription():
 @login_required
 def get_upcoming_appointments():
   doctor_id = current_user.UserID  # Get the doctor's ID
-  appointments = db_manager.get_all_appointments()
-  today = datetime.today()
+  # Limited to 5 appointments on the server-side, read from the (DoctorID, StartTime) index
+  upcoming_appointments = db_manager.get_upcoming_appointments(doctor_id, datetime.datetime.now(), limit=5)
+  return jsonify(upcoming_appointments), 200
 
-  # Filter appointments based on date and the doctor's ID
-  upcoming_appointments = [
-      appointment for appointment in appointments
-      if datetime.strptime(appointment["dateTime"], "%Y-%m-%dT%H:%M:%S") >= today and appointment['DoctorID'] == doctor_id
-  ]
+@api.route('/appointments', methods=['POST'])
+@login_required
+def book_appointment():
+    appointment_data = request.get_json(silent=True) or {}
+    if missing_fields := [field for field in ('DoctorID', 'PatientID', 'StartTime') if not appointment_data.get(field)]:
+        return jsonify({'message': f'Missing required fields: {", ".join(missing_fields)}'}), 400
+    try:
+        appointment_id = scheduler.book(appointment_data)
+    except AppointmentConflictError as e:
+        return jsonify({'message': str(e), 'conflicts': e.conflicts}), 409
+    except (InvalidRequestException, ValueError) as e:
+        return jsonify({'message': str(e)}), 400
+    except WriteBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Error booking appointment: {e}")
+        return jsonify({'message': 'Failed to book appointment'}), 500
 
-  # Limit to 5 appointments on the server-side
-  upcoming_appointments = upcoming_appointments[:5]
+    appointment = db_manager.get_appointment_by_id(appointment_id)
+    replication_strategy.replicate('insert', appointment, 'appointment', uuid4().hex)
+    return jsonify(appointment), 201
 
-  return jsonify(upcoming_appointments), 200
\ No newline at end of file
+@api.route('/doctors/<string:doctor_id>/availability', methods=['GET'])
+@login_required
+def get_doctor_availability(doctor_id):
+    try:
+        first_day = datetime.date.fromisoformat(request.args['date']) if request.args.get('date') else datetime.date.today()
+    except ValueError:
+        return jsonify({'message': 'date must be YYYY-MM-DD'}), 400
+    days = max(1, min(request.args.get('days', 1, type=int), Config.SCHEDULE_MAX_DAYS))
+    minutes = request.args.get('duration', Config.APPOINTMENT_DEFAULT_MINUTES, type=int)
+    if not 0 < minutes <= Config.APPOINTMENT_MAX_MINUTES:
+        return jsonify({'message': f'duration must be between 1 and {Config.APPOINTMENT_MAX_MINUTES} minutes'}), 400
+
+    duration = datetime.timedelta(minutes=minutes)
+    patient_id = request.args.get('patient_id')
+    availability = [
+        scheduler.availability(doctor_id, first_day + datetime.timedelta(days=offset), duration, patient_id)
+        for offset in range(days)
+    ]
+    return jsonify({'DoctorID': doctor_id, 'duration': minutes, 'days': availability}), 200
+
+#BILLING AND REPORTING
+@api.route('/billings', methods=['POST'])
+@login_required
+def create_billing():
+    billing_data = request.get_json(silent=True) or {}
+    if missing_fields := [field for field in ('PatientID', 'TotalCost') if field not in billing_data]:
+        return jsonify({'message': f'Missing required fields: {", ".join(missing_fields)}'}), 400
+    try:
+        billing_id = db_manager.insert_billing(billing_data)
+        billing_data['BillingID'] = billing_id
+        replication_strategy.replicate('insert', billing_data, 'billing', uuid4().hex)
+        return jsonify({'BillingID': billing_id}), 201
+    except (ValueError, TypeError) as e:
+        return jsonify({'message': f'Invalid billing data: {e}'}), 400
+    except WriteBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Error creating billing: {e}")
+        return jsonify({'message': 'Failed to create billing'}), 500
+
+@api.route('/billings/<int:billing_id>', methods=['PUT'])
+@login_required
+def update_billing(billing_id):
+    update_data = request.get_json(silent=True)
+    if not update_data:
+        return jsonify({'message': 'Missing update data'}), 400
+    try:
+        if db_manager.update_billing(billing_id, update_data) is None:
+            return jsonify({'message': f'Billing with ID {billing_id} not found'}), 404
+        update_data['BillingID'] = billing_id
+        replication_strategy.replicate('update', update_data, 'billing', uuid4().hex)
+        return jsonify({'message': 'Billing updated successfully'}), 200
+    except ArchivedRecordError as e:
+        return jsonify({'message': str(e)}), 409
+    except (ValueError, TypeError) as e:
+        return jsonify({'message': f'Invalid billing data: {e}'}), 400
+    except WriteBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Error updating billing: {e}")
+        return jsonify({'message': 'Failed to update billing'}), 500
+
+@api.route('/reports/revenue', methods=['GET'])
+@login_required
+@cached_response('billings')
+def get_revenue_report():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    group_by = [name for name in request.args.get('group_by', 'day').split(',') if name]
+    if unknown := [name for name in group_by if name not in ('day', 'department', 'status')]:
+        return jsonify({'message': f'Unknown group_by fields: {", ".join(unknown)}'}), 400
+    try:
+        start = datetime.date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'message': 'from and to must be YYYY-MM-DD dates'}), 400
+    return jsonify(db_manager.get_revenue_report(start, end, group_by)), 200
+
+@api.route('/reports/revenue/rebuild', methods=['POST'])
+@login_required
+def rebuild_revenue_rollups():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    return jsonify(db_manager.rebuild_billing_rollups()), 200
+
+#ANALYTICS
+def _analytics_group_by(default, allowed):
+    group_by = [name for name in request.args.get('group_by', default).split(',') if name]
+    unknown = [name for name in group_by if name not in allowed]
+    return group_by, unknown
+
+@api.route('/analytics/patients', methods=['GET'])
+@login_required
+def patient_analytics():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    group_by, unknown = _analytics_group_by('gender', PATIENT_FIELDS)
+    if unknown:
+        return jsonify({'message': f'Unknown group_by fields: {", ".join(unknown)}'}), 400
+    return jsonify(analytics.patient_distribution(group_by)), 200
+
+@api.route('/analytics/doctors', methods=['GET'])
+@login_required
+def doctor_analytics():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    group_by, unknown = _analytics_group_by('department', DOCTOR_FIELDS)
+    if unknown:
+        return jsonify({'message': f'Unknown group_by fields: {", ".join(unknown)}'}), 400
+    return jsonify(analytics.doctor_distribution(group_by)), 200
+
+@api.route('/admin/analytics', methods=['GET'])
+@login_required
+def analytics_status():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    return jsonify(analytics.stats()), 200
+
+#COLD-DATA ARCHIVE
+@api.route('/admin/archive', methods=['POST'])
+@login_required
+def run_archive():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    payload = request.get_json(silent=True) or {}
+    try:
+        before = datetime.datetime.fromisoformat(payload['before']) if payload.get('before') else None
+    except (TypeError, ValueError):
+        return jsonify({'message': 'before must be an ISO date'}), 400
+    result = db_manager.archive.archive(before)
+    if payload.get('compact'):
+        result['compaction'] = db_manager.archive.compact()
+    return jsonify(result), 200
+
+@api.route('/admin/archive', methods=['GET'])
+@login_required
+def archive_status():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    return jsonify(db_manager.archive.status()), 200
+
+#CHANGE DATA CAPTURE
+def _changes_batch_args():
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', Config.CDC_BATCH_SIZE, type=int)
+    limit = max(1, min(limit, Config.CDC_MAX_BATCH_SIZE))
+    wait = request.args.get('wait', 0, type=float)
+    wait = max(0, min(wait, Config.CDC_MAX_WAIT_SECONDS))
+    return since, limit, wait
+
+@api.route('/changes', methods=['GET'])
+@replication_auth_required
+def get_changes():
+    since, limit, wait = _changes_batch_args()
+    change_log = db_manager.change_log
+
+    if request.args.get('stream', type=int):
+        def generate(position):
+            # Newline-delimited JSON; an empty line is sent as a heartbeat while idle. A heartbeat
+            # to a client that has gone away ends the response, and so does either deadline
+            started = last_change = time.monotonic()
+            while True:
+                now = time.monotonic()
+                remaining = min(started + Config.CDC_STREAM_MAX_SECONDS, last_change + Config.CDC_STREAM_IDLE_SECONDS) - now
+                if remaining <= 0:
+                    return
+                changes = change_log.wait_for(position, min(Config.CDC_MAX_WAIT_SECONDS, remaining), limit)
+                if not changes:
+                    yield '\n'
+                    continue
+                for change in changes:
+                    yield json.dumps(change) + '\n'
+                position = changes[-1]['seq']
+                last_change = time.monotonic()
+        return Response(stream_with_context(generate(since)), mimetype='application/x-ndjson')
+
+    changes = change_log.wait_for(since, wait, limit)
+    next_seq = changes[-1]['seq'] if changes else since
+    return jsonify({'node': db_manager.NODE_ID, 'changes': changes, 'next': next_seq}), 200
+
+@api.route('/changes/ack', methods=['POST'])
+@replication_auth_required
+def ack_changes():
+    ack_data = request.get_json(silent=True) or {}
+    consumer_id = ack_data.get('consumer')
+    seq = ack_data.get('seq')
+    if not consumer_id or not isinstance(seq, int):
+        return jsonify({'message': 'consumer and integer seq are required'}), 400
+    compacted = db_manager.change_log.ack(consumer_id, seq)
+    return jsonify({'consumer': consumer_id, 'acked': seq, 'compacted': compacted}), 200
+
+#METRICS
+@api.route('/metrics', methods=['GET'])
+@replication_auth_required
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+#QUERY PROFILER
+@api.route('/admin/profiler', methods=['GET', 'DELETE'])
+@login_required
+def query_profiler():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    if request.method == 'DELETE':
+        profiler.reset()
+        return jsonify({'message': 'Profiler statistics cleared'}), 200
+    return jsonify(profiler.report()), 200
+
+#SCHEMA
+@api.route('/admin/schema', methods=['GET'])
+@login_required
+def schema_status():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    status = MigrationRunner(db_manager.engine).status()
+    status['lookup_plans'] = verify_query_plans(db_manager.engine)
+    return jsonify(status), 200
@@ -1,35 +1,116 @@
 # app.py
 
+import time
+STARTUP_STARTED = time.perf_counter()
+
 import os
+import logging
+import threading
 from config import app_config
 from flask import Flask, abort, redirect, render_template, request, url_for, jsonify
-from flask_login import LoginManager, login_required, login_user, logout_user, current_user  
-from database import DatabaseManager
-from models import User
+from flask_login import LoginManager, login_required, login_user, logout_user, current_user
 from api import api
+from metrics import init_metrics, registry
+from profiler import profiler
+from auth import AuthBusyError, session_cache
+from rendering import init_rendering, precompile_templates
+from admission import init_admission
+from services import get_db_manager
+
+STARTUP_STEP_SECONDS = registry.gauge('startup_step_seconds', 'Time spent in each node startup step')
+
+# Startup step -> milliseconds, in the order the steps ran
+startup_timings = {}
+_bootstrap_lock = threading.Lock()
+
+
+def _record_step(name, started):
+    elapsed = time.perf_counter() - started
+    startup_timings[name] = round(elapsed * 1000, 1)
+    STARTUP_STEP_SECONDS.set(elapsed, step=name)
+
+
+_record_step('imports', STARTUP_STARTED)
+
+
+def bootstrap(app):
+    """
+    Runs the one-time node checks: schema, admin user and template compilation.
+
+    Called before the first request is served (or eagerly by __main__). The
+    schema step costs one query when the database is already up to date.
+    """
+    if app.extensions.get('bootstrapped'):
+        return
+    with _bootstrap_lock:
+        if app.extensions.get('bootstrapped'):
+            return
+        started = time.perf_counter()
+        db_manager = get_db_manager()
+        _record_step('engine', started)
+
+        started = time.perf_counter()
+        schema = db_manager.ensure_schema()
+        _record_step(f'schema_{schema}', started)
+
+        # Required: Automatically ensure there is an admin user on App worker startup
+        started = time.perf_counter()
+        db_manager.ensure_admin_user()
+        _record_step('admin_user', started)
+
+        started = time.perf_counter()
+        precompile_templates(app)
+        _record_step('templates', started)
+
+        total = (time.perf_counter() - STARTUP_STARTED) * 1000
+        startup_timings['total'] = round(total, 1)
+        logging.info(f"Node ready in {total:.1f} ms: {startup_timings}")
+        if total > app_config.COLD_START_TARGET_MS:
+            logging.warning(f"Cold start took {total:.1f} ms, over the {app_config.COLD_START_TARGET_MS} ms target")
+        if app_config.NODES and not app_config.REPLICATION_TOKEN:
+            logging.warning('REPLICATION_TOKEN is not set: peers cannot authenticate to /replicate or the change feed')
+        app.extensions['bootstrapped'] = True
+
+
+def create_app(config=app_config):
+    """Builds the Flask app without touching the database; see bootstrap()."""
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    # Registered first so no other request hook runs against an unprepared node
+    app.before_request(lambda: bootstrap(app))
+    init_rendering(app)
+    app.register_blueprint(api)
+    init_metrics(app)
+    if config.ADMISSION_CONTROL:
+        init_admission(app)
+    profiler.init_app(app)
+
+    # Initialize Flask-Login
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+    login_manager.login_view = 'login_page'
+    login_manager.user_loader(load_user)
+
+    app.add_url_rule('/login', view_func=login, methods=['GET', 'POST'])
+    app.add_url_rule('/user/info', view_func=user_info)
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/login_page', view_func=login_page)
+    app.add_url_rule('/logout', view_func=logout)
+    # Dashboard routes (using helper function)
+    app.add_url_rule('/dashboard/admin', view_func=create_dashboard_route('admin'))
+    app.add_url_rule('/dashboard/doctors', view_func=create_dashboard_route('doctor'))
+    app.add_url_rule('/dashboard/patients', view_func=create_dashboard_route('patient'))
+    app.add_url_rule('/register/users', view_func=create_user)
+    app.add_url_rule('/register/patients', view_func=create_patient)
+    app.add_url_rule('/register/doctors', view_func=create_doctor)
+    app.add_url_rule('/insert/prescriptions', view_func=create_prescription)
+    app.add_url_rule('/admin/startup', view_func=startup_report)
+    _record_step('create_app', started)
+    return app
 
 
-db_manager = DatabaseManager()
-db_manager.create_tables()
-
-app = Flask(__name__)
-# Initialize Flask-Login
-
-app.config.from_object(app_config) 
-app.register_blueprint(api)
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login_page'
-
-
-# Required: Automatically ensure there is an admin user on App worker startup
-db_manager.ensure_admin_user()
-
-@login_manager.user_loader
-def load_user(user_id):
-    with db_manager.get_db() as db:
-        return db.query(User).get(int(user_id))
-@app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method != 'POST':
         return render_template('login.html')
@@ -37,11 +118,14 @@ def login():
     username = request.form['Username']
     password = request.form['Password']
 
-    user = db_manager.authenticate_user(username, password)
+    try:
+        user = get_db_manager().authenticate_user(username, password)
+    except AuthBusyError:
+        return jsonify({'message': 'Too many concurrent logins, retry shortly'}), 503, {'Retry-After': '1'}
 
     if not user:
         abort(401)
-    login_user(user)
+    login_user(session_cache.create(user))
     # User authenticated, proceed with logic using refreshed current_user
     role_dashboard_urls = {
         'admin': 'admin_dashboard',
@@ -59,74 +143,73 @@ def create_dashboard_route(role):
     dashboard.__name__ = f"{role}_dashboard"
     return dashboard
 
-@app.route('/user/info')
 @login_required
 def user_info():
-    user_id = current_user.UserID
-    with db_manager.get_db() as db:
-        if user := db.query(User).get(user_id):
-            user_data = {
-                "id": user.UserID,
-                "username": user.Username,
-                "role": user.Role
-            }
-        else:
-            return abort(404, description="User not found")
+    # current_user comes from the session cache, so this needs no database access
+    user_data = {
+        "id": current_user.UserID,
+        "username": current_user.Username,
+        "role": current_user.Role
+    }
     return jsonify(user_data)
 
 # Home page route
-@app.route('/')
 def index():
     return render_template('index.html')
 
-# User loader function for Flask-Login (using imported function)
-@app.login_manager.user_loader
-def load_user(user_id):
-    return db_manager.load_user(user_id)
+# User loader for Flask-Login: the stored id is a session id resolved from the session cache
+def load_user(session_id):
+    return session_cache.resolve(session_id, get_db_manager().load_user)
 
 # Login page route
-@app.route('/login_page')
 def login_page():
     return render_template('login.html')
 
 # Logout route
-@app.route('/logout')
 @login_required
 def logout():
+    session_cache.discard(current_user.get_id())
     logout_user()
     return redirect(url_for('login_page'))
 
-# Dashboard routes (using helper function)
-app.route('/dashboard/admin')(create_dashboard_route('admin'))
-app.route('/dashboard/doctors')(create_dashboard_route('doctor'))
-app.route('/dashboard/patients')(create_dashboard_route('patient'))
-
-# Create user page route 
-@app.route('/register/users')
+# Create user page route
 @login_required
 def create_user():
     return render_template('create_user.html')
 
-# Create patients page route 
-@app.route('/register/patients')
+# Create patients page route
 @login_required
 def create_patient():
     return render_template('create_patient.html')
-# Create doctors page route 
-@app.route('/register/doctors')
+# Create doctors page route
 @login_required
 def create_doctor():
     return render_template('create_doctor.html')
-# Create prescription page route 
-@app.route('/insert/prescriptions')
+# Create prescription page route
 @login_required
 def create_prescription():
     return render_template('create_prescription.html')
 
+# Startup timing breakdown
+@login_required
+def startup_report():
+    if current_user.Role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    return jsonify({
+        'timings_ms': startup_timings,
+        'target_ms': app_config.COLD_START_TARGET_MS,
+        'within_target': startup_timings.get('total', 0) <= app_config.COLD_START_TARGET_MS
+    }), 200
+
+
+app = create_app()
+
 
 # Main function
 if __name__ == '__main__':
+    # Bootstrap before listening so the node is ready when its port opens
+    bootstrap(app)
     debug_mode = app_config.DEBUG
     #host = os.environ.get('HOST', '0.0.0.0')
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=debug_mode)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=debug_mode)
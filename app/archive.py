@@ -0,0 +1,276 @@
+#archive.py
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import datetime
+import threading
+from sqlalchemy import func
+from config import Config
+from metrics import registry
+from models import Appointment, Prescription, Billing
+from cache import table_versions
+
+ARCHIVED_ROWS = registry.counter('archive_rows_moved_total', 'Rows moved from the hot database into period archives by table')
+ARCHIVE_READS = registry.counter('archive_reads_total', 'Queries answered from period archives by table')
+HOT_DB_BYTES = registry.gauge('hot_db_bytes', 'Size of the hot SQLite database, excluding free pages')
+
+# table -> (model, id column, date column the age is measured on, whether the chart orders by that date)
+ARCHIVED_TABLES = {
+    'appointments': (Appointment, 'AppointmentID', 'StartTime', True),
+    'prescriptions': (Prescription, 'PrescriptionID', 'PrescribedAt', False),
+    'billings': (Billing, 'BillingID', 'DateOfBilling', True),
+}
+
+
+def period_of(value):
+    """Archive period of a date: 'YYYY', or 'YYYY-MM' with ARCHIVE_PERIOD = 'month'."""
+    return value.strftime('%Y-%m' if Config.ARCHIVE_PERIOD == 'month' else '%Y')
+
+
+class ArchiveStore:
+    """
+    Cold rows of the append-mostly tables, one SQLite file per period.
+
+    Rows older than ARCHIVE_AFTER_DAYS are copied into the file of their
+    period as zlib-compressed row images, indexed by patient, and then
+    deleted from the hot database, which keeps its working set small. Reads
+    attach the period files read-only to a per-thread in-memory connection,
+    so archived rows stay queryable without ever being opened for writing
+    outside archive(). Archiving is a local storage decision: it is not
+    recorded in the change log and is not replicated.
+    """
+
+    def __init__(self, db_manager, directory=None):
+        self.db_manager = db_manager
+        self.directory = directory or Config.ARCHIVE_DIR
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._periods = None
+
+    def _path(self, period):
+        return os.path.join(self.directory, f"{period}.db")
+
+    def periods(self):
+        """Archive periods on disk, newest first."""
+        if self._periods is None:
+            with self._lock:
+                if self._periods is None:
+                    names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+                    self._periods = sorted((name[:-3] for name in names if name.endswith('.db')), reverse=True)
+        return self._periods
+
+    # Read path
+
+    def _hub(self):
+        hub = getattr(self._local, 'hub', None)
+        if hub is None:
+            hub = self._local.hub = sqlite3.connect(':memory:', uri=True, check_same_thread=False)
+            self._local.attached = {}
+        return hub
+
+    def _attach(self, period):
+        hub = self._hub()
+        attached = self._local.attached
+        if period in attached:
+            return attached[period]
+        if len(attached) >= Config.ARCHIVE_MAX_ATTACHED:
+            # SQLite caps attached databases; drop the oldest period this thread attached
+            oldest = min(attached)
+            hub.execute(f'DETACH DATABASE "{attached.pop(oldest)}"')
+        alias = f"cold_{period.replace('-', '_')}"
+        hub.execute(f'ATTACH DATABASE ? AS "{alias}"', (f"file:{self._path(period)}?mode=ro",))
+        attached[period] = alias
+        return alias
+
+    def patient_rows(self, table, patient_id, exclude=()):
+        """
+        Archived row dicts of one patient, in chart order (newest period first).
+
+        Rows whose ids are in `exclude` are skipped: a crash between the
+        archive insert and the hot delete leaves a row in both places until
+        the next run, and the hot copy is the one shown.
+        """
+        rows = []
+        for period in self.periods():
+            alias = self._attach(period)
+            try:
+                result = self._hub().execute(
+                    f'SELECT "ID", "Row" FROM "{alias}".{table} WHERE "PatientID" = ? ORDER BY "SortKey" DESC, "ID" DESC',
+                    (patient_id,)
+                ).fetchall()
+            except sqlite3.OperationalError:
+                continue  # this period has no rows of the table
+            rows.extend(json.loads(zlib.decompress(image)) for row_id, image in result if row_id not in exclude)
+        if rows:
+            ARCHIVE_READS.inc(table=table)
+        return rows
+
+    def contains(self, table, row_id):
+        """True if the row with this id has been archived."""
+        for period in self.periods():
+            alias = self._attach(period)
+            try:
+                if self._hub().execute(f'SELECT 1 FROM "{alias}".{table} WHERE "ID" = ?', (row_id,)).fetchone():
+                    return True
+            except sqlite3.OperationalError:
+                continue
+        return False
+
+    def billing_rows(self, exclude=()):
+        """(DateOfBilling, DepartmentID, PaymentStatus, TotalCost) of every archived billing not in `exclude`, for rollup rebuilds."""
+        for period in self.periods():
+            alias = self._attach(period)
+            try:
+                result = self._hub().execute(f'SELECT "ID", "Row" FROM "{alias}".billings')
+            except sqlite3.OperationalError:
+                continue
+            for row_id, image in result:
+                if row_id in exclude:
+                    continue
+                row = json.loads(zlib.decompress(image))
+                yield row['DateOfBilling'], row['DepartmentID'], row['PaymentStatus'], row['TotalCost']
+
+    # Write path
+
+    def _open_for_write(self, period):
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(self._path(period))
+        for table in ARCHIVED_TABLES:
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ('
+                '"ID" INTEGER PRIMARY KEY, "PatientID" TEXT, "SortKey" TEXT, "Row" BLOB NOT NULL)'
+            )
+            conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_PatientID ON {table} ("PatientID", "SortKey")')
+        return conn
+
+    def archive(self, before=None):
+        """
+        Moves rows dated before `before` (default: ARCHIVE_AFTER_DAYS ago) into their period files.
+
+        Each batch is committed to the archive before it is deleted from the
+        hot database, so a crash in between leaves a copy in both places and
+        the next run finishes the move.
+        """
+        started = time.perf_counter()
+        before = before or datetime.datetime.utcnow() - datetime.timedelta(days=Config.ARCHIVE_AFTER_DAYS)
+        moved, touched = {}, set()
+        for table, (model, id_name, date_name, sort_by_date) in ARCHIVED_TABLES.items():
+            id_column, date_column = getattr(model, id_name), getattr(model, date_name)
+            cutoff = before.date() if date_name == 'DateOfBilling' else before
+            moved[table] = 0
+            with self.db_manager.get_db() as db:
+                # SQLite hands out max(id) + 1, so the row holding the highest id stays
+                # hot; otherwise a new row could reuse the id of an archived one
+                top_id = db.query(func.max(id_column)).scalar() or 0
+            while True:
+                with self.db_manager.get_db() as db:
+                    rows = (
+                        db.query(model)
+                        .filter(date_column.isnot(None), date_column < cutoff, id_column < top_id)
+                        .order_by(id_column)
+                        .limit(Config.ARCHIVE_BATCH_SIZE)
+                        .all()
+                    )
+                    batches = {}
+                    for row in rows:
+                        date = getattr(row, date_name)
+                        batches.setdefault(period_of(date), []).append((
+                            getattr(row, id_name),
+                            row.PatientID,
+                            date.isoformat() if sort_by_date else '',
+                            zlib.compress(json.dumps(row.to_dict()).encode(), Config.ARCHIVE_COMPRESSION_LEVEL)
+                        ))
+                if not rows:
+                    break
+                for period, images in batches.items():
+                    conn = self._open_for_write(period)
+                    try:
+                        with conn:
+                            conn.executemany(f'INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?)', images)
+                    finally:
+                        conn.close()
+                    touched.add(period)
+                ids = [image[0] for images in batches.values() for image in images]
+                self.db_manager.writer.execute(self._delete_op, model, id_column, ids)
+                moved[table] += len(ids)
+                ARCHIVED_ROWS.inc(len(ids), table=table)
+            if moved[table]:
+                table_versions.bump(table)
+
+        with self._lock:
+            self._periods = None
+        logging.info(f"Archived {moved} before {before.isoformat()} in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return {'before': before.isoformat(), 'moved': moved, 'periods': sorted(touched)}
+
+    @staticmethod
+    def _delete_op(db, model, id_column, ids):
+        db.query(model).filter(id_column.in_(ids)).delete(synchronize_session=False)
+
+    def compact(self):
+        """
+        Returns free pages of the hot database to the filesystem without taking it offline.
+
+        Pages are released in steps of ARCHIVE_VACUUM_STEP_PAGES, each in its
+        own short write transaction, so writers interleave with compaction.
+        A database created before incremental auto-vacuum was enabled needs
+        one full VACUUM first, which blocks writers while it runs.
+        """
+        started = time.perf_counter()
+        engine = self.db_manager.engine
+        with engine.connect() as conn:
+            auto_vacuum = conn.exec_driver_sql('PRAGMA auto_vacuum').scalar()
+        if auto_vacuum != 2:
+            raw = engine.raw_connection()
+            try:
+                cursor = raw.cursor()
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                cursor.execute('VACUUM')
+                cursor.close()
+            finally:
+                raw.close()
+            logging.warning('Hot database rewritten once by VACUUM to enable incremental auto-vacuum')
+            return {'mode': 'full', 'freed_pages': None, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)}
+
+        freed = 0
+        while True:
+            with engine.connect() as conn:
+                free = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+                if not free:
+                    break
+                # Each result row is one freed page; the pragma only runs as far as it is stepped
+                conn.exec_driver_sql(f'PRAGMA incremental_vacuum({Config.ARCHIVE_VACUUM_STEP_PAGES})').fetchall()
+                conn.commit()
+            freed += min(free, Config.ARCHIVE_VACUUM_STEP_PAGES)
+            time.sleep(Config.ARCHIVE_VACUUM_PAUSE_MS / 1000)
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        return {'mode': 'incremental', 'freed_pages': freed, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)}
+
+    def status(self):
+        with self.db_manager.engine.connect() as conn:
+            page_size = conn.exec_driver_sql('PRAGMA page_size').scalar()
+            page_count = conn.exec_driver_sql('PRAGMA page_count').scalar()
+            free_pages = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+        hot_bytes = (page_count - free_pages) * page_size
+        HOT_DB_BYTES.set(hot_bytes)
+
+        periods = []
+        for period in self.periods():
+            alias = self._attach(period)
+            counts = {}
+            for table in ARCHIVED_TABLES:
+                try:
+                    counts[table] = self._hub().execute(f'SELECT COUNT(*) FROM "{alias}".{table}').fetchone()[0]
+                except sqlite3.OperationalError:
+                    counts[table] = 0
+            periods.append({'period': period, 'bytes': os.path.getsize(self._path(period)), 'rows': counts})
+        return {
+            'hot': {'bytes': hot_bytes, 'free_bytes': free_pages * page_size},
+            'after_days': Config.ARCHIVE_AFTER_DAYS,
+            'period': Config.ARCHIVE_PERIOD,
+            'periods': periods
+        }
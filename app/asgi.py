@@ -0,0 +1,33 @@
+# asgi.py
+#
+# ASGI entrypoint, e.g. `uvicorn asgi:application --app-dir app --port 8081`.
+# Flask itself stays WSGI; the async views still run their database calls on
+# the dedicated executor and fan replication out to all peers concurrently.
+
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from config import Config
+from app import app
+
+# asgiref runs WSGI calls thread-sensitively, on one thread for the whole process,
+# so a single long-poll or stream would hold up every other request. Requests run
+# on this pool instead; one waiting in admission control or streaming holds a thread.
+_request_executor = ThreadPoolExecutor(max_workers=Config.ASGI_REQUEST_THREADS, thread_name_prefix='request')
+
+
+class _PooledWsgiInstance(WsgiToAsgiInstance):
+    _run_wsgi_app = WsgiToAsgiInstance.__dict__['run_wsgi_app'].__wrapped__
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._run_wsgi_app, thread_sensitive=False, executor=_request_executor)(body)
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that serves requests concurrently on a bounded thread pool."""
+
+    async def __call__(self, scope, receive, send):
+        await _PooledWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+application = PooledWsgiToAsgi(app)
@@ -0,0 +1,243 @@
+#auth.py
+
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from config import Config
+from metrics import registry
+
+KDF_DURATION = registry.histogram('auth_kdf_duration_seconds', 'Password KDF time, including queueing, by operation')
+KDF_REJECTED = registry.counter('auth_kdf_rejected_total', 'KDF requests rejected because the worker pool was saturated')
+SESSION_CACHE_LOOKUPS = registry.counter('auth_session_cache_lookups_total', 'Session cache lookups by result')
+
+
+class AuthBusyError(Exception):
+    """Raised when the KDF worker pool is saturated and the caller should retry later."""
+    pass
+
+
+def has_replication_token(headers):
+    """True if the request carries the configured replication token; always False when none is configured."""
+    token = Config.REPLICATION_TOKEN
+    presented = headers.get('X-Replication-Token')
+    if not token or presented is None:
+        return False
+    return hmac.compare_digest(presented.encode('utf-8'), token.encode('utf-8'))
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+
+class PasswordHasher:
+    """
+    scrypt password hashing on a bounded worker pool.
+
+    Hashes are stored as ``scrypt$<n>$<r>$<p>$<salt>$<hash>``. Unsalted
+    SHA-256 digests written by older versions still verify and are reported
+    as needing a rehash. Stored hashes may come from peers, so their cost
+    parameters are checked against max_n, max_r and max_p before use.
+    """
+
+    PREFIX = 'scrypt'
+
+    def __init__(self, n, r, p, workers, queue_limit, timeout, max_n=None, max_r=None, max_p=None):
+        self.n = n
+        self.r = r
+        self.p = p
+        self.max_n = max(max_n or n, n)
+        self.max_r = max(max_r or r, r)
+        self.max_p = max(max_p or p, p)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._workers = workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _submit(self, operation, func, *args):
+        if not self._slots.acquire(blocking=False):
+            KDF_REJECTED.inc()
+            raise AuthBusyError('Password hashing pool is saturated')
+        started = time.perf_counter()
+        try:
+            future = self._get_executor().submit(func, *args)
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError as e:
+            raise AuthBusyError('Password hashing timed out') from e
+        finally:
+            self._slots.release()
+            KDF_DURATION.observe(time.perf_counter() - started, operation=operation)
+
+    def _get_executor(self):
+        # Created on first use so importing this module starts no threads
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='kdf')
+        return self._executor
+
+    def _derive(self, password, salt, n, r, p):
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=32)
+
+    def _hash(self, password):
+        salt = secrets.token_bytes(16)
+        derived = self._derive(password, salt, self.n, self.r, self.p)
+        return f"{self.PREFIX}${self.n}${self.r}${self.p}${_b64encode(salt)}${_b64encode(derived)}"
+
+    def _parse(self, stored):
+        # ValueError (binascii.Error included) for a malformed hash or out-of-bounds cost
+        _, n, r, p, salt, expected = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        if not (2 <= n <= self.max_n and n & (n - 1) == 0 and 1 <= r <= self.max_r and 1 <= p <= self.max_p):
+            raise ValueError(f"scrypt parameters n={n} r={r} p={p} are outside the configured bounds")
+        return n, r, p, base64.b64decode(salt, validate=True), base64.b64decode(expected, validate=True)
+
+    def is_valid(self, stored):
+        """True if `stored` is a hash this node would verify: scrypt within bounds, or a legacy digest."""
+        if isinstance(stored, bytes):
+            return len(stored) == hashlib.sha256().digest_size
+        if not isinstance(stored, str) or not stored.startswith(self.PREFIX + '$'):
+            return False
+        try:
+            self._parse(stored)
+        except ValueError:
+            return False
+        return True
+
+    def _verify(self, password, stored):
+        if isinstance(stored, str) and stored.startswith(self.PREFIX + '$'):
+            try:
+                n, r, p, salt, expected = self._parse(stored)
+            except ValueError as e:
+                logging.warning(f"Refused to verify against a stored password hash: {e}")
+                return False, False
+            derived = self._derive(password, salt, n, r, p)
+            matches = hmac.compare_digest(derived, expected)
+            return matches, matches and (n, r, p) != (self.n, self.r, self.p)
+        # Legacy unsalted SHA-256 digest, stored as a blob
+        if not isinstance(stored, bytes):
+            return False, False
+        digest = hashlib.sha256(password.encode('utf-8')).digest()
+        matches = hmac.compare_digest(digest, stored)
+        return matches, matches
+
+    def hash(self, password):
+        if not password:
+            return None
+        return self._submit('hash', self._hash, password)
+
+    def verify(self, password, stored):
+        """Returns (matches, needs_rehash)."""
+        if not password or not stored:
+            return False, False
+        return self._submit('verify', self._verify, password, stored)
+
+
+class SessionUser:
+    """Authenticated principal resolved from the session cache, without an ORM object."""
+
+    def __init__(self, session_id, user_id, username, role):
+        self.session_id = session_id
+        self.UserID = user_id
+        self.Username = username
+        self.Role = role
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def get_id(self):
+        return self.session_id
+
+    def __repr__(self):
+        return f"<SessionUser(Username={self.Username}, Role={self.Role})>"
+
+
+class SessionCache:
+    """
+    LRU cache of verified sessions keyed by session id.
+
+    Session ids have the form ``<UserID>:<token>`` and are stored by
+    Flask-Login in the signed session cookie, so a cache hit resolves
+    current_user with no database round-trip. A miss (another process, a
+    restart or an evicted entry) falls back to one user lookup.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, session_user):
+        with self._lock:
+            self._entries[session_user.session_id] = (session_user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(session_user.session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return session_user
+
+    def create(self, user):
+        session_id = f"{user.UserID}:{secrets.token_urlsafe(24)}"
+        return self._store(SessionUser(session_id, user.UserID, user.Username, user.Role))
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(session_id)
+                SESSION_CACHE_LOOKUPS.inc(result='hit')
+                return entry[0]
+            if entry is not None:
+                del self._entries[session_id]
+        SESSION_CACHE_LOOKUPS.inc(result='miss')
+        return None
+
+    def resolve(self, session_id, load_user):
+        """Returns the cached SessionUser, restoring it through load_user(user_id) on a miss."""
+        if session_user := self.get(session_id):
+            return session_user
+        user_id, separator, _ = session_id.partition(':')
+        if not separator:
+            return None
+        user = load_user(user_id)
+        if user is None:
+            return None
+        return self._store(SessionUser(session_id, user.UserID, user.Username, user.Role))
+
+    def discard(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def invalidate_user(self, user_id):
+        prefix = f"{user_id}:"
+        with self._lock:
+            for session_id in [sid for sid in self._entries if sid.startswith(prefix)]:
+                del self._entries[session_id]
+
+    def on_changes(self, changes):
+        # Change log listener: drop sessions of users that were updated or deleted
+        for change in changes:
+            if change['table'] == 'users' and change['operation'] in ('update', 'delete'):
+                self.invalidate_user(change['row_id'])
+                logging.info(f"Invalidated cached sessions for user {change['row_id']}")
+
+
+password_hasher = PasswordHasher(
+    n=Config.AUTH_SCRYPT_N,
+    r=Config.AUTH_SCRYPT_R,
+    p=Config.AUTH_SCRYPT_P,
+    max_n=Config.AUTH_SCRYPT_MAX_N,
+    max_r=Config.AUTH_SCRYPT_MAX_R,
+    max_p=Config.AUTH_SCRYPT_MAX_P,
+    workers=Config.AUTH_KDF_WORKERS,
+    queue_limit=Config.AUTH_KDF_QUEUE_LIMIT,
+    timeout=Config.AUTH_KDF_TIMEOUT_SECONDS
+)
+session_cache = SessionCache(Config.SESSION_CACHE_SIZE, Config.SESSION_CACHE_TTL_SECONDS)
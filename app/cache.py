@@ -0,0 +1,155 @@
+#cache.py
+
+import hashlib
+import secrets
+import datetime
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request, make_response
+from flask_login import current_user
+from config import Config
+from metrics import registry
+
+RESPONSE_CACHE_LOOKUPS = registry.counter('response_cache_lookups_total', 'Response cache lookups by result')
+RESPONSE_CACHE_BYTES = registry.gauge('response_cache_bytes', 'Bytes held by the response cache')
+
+# ETags from a previous process must never validate against this one
+BOOT_ID = secrets.token_hex(8)
+
+
+class TableVersions:
+    """Per-table change counters and last-modified times, bumped from the change log."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        self._versions = {}
+
+    def bump(self, table):
+        now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        with self._lock:
+            version, _ = self._versions.get(table, (0, self._started))
+            self._versions[table] = (version + 1, now)
+
+    def snapshot(self, tables):
+        """Returns (versions tuple, latest last-modified) for the given tables."""
+        with self._lock:
+            entries = [self._versions.get(table, (0, self._started)) for table in tables]
+        return tuple(version for version, _ in entries), max(modified for _, modified in entries)
+
+    def on_changes(self, changes):
+        for table in {change['table'] for change in changes}:
+            self.bump(table)
+
+
+class ResponseCache:
+    """LRU cache of rendered response bodies, bounded by total body size."""
+
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['etag'] != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, etag, body, mimetype, status):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if old := self._entries.pop(key, None):
+                self._size -= len(old['body'])
+            self._entries[key] = {'etag': etag, 'body': body, 'mimetype': mimetype, 'status': status}
+            self._size += len(body)
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted['body'])
+            RESPONSE_CACHE_BYTES.set(self._size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            RESPONSE_CACHE_BYTES.set(0)
+
+
+table_versions = TableVersions()
+response_cache = ResponseCache(Config.RESPONSE_CACHE_MAX_BYTES, Config.RESPONSE_CACHE_MAX_ENTRY_BYTES)
+
+
+def _tee_into_cache(chunks, key, etag, mimetype):
+    # Stores a streamed body once it has been sent in full, unless it outgrows an entry
+    parts, size = [], 0
+    for chunk in chunks:
+        if parts is not None:
+            data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            size += len(data)
+            if size > response_cache.max_entry_bytes:
+                parts = None
+            else:
+                parts.append(data)
+        yield chunk
+    if parts is not None:
+        response_cache.put(key, etag, b''.join(parts), mimetype, 200)
+
+
+def _not_modified(etag, last_modified):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+
+def cached_response(*tables):
+    """
+    Caches a GET view per route, arguments, query string and role.
+
+    The ETag is derived from the change counters of `tables`, so a matching
+    If-None-Match is answered with 304 before the view or the database is
+    touched. If-Modified-Since alone is not trusted to revalidate.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions, last_modified = table_versions.snapshot(tables)
+            key = (
+                request.endpoint,
+                tuple(sorted(kwargs.items())),
+                tuple(sorted(request.args.items(multi=True))),
+                getattr(current_user, 'Role', None)
+            )
+            etag = hashlib.sha1(repr((BOOT_ID, key, versions)).encode('utf-8')).hexdigest()
+
+            # Last-Modified has whole-second resolution, so a write in the same second as
+            # the client's copy would still match If-Modified-Since; only the ETag validates
+            if request.if_none_match and request.if_none_match.contains(etag):
+                RESPONSE_CACHE_LOOKUPS.inc(result='not_modified')
+                return _not_modified(etag, last_modified)
+
+            if entry := response_cache.get(key, etag):
+                RESPONSE_CACHE_LOOKUPS.inc(result='hit')
+                response = make_response(entry['body'], entry['status'])
+                response.mimetype = entry['mimetype']
+            else:
+                RESPONSE_CACHE_LOOKUPS.inc(result='miss')
+                response = make_response(current_app.ensure_sync(view)(*args, **kwargs))
+                if response.status_code == 200 and response.is_streamed:
+                    response.response = _tee_into_cache(response.response, key, etag, response.mimetype)
+                elif response.status_code == 200:
+                    response_cache.put(key, etag, response.get_data(), response.mimetype, response.status_code)
+
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
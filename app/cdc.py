@@ -0,0 +1,131 @@
+#cdc.py
+
+import json
+import logging
+import datetime
+import threading
+from sqlalchemy import func, inspect
+from config import Config
+from models import ChangeLogEntry, ChangeConsumer
+
+# Columns that must never leave the node through the changes feed
+EXCLUDED_COLUMNS = {'Password'}
+
+
+def row_image(obj):
+    """Returns a JSON-safe dict of the mapped columns of an ORM object."""
+    image = {}
+    for attr in inspect(obj).mapper.column_attrs:
+        if attr.key in EXCLUDED_COLUMNS:
+            continue
+        value = getattr(obj, attr.key)
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        image[attr.key] = value
+    return image
+
+
+class ChangeLog:
+    """
+    Ordered change-data-capture log for this node.
+
+    Entries are written in the same transaction as the row they describe, so
+    the log never contains a change that was rolled back. Consumers tail the
+    log with read()/wait_for() and acknowledge positions with ack(); segments
+    acknowledged by every consumer are removed by compact().
+    """
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.segment_size = Config.CDC_SEGMENT_SIZE
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """Registers a callable invoked with the list of changes after every commit."""
+        self._listeners.append(listener)
+
+    def record(self, db, table, operation, row_id, image=None):
+        """Adds a change entry to the session; it is persisted by the caller's commit."""
+        entry = ChangeLogEntry(
+            TableName=table,
+            Operation=operation,
+            RowID=str(row_id),
+            RowImage=json.dumps(image) if image is not None else None,
+            CreatedAt=datetime.datetime.utcnow()
+        )
+        db.add(entry)
+        db.info.setdefault('pending_changes', []).append({
+            'table': table,
+            'operation': operation,
+            'row_id': str(row_id),
+            'row': image
+        })
+
+    def publish(self, changes):
+        """Wakes up waiting consumers and notifies listeners once changes are committed."""
+        if not changes:
+            return
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+        for listener in self._listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                logging.error(f"Change listener failed: {e}")
+
+    def read(self, since=0, limit=None):
+        limit = limit or Config.CDC_BATCH_SIZE
+        with self.db_manager.get_db() as db:
+            entries = (
+                db.query(ChangeLogEntry)
+                .filter(ChangeLogEntry.Seq > since)
+                .order_by(ChangeLogEntry.Seq)
+                .limit(limit)
+                .all()
+            )
+            return [entry.to_dict() for entry in entries]
+
+    def wait_for(self, since=0, timeout=0, limit=None):
+        """Long-poll read: blocks up to `timeout` seconds until changes after `since` exist."""
+        with self._cond:
+            generation = self._generation
+        changes = self.read(since, limit)
+        if changes or timeout <= 0:
+            return changes
+        with self._cond:
+            self._cond.wait_for(lambda: self._generation != generation, timeout)
+        return self.read(since, limit)
+
+    def latest_seq(self):
+        with self.db_manager.get_db() as db:
+            return db.query(func.max(ChangeLogEntry.Seq)).scalar() or 0
+
+    def ack(self, consumer_id, seq):
+        with self.db_manager.get_db() as db:
+            consumer = db.query(ChangeConsumer).filter(ChangeConsumer.ConsumerID == consumer_id).one_or_none()
+            if consumer is None:
+                consumer = ChangeConsumer(ConsumerID=consumer_id, AckedSeq=0)
+                db.add(consumer)
+            # Acknowledgements only move forward
+            consumer.AckedSeq = max(consumer.AckedSeq or 0, seq)
+            consumer.UpdatedAt = datetime.datetime.utcnow()
+            db.commit()
+        return self.compact()
+
+    def compact(self):
+        """Deletes whole segments that every registered consumer has acknowledged."""
+        with self.db_manager.get_db() as db:
+            min_acked = db.query(func.min(ChangeConsumer.AckedSeq)).scalar()
+            if not min_acked:
+                return 0
+            boundary = (min_acked // self.segment_size) * self.segment_size
+            if boundary <= 0:
+                return 0
+            deleted = db.query(ChangeLogEntry).filter(ChangeLogEntry.Seq <= boundary).delete(synchronize_session=False)
+            db.commit()
+        if deleted:
+            logging.info(f"Compacted {deleted} change log entries up to seq {boundary}")
+        return deleted
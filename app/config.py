@@ -3,19 +3,136 @@
 import os
 import logging
 
+def _env_list(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return [item.strip() for item in value.split(',') if item.strip()]
+
 class Config:
-    SQLALCHEMY_DATABASE_URI = "sqlite:///data/ntsoekhe.db"
-    #SECRET_KEY = os.urandom(32)
+    DEBUG = False
+    # Every setting below can be overridden per node through the environment,
+    # which is how the benchmark harness runs several nodes on one host
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', "sqlite:///data/ntsoekhe.db")
+    SECRET_KEY = os.environ.get('SECRET_KEY') or os.urandom(32)
     SQLALCHEMY_TRACK_MODIFICATIONS = False       
     REQUEST_CACHE_EXPIRY_SECONDS = 300 
-    DATA_DIR = "data" 
-    NODES = [
+    DATA_DIR = os.environ.get('DATA_DIR', "data")
+    NODES = _env_list('NODES', [
         #'http://172.0.0.1:8081',
         'http://172.0.0.2:8082',
         'http://172.0.0.3:8083',
         'http://172.0.0.4:8084',
         'http://172.0.0.5:8085'
-    ]
+    ])
+    # Shared secret peers present on /replicate instead of a login session; there is
+    # deliberately no default, and without one only logged-in admins reach those routes
+    REPLICATION_TOKEN = os.environ.get('REPLICATION_TOKEN') or None
+    REPLICATION_TIMEOUT_SECONDS = 5
+    # Prefix of the origin id for sequence numbers (default: host name); a random suffix is added per database
+    NODE_ID = os.environ.get('NODE_ID')
+    # Outgoing operations kept for resending to peers that report a gap
+    REPLICATION_LOG_RETENTION = int(os.environ.get('REPLICATION_LOG_RETENTION', 100000))
+    REPLICATION_LOG_TRIM_EVERY = 1000
+    REPLICATION_RESEND_BATCH = 500
+    REPLICATION_RESEND_GRACE_SECONDS = 2
+    # Out-of-order messages held per origin until the gap before them is filled
+    REPLICATION_REORDER_BUFFER = 10000
+    # Replicated payloads contain patient data; only log them when explicitly asked to
+    LOG_REPLICATION_PAYLOADS = os.environ.get('LOG_REPLICATION_PAYLOADS', '0') == '1'
+    # Opt-in SQL profiler (admin view at /admin/profiler)
+    QUERY_PROFILING = os.environ.get('QUERY_PROFILING', '0') == '1'
+    PROFILER_EXPLAIN = os.environ.get('PROFILER_EXPLAIN', '0') == '1'
+    PROFILER_TOP_N = 20
+    PROFILER_SLOW_QUERY_MS = 50
+    PROFILER_N_PLUS_ONE_THRESHOLD = 5
+    # Password KDF (scrypt) and verified-session cache
+    AUTH_SCRYPT_N = int(os.environ.get('AUTH_SCRYPT_N', 2 ** 14))
+    AUTH_SCRYPT_R = 8
+    AUTH_SCRYPT_P = 1
+    # Largest cost a stored (possibly replicated) hash may ask verification to pay
+    AUTH_SCRYPT_MAX_N = int(os.environ.get('AUTH_SCRYPT_MAX_N', max(2 ** 16, AUTH_SCRYPT_N)))
+    AUTH_SCRYPT_MAX_R = 16
+    AUTH_SCRYPT_MAX_P = 4
+    AUTH_KDF_WORKERS = int(os.environ.get('AUTH_KDF_WORKERS', 4))
+    AUTH_KDF_QUEUE_LIMIT = 64
+    AUTH_KDF_TIMEOUT_SECONDS = 10
+    SESSION_CACHE_SIZE = 10000
+    SESSION_CACHE_TTL_SECONDS = 3600
+    # Rendered list/dashboard responses
+    RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    RESPONSE_CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+    # Template rendering and response compression
+    STREAM_TEMPLATES = os.environ.get('STREAM_TEMPLATES', '1') == '1'
+    STREAM_BUFFER_ROWS = 50
+    # Compiled templates belong to this package, so a relative DATA_DIR is taken from app/, not the working directory
+    TEMPLATE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), DATA_DIR, 'template_cache')
+    COMPRESS_RESPONSES = True
+    COMPRESSION_LEVEL = 6
+    COMPRESSION_MIN_BYTES = 1024
+    CHART_MAX_PAGE_SIZE = 200
+    # Appointment scheduling; the maximum length bounds every overlap search
+    APPOINTMENT_DEFAULT_MINUTES = 30
+    APPOINTMENT_MAX_MINUTES = 8 * 60
+    SCHEDULE_DAY_START_HOUR = 8
+    SCHEDULE_DAY_END_HOUR = 17
+    SCHEDULE_SLOT_STEP_MINUTES = 15
+    SCHEDULE_MAX_DAYS = 31
+    SCHEDULE_INDEX_CACHE_SIZE = 2000
+    # Columnar patient/doctor snapshot for dashboard aggregates; off loads a fresh copy per query
+    ANALYTICS_SNAPSHOT = os.environ.get('ANALYTICS_SNAPSHOT', '1') == '1'
+    ANALYTICS_AGE_BANDS = (18, 30, 45, 65)
+    # Cold-data archival: old appointments, prescriptions and billings move to one read-only file per period
+    ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 730))
+    ARCHIVE_PERIOD = os.environ.get('ARCHIVE_PERIOD', 'year')  # 'year' or 'month'
+    ARCHIVE_BATCH_SIZE = 1000
+    ARCHIVE_COMPRESSION_LEVEL = 6
+    # SQLite attaches at most 10 databases per connection
+    ARCHIVE_MAX_ATTACHED = 8
+    ARCHIVE_VACUUM_STEP_PAGES = 256
+    ARCHIVE_VACUUM_PAUSE_MS = 5
+    # SQLite write path: WAL journal and group commit through a single writer thread
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', '1') == '1'
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+    WRITE_GROUP_MAX_OPS = int(os.environ.get('WRITE_GROUP_MAX_OPS', 64))
+    WRITE_GROUP_MAX_WAIT_MS = float(os.environ.get('WRITE_GROUP_MAX_WAIT_MS', 1))
+    WRITE_QUEUE_LIMIT = 2048
+    WRITE_TIMEOUT_SECONDS = 10
+    # Thread pool that runs database calls for async views
+    DB_EXECUTOR_WORKERS = int(os.environ.get('DB_EXECUTOR_WORKERS', 16))
+    # Requests served at once by the ASGI entrypoint (asgi.py), including idle long-polls and streams
+    ASGI_REQUEST_THREADS = int(os.environ.get('ASGI_REQUEST_THREADS', 128))
+    # Admission control: requests served at once, per class (max active, max queued, max wait seconds)
+    # and per-client token buckets (requests per second, burst)
+    ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1') == '1'
+    ADMISSION_MAX_ACTIVE = int(os.environ.get('ADMISSION_MAX_ACTIVE', 64))
+    ADMISSION_CLASS_LIMITS = {
+        'interactive': (64, 512, 5),
+        'write': (32, 256, 5),
+        'replication': (16, 512, 10),
+        'bulk': (4, 16, 2),
+        # /changes long-polls and streams: mostly idle, so capped on their own, outside ADMISSION_MAX_ACTIVE
+        'long_poll': (32, 64, 1),
+    }
+    ADMISSION_RATE_LIMITS = {
+        'interactive': (200, 400),
+        'write': (200, 400),
+        'replication': (2000, 4000),
+        'bulk': (5, 20),
+        'long_poll': (50, 100),
+    }
+    ADMISSION_MAX_CLIENTS = 10000
+    # Import to first request servable, measured by app.py and reported at /admin/startup
+    COLD_START_TARGET_MS = int(os.environ.get('COLD_START_TARGET_MS', 1500))
+    # Change-data-capture feed
+    CDC_BATCH_SIZE = 500
+    CDC_MAX_BATCH_SIZE = 5000
+    CDC_MAX_WAIT_SECONDS = 30
+    # A stream ends after this long, or after this long without a change; clients resume from their last seq
+    CDC_STREAM_MAX_SECONDS = int(os.environ.get('CDC_STREAM_MAX_SECONDS', 300))
+    CDC_STREAM_IDLE_SECONDS = int(os.environ.get('CDC_STREAM_IDLE_SECONDS', 120))
+    CDC_SEGMENT_SIZE = 1000
 
 class DevelopmentConfig(Config):
     DEBUG = True
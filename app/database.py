@@ -3,29 +3,116 @@
 from dateutil.parser import parse
 import socket
 import random
+import secrets
+import time
+import datetime
 import logging
 import sqlalchemy
 from sqlite3 import IntegrityError
+from sqlalchemy.exc import OperationalError
 from flask import jsonify
 from config import Config
-from flask_login import login_user
 from contextlib import contextmanager
-from sqlalchemy import create_engine, Table, Column, MetaData, Integer, String, ForeignKey
-from sqlalchemy.orm import sessionmaker
-from models import Base, Patient, Doctor, User, Prescription, Appointment, Department
-from exceptions import DatabaseIntegrityError, ValueError, TypeError
-import hashlib
+from sqlalchemy import create_engine, event, Table, Column, MetaData, Integer, String, ForeignKey
+from sqlalchemy.orm import sessionmaker, selectinload
+from models import Base, Patient, Doctor, User, Prescription, Appointment, Department, Billing, ReplicationPosition
+from reporting import apply_billing_delta, recompute_rollups, revenue_report
+from exceptions import DatabaseIntegrityError, ValueError, TypeError, AppointmentConflictError, InvalidRequestException, ArchivedRecordError
+from cdc import ChangeLog, row_image
+from metrics import track_db, POOL_CHECKOUT_WAIT
+from profiler import profiler
+from auth import password_hasher, session_cache
+from cache import table_versions
+from migrations import MigrationRunner, is_fresh_database, verify_query_plans
+from writer import WriteCoordinator, WriteBusyError
+from archive import ArchiveStore, ARCHIVED_TABLES
+from scheduling import parse_timestamp
+
+# Ids of rows that replicate with their id are drawn from this range rather than
+# the local autoincrement, so rows created on different nodes do not collide; it
+# starts above the autoincrement ids of older rows and stays exact in JSON numbers
+RECORD_ID_RANGE = (2 ** 32, 2 ** 53)
+
+def configure_sqlite(engine):
+    """
+    Enables WAL and makes SAVEPOINT usable on pysqlite connections.
+
+    pysqlite defers BEGIN until the first DML statement, which breaks
+    SAVEPOINT; its own transaction handling is turned off and BEGIN is
+    emitted by SQLAlchemy instead.
+    """
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {Config.SQLITE_BUSY_TIMEOUT_MS}')
+        # Only possible before the first table exists; ArchiveStore.compact() converts older files.
+        # Setting it on a populated file would contend for the write lock on every connect.
+        if cursor.execute('PRAGMA page_count').fetchone()[0] == 0:
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if Config.SQLITE_WAL:
+            # WAL lets readers proceed while the writer commits; NORMAL syncs at checkpoints only
+            cursor.execute('PRAGMA journal_mode = WAL')
+            cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def _on_begin(conn):
+        conn.exec_driver_sql('BEGIN')
 
    
 # Database manager class
 class DatabaseManager:
-    def __init__(self):
-        self.DATABASE_URL = Config.SQLALCHEMY_DATABASE_URI
+    def __init__(self, database_url=None):
+        self.DATABASE_URL = database_url or Config.SQLALCHEMY_DATABASE_URI
         self.NODE_ID = socket.gethostname()
         self.engine = create_engine(self.DATABASE_URL)
-        
+        if self.engine.dialect.name == 'sqlite':
+            configure_sqlite(self.engine)
+        self.change_log = ChangeLog(self)
+        self.archive = ArchiveStore(self)
+        self.writer = WriteCoordinator(
+            self,
+            max_batch=Config.WRITE_GROUP_MAX_OPS,
+            max_wait=Config.WRITE_GROUP_MAX_WAIT_MS / 1000,
+            queue_limit=Config.WRITE_QUEUE_LIMIT,
+            timeout=Config.WRITE_TIMEOUT_SECONDS
+        )
+        self.change_log.subscribe(session_cache.on_changes)
+        self.change_log.subscribe(table_versions.on_changes)
+        if Config.QUERY_PROFILING:
+            profiler.attach(self.engine)
+
     def create_tables(self):
+        fresh = is_fresh_database(self.engine)
         Base.metadata.create_all(self.engine)
+        self.run_migrations(stamp_only=fresh)
+        verify_query_plans(self.engine)
+
+    def ensure_schema(self):
+        """
+        create_tables(), skipped when the schema is already at the latest migration.
+
+        Returns 'current', 'created' or 'migrated'. New tables must ship with a
+        migration version so that an up-to-date database really has them.
+        """
+        fresh = is_fresh_database(self.engine)
+        if not fresh:
+            try:
+                if not MigrationRunner(self.engine).pending():
+                    return 'current'
+            except OperationalError:
+                pass  # predates schema_migrations
+        self.create_tables()
+        return 'created' if fresh else 'migrated'
+
+    def run_migrations(self, stamp_only=False):
+        # create_all() never alters existing tables; schema and index changes ship as migrations
+        runner = MigrationRunner(self.engine)
+        if stamp_only:
+            runner.stamp()
+            return []
+        return runner.run()
         
     def get_session(self):
         Session = sessionmaker(bind=self.engine)
@@ -35,21 +122,26 @@ class DatabaseManager:
     def get_db(self):
         db = self.get_session()
         try:
+            started = time.perf_counter()
+            db.connection()
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
             yield db
         finally:
             db.close()
+
+    def _record_change(self, db, table, operation, row_id, obj=None):
+        self.change_log.record(db, table, operation, row_id, row_image(obj) if obj is not None else None)
+
+    def _commit(self, db):
+        # Commits the session, then publishes the change log entries it carried
+        db.commit()
+        self.change_log.publish(db.info.pop('pending_changes', []))
+
     def hash_password(self, password):
-        try:
-            if password is None or password == '':
-                return None
-            password_bytes = password.encode('utf-8')
-            hash_object = hashlib.sha256()
-            hash_object.update(password_bytes)
-            return hash_object.digest()
-        except Exception as e:
-            print(f"Error occurred during password hashing: {e}")
-            return None
+        # Runs the KDF on the bounded auth worker pool
+        return password_hasher.hash(password)
             
+    @track_db
     def ensure_admin_user(self):
         with self.get_db() as db:
             admin_user = db.query(User).filter(User.Username == 'admin').one_or_none()
@@ -58,11 +150,13 @@ class DatabaseManager:
                 password = self.hash_password('admin123')
                 new_admin = User(admin_id, 'admin', password, 'admin') 
                 db.add(new_admin)
+                self._record_change(db, 'users', 'insert', admin_id, new_admin)
                 try:
-                    db.commit()
+                    self._commit(db)
                 except Exception as e:
                     print(f"Error occurred during commit: {e}")
   
+    @track_db
     def generate_user_id(self, role):
         prefix = {'admin': 'a', 'patient': 'p', 'doctor': 'd', 'nurse': 'n'}
         with self.get_db() as db:
@@ -71,124 +165,170 @@ class DatabaseManager:
                 if not db.query(User).filter(User.UserID == user_id).one_or_none():
                     return user_id
 
+    def _new_record_id(self, db, model):
+        column = model.__mapper__.primary_key[0]
+        low, high = RECORD_ID_RANGE
+        while True:
+            record_id = low + secrets.randbelow(high - low)
+            if db.query(column).filter(column == record_id).first() is None:
+                return record_id
+
+    @track_db
     def load_user(self, user_id):
         with self.get_db() as db:
             return db.query(User).get(user_id)
 
+    @track_db
     def insert_user(self, user):
-        with self.get_db() as db:
-            try:
-                if db.query(User).filter(User.Username == user['Username']).one_or_none():
-                    logging.error('Username already exists')
-                    return jsonify({'error': 'Username already exists'}), 400
-                user_id = user.get('UserID') or self.generate_user_id(user['Role'])
-                username = user['Username']
-                password = self.hash_password(user['Password'])
-                
-                role = user['Role']
-                new_user = User(user_id, username, password, role)
-                db.add(new_user)
-                db.commit()
-                logging.info(f"User inserted successfully. ID: {new_user.UserID}")
-                return new_user.UserID
-            except Exception as e:
-                logging.error(f"Error occurred during user insertion: {str(e)}")
-                return jsonify({'error': f"Error occurred during user insertion: {str(e)}"}), 505
+        try:
+            user_id = user.get('UserID') or self.generate_user_id(user['Role'])
+            # Replicated inserts carry the hash computed by the origin node; the KDF
+            # runs here, never on the writer thread
+            password = user.get('PasswordHash') or self.hash_password(user['Password'])
+            inserted_id = self.writer.execute(self._insert_user_op, user_id, user['Username'], password, user['Role'])
+            if inserted_id is None:
+                logging.error('Username already exists')
+                return jsonify({'error': 'Username already exists'}), 400
+            logging.info(f"User inserted successfully. ID: {inserted_id}")
+            return inserted_id
+        except WriteBusyError:
+            raise
+        except Exception as e:
+            logging.error(f"Error occurred during user insertion: {str(e)}")
+            return jsonify({'error': f"Error occurred during user insertion: {str(e)}"}), 505
+
+    def _insert_user_op(self, db, user_id, username, password, role):
+        # Replicated hashes are stored as received, so one with an unbounded cost is refused here
+        if not password_hasher.is_valid(password):
+            raise InvalidRequestException('PasswordHash is malformed or its scrypt parameters are out of bounds')
+        if db.query(User).filter(User.Username == username).one_or_none():
+            return None
+        new_user = User(user_id, username, password, role)
+        db.add(new_user)
+        db.flush()
+        self._record_change(db, 'users', 'insert', user_id, new_user)
+        return new_user.UserID
+
+    @track_db
     def insert_patient(self, patient):
-        with self.get_db() as db:
-            try:
-                patient_id = patient['PatientID']
-                name = patient['Name']
-                date_of_birth = parse(patient['DateOfBirth']).date()
-                gender = patient['Gender']
-                phone_number = patient['PhoneNumber']
-                
-                new_patient = Patient(patient_id, name, date_of_birth, gender, phone_number)
-                db.add(new_patient)
-                db.commit()
-                logging.info(f"Patient inserted successfully. ID: {new_patient.PatientID}")
-                return new_patient.PatientID
-            except IntegrityError as e:
-                raise DatabaseIntegrityError(
-                    f"Error creating patient (data integrity): {e}"
-                ) from e
-            except ValueError as e:
-                raise ValueError(f"Error creating patient: {str(e)}") from e
-            except Exception as e:
-                raise Exception(f"Error creating patient: {str(e)}") from e
-                
+        try:
+            patient_id = self.writer.execute(self._insert_patient_op, patient)
+            logging.info(f"Patient inserted successfully. ID: {patient_id}")
+            return patient_id
+        except IntegrityError as e:
+            raise DatabaseIntegrityError(
+                f"Error creating patient (data integrity): {e}"
+            ) from e
+        except ValueError as e:
+            raise ValueError(f"Error creating patient: {str(e)}") from e
+        except WriteBusyError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error creating patient: {str(e)}") from e
+
+    def _insert_patient_op(self, db, patient):
+        patient_id = patient['PatientID']
+        name = patient['Name']
+        date_of_birth = parse(patient['DateOfBirth']).date()
+        gender = patient['Gender']
+        phone_number = patient['PhoneNumber']
 
+        new_patient = Patient(patient_id, name, date_of_birth, gender, phone_number)
+        db.add(new_patient)
+        db.flush()
+        self._record_change(db, 'patients', 'insert', patient_id, new_patient)
+        return new_patient.PatientID
+
+    @track_db
     def insert_doctor(self, doctor_data):
-        with self.get_db() as db:
-            try:
-                department_id = db.query(Department.DepartmentID).filter(Department.DepartmentName == doctor_data['DepartmentName']).scalar()
-                new_doctor = Doctor(
-                    doctor_id=doctor_data.get('DoctorID'),
-                    name=doctor_data.get('DoctorName'),
-                    specialization=doctor_data.get('Specialization'),
-                    phone_number=doctor_data.get('PhoneNumber'),
-                    department_id=department_id
-                )
-                db.add(new_doctor)
-                db.commit()
-                logging.info(f"Doctor inserted successfully with ID: {new_doctor.DoctorID}")
-                return new_doctor.DoctorID
-            except IntegrityError as e:
-                logging.error(f"Error creating doctor (data integrity): {e}")
-                raise DatabaseIntegrityError(f"Error creating doctor (data integrity): {e}") from e
-            except ValueError as e:
-                logging.error(f"Error creating doctor: {str(e)}")
-                raise ValueError(f"Error creating doctor: {str(e)}") from e
-            except Exception as e:
-                logging.error(f"Error creating doctor: {str(e)}")
-                raise Exception(f"Error creating doctor: {str(e)}") from e
+        try:
+            doctor_id = self.writer.execute(self._insert_doctor_op, doctor_data)
+            logging.info(f"Doctor inserted successfully with ID: {doctor_id}")
+            return doctor_id
+        except IntegrityError as e:
+            logging.error(f"Error creating doctor (data integrity): {e}")
+            raise DatabaseIntegrityError(f"Error creating doctor (data integrity): {e}") from e
+        except ValueError as e:
+            logging.error(f"Error creating doctor: {str(e)}")
+            raise ValueError(f"Error creating doctor: {str(e)}") from e
+        except WriteBusyError:
+            raise
+        except Exception as e:
+            logging.error(f"Error creating doctor: {str(e)}")
+            raise Exception(f"Error creating doctor: {str(e)}") from e
 
+    def _insert_doctor_op(self, db, doctor_data):
+        department_id = db.query(Department.DepartmentID).filter(Department.DepartmentName == doctor_data['DepartmentName']).scalar()
+        new_doctor = Doctor(
+            doctor_id=doctor_data.get('DoctorID'),
+            name=doctor_data.get('DoctorName'),
+            specialization=doctor_data.get('Specialization'),
+            phone_number=doctor_data.get('PhoneNumber'),
+            department_id=department_id
+        )
+        db.add(new_doctor)
+        db.flush()
+        self._record_change(db, 'doctors', 'insert', new_doctor.DoctorID, new_doctor)
+        return new_doctor.DoctorID
 
+    @track_db
     def delete_patient(self, patient_id):
         try:
             if patient_id is None:
                 raise ValueError("Invalid patient ID")
-            with self.get_db() as db:
-                if (
-                    patient := db.query(Patient)
-                    .filter(Patient.PatientID == patient_id)
-                    .one_or_none()
-                ):
-                    db.delete(patient)
-                    db.commit()
-                    return jsonify({"message": "Deletion successful"}), 200
-                else:
-                    return jsonify({"error": "Patient not found"}), 404
+            if self.writer.execute(self._delete_patient_op, patient_id):
+                return jsonify({"message": "Deletion successful"}), 200
+            else:
+                return jsonify({"error": "Patient not found"}), 404
+        except WriteBusyError:
+            raise
         except Exception as e:
             print(f"Error occurred during patient deletion: {e}")
             return jsonify({"error": str(e)}), 500
-        
+
+    def _delete_patient_op(self, db, patient_id):
+        if patient := db.query(Patient).filter(Patient.PatientID == patient_id).one_or_none():
+            self._record_change(db, 'patients', 'delete', patient_id, patient)
+            db.delete(patient)
+            db.flush()
+            return True
+        return False
+
+    @track_db
     def delete_user(self, user_id):
         try:
             if user_id is None:
                 raise ValueError("Invalid patient ID")
-            with self.get_db() as db:
-                if (
-                    user := db.query(User)
-                    .filter(User.UserID == user_id)
-                    .one_or_none()
-                ):
-                    db.delete(user)
-                    db.commit()
-                    return jsonify({"message": "Deletion successful"}), 200
-                else:
-                    return jsonify({"error": "User not found"}), 404
+            if self.writer.execute(self._delete_user_op, user_id):
+                return jsonify({"message": "Deletion successful"}), 200
+            else:
+                return jsonify({"error": "User not found"}), 404
+        except WriteBusyError:
+            raise
         except Exception as e:
             print(f"Error occurred during User deletion: {e}")
             return jsonify({"error": str(e)}), 500
 
+    def _delete_user_op(self, db, user_id):
+        if user := db.query(User).filter(User.UserID == user_id).one_or_none():
+            self._record_change(db, 'users', 'delete', user_id, user)
+            db.delete(user)
+            db.flush()
+            return True
+        return False
+
+    @track_db
     def update_patient(self, patient_id, new_data):
-        with self.get_db() as db:
-            if patient := db.query(Patient).filter(Patient.PatientID == patient_id).one_or_none():
-                for key, value in new_data.items():
-                    setattr(patient, key, value)
-        db.commit()
+        self.writer.execute(self._update_patient_op, patient_id, new_data)
 
+    def _update_patient_op(self, db, patient_id, new_data):
+        if patient := db.query(Patient).filter(Patient.PatientID == patient_id).one_or_none():
+            for key, value in new_data.items():
+                setattr(patient, key, value)
+            db.flush()
+            self._record_change(db, 'patients', 'update', patient_id, patient)
+
+    @track_db
     def get_all_patients(self):
         try:
             with self.get_db() as db:
@@ -199,6 +339,18 @@ class DatabaseManager:
             logging.error(f"Error occurred during getting all patients: {e}")
             return []
 
+    def iter_patients(self, batch_size=500):
+        # Streams patients in batches instead of materializing the whole table
+        with self.get_db() as db:
+            for patient in db.query(Patient).yield_per(batch_size):
+                yield patient.to_dict()
+
+    @track_db
+    def patient_exists(self, patient_id):
+        with self.get_db() as db:
+            return db.query(Patient.PatientID).filter(Patient.PatientID == patient_id).first() is not None
+
+    @track_db
     def get_patient_by_id(self, patient_id):
         if patient_id is None:
             raise ValueError("Invalid patient ID")
@@ -219,13 +371,18 @@ class DatabaseManager:
                 print(f'Error occurred during get patient by id: {e}')
                 return jsonify({"error": str(e)}), 500
 
+    @track_db
     def update_doctor(self, doctor_id, new_data):
-        with self.get_db() as db:
-            if doctor := db.query(Doctor).filter(Doctor.id == doctor_id).one_or_none():
-                for key, value in new_data.items():
-                    setattr(doctor, key, value)
-        db.commit()
+        self.writer.execute(self._update_doctor_op, doctor_id, new_data)
+
+    def _update_doctor_op(self, db, doctor_id, new_data):
+        if doctor := db.query(Doctor).filter(Doctor.DoctorID == doctor_id).one_or_none():
+            for key, value in new_data.items():
+                setattr(doctor, key, value)
+            db.flush()
+            self._record_change(db, 'doctors', 'update', doctor_id, doctor)
 
+    @track_db
     def get_all_doctors(self):
         with self.get_db() as db:
             doctors = db.query(Doctor, Department.DepartmentName).join(Department, Doctor.DepartmentID == Department.DepartmentID).all()
@@ -245,69 +402,461 @@ class DatabaseManager:
                 serialized_doctors.append(serialized_doctor)
             return serialized_doctors
 
+    def iter_doctors(self, batch_size=500):
+        with self.get_db() as db:
+            doctors = (
+                db.query(Doctor, Department.DepartmentName)
+                .join(Department, Doctor.DepartmentID == Department.DepartmentID)
+                .yield_per(batch_size)
+            )
+            for doctor, department_name in doctors:
+                yield {
+                    'DoctorID': doctor.DoctorID,
+                    'Name': doctor.Name,
+                    'Specialization': doctor.Specialization,
+                    'PhoneNumber': doctor.PhoneNumber,
+                    'DepartmentName': department_name
+                }
+
+    @track_db
     def get_doctor_by_id(self, doctor_id):
         with self.get_db() as db:
             return db.query(Doctor).filter(Doctor.id == doctor_id).one_or_none()
 
+    @track_db
     def delete_doctor(self, doctor_id):
+        self.writer.execute(self._delete_doctor_op, doctor_id)
+
+    def _delete_doctor_op(self, db, doctor_id):
+        if doctor := db.query(Doctor).filter(Doctor.DoctorID == doctor_id).one_or_none():
+            self._record_change(db, 'doctors', 'delete', doctor_id, doctor)
+            db.delete(doctor)
+            db.flush()
+
+    # (object_type, action) -> write operation taking the step's data
+    BATCH_STEPS = {
+        ('user', 'insert'): '_insert_user_step_op',
+        ('user', 'delete'): '_delete_user_op',
+        ('patient', 'insert'): '_insert_patient_op',
+        ('patient', 'update'): '_update_patient_step_op',
+        ('patient', 'delete'): '_delete_patient_op',
+        ('doctor', 'insert'): '_insert_doctor_op',
+        ('doctor', 'update'): '_update_doctor_step_op',
+        ('doctor', 'delete'): '_delete_doctor_op',
+        ('appointment', 'insert'): '_insert_appointment_step_op',
+        ('billing', 'insert'): '_insert_billing_op',
+        ('billing', 'update'): '_update_billing_step_op',
+    }
+
+    @track_db
+    def apply_batch(self, operations):
+        """
+        Applies a compound operation in one transaction: all of its steps commit or none do.
+
+        `operations` is an ordered list of {'action', 'object_type', 'data'}
+        steps, the same shape as single replication messages. User inserts
+        must carry `PasswordHash`; passwords are never hashed on the writer.
+        """
+        for step in operations:
+            if (step.get('object_type'), step.get('action')) not in self.BATCH_STEPS:
+                raise InvalidRequestException(f"Unsupported batch step: {step.get('action')} {step.get('object_type')}")
+        try:
+            return self.writer.execute(self._apply_batch_op, operations)
+        except sqlalchemy.exc.IntegrityError as e:
+            raise DatabaseIntegrityError(f"Compound operation rolled back: {e.orig}") from e
+
+    def _apply_batch_op(self, db, operations):
+        # The writer runs this in one savepoint, so a failing step rolls back the steps before it
+        return [
+            getattr(self, self.BATCH_STEPS[(step['object_type'], step['action'])])(db, step['data'])
+            for step in operations
+        ]
+
+    def _insert_user_step_op(self, db, user):
+        user_id = self._insert_user_op(db, user['UserID'], user['Username'], user['PasswordHash'], user['Role'])
+        if user_id is None:
+            raise DatabaseIntegrityError('Username already exists')
+        return user_id
+
+    def _update_patient_step_op(self, db, patient):
+        return self._update_patient_op(db, patient['PatientID'], {k: v for k, v in patient.items() if k != 'PatientID'})
+
+    def _update_doctor_step_op(self, db, doctor):
+        return self._update_doctor_op(db, doctor['DoctorID'], {k: v for k, v in doctor.items() if k != 'DoctorID'})
+
+    def _insert_appointment_step_op(self, db, appointment):
+        start, end = (parse_timestamp(parse(appointment[key])) for key in ('StartTime', 'EndTime'))
+        return self._insert_appointment_op(db, appointment, start, end, False)
+
+    def _update_billing_step_op(self, db, billing):
+        return self._update_billing_op(db, billing['BillingID'], billing)
+
+    @track_db
+    def apply_replicated(self, origin, seq, operations):
+        """
+        Applies operation `seq` from `origin` exactly once, in one transaction with its position.
+
+        Returns 'applied', or 'duplicate' when the position already covers
+        it. Callers apply each origin's operations in sequence order. With
+        `operations` None the position is advanced without applying
+        anything, to step over an operation that cannot be applied.
+        """
+        if operations is not None:
+            for step in operations:
+                if (step.get('object_type'), step.get('action')) not in self.BATCH_STEPS:
+                    raise InvalidRequestException(f"Unsupported replicated step: {step.get('action')} {step.get('object_type')}")
+        return self.writer.execute(self._apply_replicated_op, origin, seq, operations)
+
+    def _apply_replicated_op(self, db, origin, seq, operations):
+        position = db.query(ReplicationPosition).filter(ReplicationPosition.Origin == origin).one_or_none()
+        if position is None:
+            position = ReplicationPosition(Origin=origin, AppliedSeq=0)
+            db.add(position)
+        if position.AppliedSeq >= seq:
+            return 'duplicate'
+        if operations is not None:
+            self._apply_batch_op(db, operations)
+        position.AppliedSeq = seq
+        position.UpdatedAt = datetime.datetime.utcnow()
+        db.flush()
+        return 'applied'
+
+    @track_db
+    def get_replication_positions(self):
         with self.get_db() as db:
-            if doctor := db.query(Doctor).filter(Doctor.DoctorID == doctor_id).one_or_none():
-                db.delete(doctor)
-        db.commit()
+            return dict(db.query(ReplicationPosition.Origin, ReplicationPosition.AppliedSeq).all())
 
+    @track_db
     def authenticate_user(self, username, password):
+        # The KDF runs after the session is closed so no pooled connection is held while hashing.
+        # AuthBusyError from a saturated KDF pool propagates to the caller.
+        with self.get_db() as db:
+            user = db.query(User).filter(User.Username == username).one_or_none()
+        if user is None:
+            return None
+        matches, needs_rehash = password_hasher.verify(password, user.Password)
+        if not matches:
+            return None
+        if needs_rehash:
+            self.update_user_password(user.UserID, password_hasher.hash(password))
+        return user
+
+    @track_db
+    def update_user_password(self, user_id, password_hash):
+        self.writer.execute(self._update_user_password_op, user_id, password_hash)
+
+    def _update_user_password_op(self, db, user_id, password_hash):
+        if user := db.query(User).filter(User.UserID == user_id).one_or_none():
+            user.Password = password_hash
+            db.flush()
+            self._record_change(db, 'users', 'update', user_id, user)
+
+    @track_db
+    def insert_prescription(self, prescription):
         try:
-            with self.get_db() as db:
-                if (
-                    user := db.query(User)
-                    .filter(User.Username == username)
-                    .one_or_none()
-                ):
-                    password_hash = self.hash_password(password)
-                    if user.Password == password_hash:
-                        user.IsAuthenticated = True
-                        user.IsActive = True
-                        user.IsAnonymous = False
-                        login_user(user)
-                    return user
-                else:
-                    return jsonify({'error': "Invalid username or password."}), 401
+            return self.writer.execute(self._insert_prescription_op, prescription)
+        except IntegrityError as e:
+            raise DatabaseIntegrityError(f"Failed to insert prescription: {e}") from e
+        except WriteBusyError:
+            raise
         except Exception as e:
-            print(f"Error occurred during authentication: {e}")
-            return jsonify({'Error': str(e)}), 500
-                   
-    def insert_prescription(self, prescription):
+            raise e
+
+    def _insert_prescription_op(self, db, prescription):
+        patient_id = prescription['PatientID']
+        doctor_id = prescription['DoctorID']
+        medication = prescription['Medication']
+        dosage = prescription['Dosage']
+        frequency = prescription['Frequency']
+        refills = prescription['Refills']
+        instructions = prescription['Instruction']
+        prescribed_at = prescription.get('PrescribedAt')
+
+        new_prescription = Prescription(
+            patient_id,
+            doctor_id,
+            medication,
+            dosage,
+            frequency,
+            refills,
+            instructions,
+        )
+        # An explicit PrescribedAt (imports, backfills) is kept; archival ages prescriptions by it
+        new_prescription.PrescribedAt = parse(prescribed_at) if prescribed_at else datetime.datetime.utcnow()
+        db.add(new_prescription)
+        db.flush()
+        self._record_change(db, 'prescriptions', 'insert', new_prescription.PrescriptionID, new_prescription)
+        return new_prescription.PrescriptionID
+
+    def _billing_values(self, billing):
+        return {
+            'DateOfBilling': billing.DateOfBilling,
+            'DepartmentID': billing.DepartmentID,
+            'PaymentStatus': billing.PaymentStatus,
+            'TotalCost': billing.TotalCost
+        }
+
+    @track_db
+    def insert_billing(self, billing_data):
+        return self.writer.execute(self._insert_billing_op, billing_data)
+
+    def _insert_billing_op(self, db, billing_data):
+        department_id = billing_data.get('DepartmentID')
+        if department_id is None and billing_data.get('DepartmentName'):
+            department_id = db.query(Department.DepartmentID).filter(Department.DepartmentName == billing_data['DepartmentName']).scalar()
+        date_of_billing = billing_data.get('DateOfBilling')
+        new_billing = Billing(
+            BillingID=billing_data.get('BillingID') or self._new_record_id(db, Billing),
+            PatientID=billing_data['PatientID'],
+            TotalCost=float(billing_data['TotalCost']),
+            PaymentStatus=billing_data.get('PaymentStatus', 'unpaid'),
+            DateOfBilling=parse(date_of_billing).date() if date_of_billing else datetime.date.today(),
+            DepartmentID=department_id
+        )
+        db.add(new_billing)
+        db.flush()
+        # The rollup moves in the same transaction as the invoice
+        apply_billing_delta(db, None, self._billing_values(new_billing))
+        self._record_change(db, 'billings', 'insert', new_billing.BillingID, new_billing)
+        return new_billing.BillingID
+
+    @track_db
+    def update_billing(self, billing_id, new_data):
+        return self.writer.execute(self._update_billing_op, billing_id, new_data)
+
+    def _update_billing_op(self, db, billing_id, new_data):
+        billing = db.query(Billing).filter(Billing.BillingID == billing_id).one_or_none()
+        if billing is None:
+            self._reject_if_archived('billings', billing_id)
+            return None
+        before = self._billing_values(billing)
+        # Converted like the insert path, so a string amount never reaches the row or the rollup
+        if 'TotalCost' in new_data:
+            billing.TotalCost = float(new_data['TotalCost'])
+        for key in ('PaymentStatus', 'DepartmentID'):
+            if key in new_data:
+                setattr(billing, key, new_data[key])
+        if 'DateOfBilling' in new_data:
+            billing.DateOfBilling = parse(new_data['DateOfBilling']).date()
+        apply_billing_delta(db, before, self._billing_values(billing))
+        db.flush()
+        self._record_change(db, 'billings', 'update', billing_id, billing)
+        return billing_id
+
+    def _reject_if_archived(self, table, row_id):
+        # Archived rows are read-only. Raising fails the write, or marks a replicated
+        # operation failed and counts it, where returning None would look like success
+        if self.archive.contains(table, row_id):
+            raise ArchivedRecordError(f"{table} row {row_id} is archived and can no longer be changed")
+
+    @track_db
+    def delete_billing(self, billing_id):
+        return self.writer.execute(self._delete_billing_op, billing_id)
+
+    def _delete_billing_op(self, db, billing_id):
+        billing = db.query(Billing).filter(Billing.BillingID == billing_id).one_or_none()
+        if billing is None:
+            self._reject_if_archived('billings', billing_id)
+            return None
+        apply_billing_delta(db, self._billing_values(billing), None)
+        self._record_change(db, 'billings', 'delete', billing_id, billing)
+        db.delete(billing)
+        db.flush()
+        return billing_id
+
+    @track_db
+    def get_revenue_report(self, start=None, end=None, group_by=('day',)):
         with self.get_db() as db:
-            try:
-                patient_id = prescription['PatientID']
-                doctor_id = prescription['DoctorID']
-                medication = prescription['Medication']
-                dosage = medication['Dosage']
-                frequency = prescription['Frequency']
-                refills = prescription['Refills']
-                instructions = prescription['Instruction']
-                
-                new_prescription = Prescription(
-                    PatientID=patient_id,
-                    DoctorID=doctor_id,
-                    Medication=medication,
-                    Dosage=dosage,
-                    Frequency=frequency,
-                    Refills=refills,
-                    Instructions=instructions,
+            return revenue_report(db, start, end, group_by)
+
+    @track_db
+    def rebuild_billing_rollups(self):
+        with self.engine.begin() as conn:
+            # Rows still hot after an interrupted archive run are counted once, from billings
+            hot_ids = {billing_id for (billing_id,) in conn.execute(sqlalchemy.select(Billing.BillingID))}
+            result = recompute_rollups(conn, archived=self.archive.billing_rows(exclude=hot_ids))
+        table_versions.bump('billings')
+        return result
+
+    @track_db
+    def get_department_names(self):
+        with self.get_db() as db:
+            return dict(db.query(Department.DepartmentID, Department.DepartmentName).all())
+
+    # Child collections of a patient chart: relationship, model, newest-first ordering
+    CHART_SECTIONS = {
+        'appointments': (Patient.appointments, Appointment, (Appointment.StartTime.desc(), Appointment.AppointmentID.desc())),
+        'prescriptions': (Patient.prescriptions, Prescription, (Prescription.PrescriptionID.desc(),)),
+        'billings': (Patient.billings, Billing, (Billing.DateOfBilling.desc(), Billing.BillingID.desc())),
+    }
+
+    @track_db
+    def get_patient_chart(self, patient_id, sections=None, limit=None, offsets=None):
+        """
+        Loads a patient's demographics and child collections in 1 + len(sections) queries.
+
+        Without a limit every collection is loaded with selectinload; with one,
+        each collection is read as its own LIMIT/OFFSET window. Archived rows
+        are all older than the hot ones, so they continue each collection
+        after its last hot row.
+        """
+        sections = [name for name in (sections or self.CHART_SECTIONS) if name in self.CHART_SECTIONS]
+        offsets = offsets or {}
+        with self.get_db() as db:
+            query = db.query(Patient).filter(Patient.PatientID == patient_id)
+            if limit is None:
+                query = query.options(*(selectinload(self.CHART_SECTIONS[name][0]) for name in sections))
+            patient = query.one_or_none()
+            if patient is None:
+                return None
+
+            chart = {'patient': patient.to_dict()}
+            for name in sections:
+                relationship_attr, model, ordering = self.CHART_SECTIONS[name]
+                if limit is None:
+                    rows = sorted(getattr(patient, name), key=lambda row: self._chart_sort_key(row, ordering), reverse=True)
+                    items = [row.to_dict() for row in rows] + self._archived_chart_rows(db, name, model, patient_id)
+                    chart[name] = {'items': items, 'offset': 0, 'has_more': False}
+                    continue
+                offset = offsets.get(name, 0)
+                # One extra row tells us whether another page exists without a COUNT query
+                rows = (
+                    db.query(model)
+                    .filter(model.PatientID == patient_id)
+                    .order_by(*ordering)
+                    .offset(offset)
+                    .limit(limit + 1)
+                    .all()
                 )
-                db.add(new_prescription)
-                db.commit()
-                return new_prescription.PrescriptionID
-            except IntegrityError as e:
-                raise DatabaseIntegrityError(f"Failed to insert prescription: {e}") from e
-            except Exception as e:
-                raise e
+                items = [row.to_dict() for row in rows[:limit]]
+                has_more = len(rows) > limit
+                if not has_more and self.archive.periods():
+                    # The hot rows ran out inside this page; fill the rest from the archive
+                    if rows or offset == 0:
+                        hot_total = offset + len(rows)
+                    else:
+                        hot_total = db.query(model).filter(model.PatientID == patient_id).count()
+                    archived = self._archived_chart_rows(db, name, model, patient_id)
+                    start = max(0, offset - hot_total)
+                    room = limit - len(items)
+                    items += archived[start:start + room]
+                    has_more = len(archived) > start + room
+                chart[name] = {'items': items, 'offset': offset, 'has_more': has_more}
+            return chart
+
+    def _archived_chart_rows(self, db, name, model, patient_id):
+        if not self.archive.periods():
+            return []
+        id_column = getattr(model, ARCHIVED_TABLES[name][1])
+        hot_ids = {row_id for (row_id,) in db.query(id_column).filter(model.PatientID == patient_id)}
+        return self.archive.patient_rows(name, patient_id, exclude=hot_ids)
+
+    @staticmethod
+    def _chart_sort_key(row, ordering):
+        # Sorted in reverse, this mirrors the paged ORDER BY (descending, NULLs last)
+        key = []
+        for clause in ordering:
+            value = getattr(row, clause.element.key)
+            key.append((value is not None, value if value is not None else 0))
+        return tuple(key)
+
+    def _overlapping_appointments(self, db, column, value, start, end):
+        # Bounded by the longest bookable appointment so the (column, StartTime) index limits the scan
+        earliest = start - datetime.timedelta(minutes=Config.APPOINTMENT_MAX_MINUTES)
+        return (
+            db.query(Appointment)
+            .filter(
+                column == value,
+                Appointment.StartTime >= earliest,
+                Appointment.StartTime < end,
+                Appointment.EndTime > start
+            )
+            .all()
+        )
+
+    @track_db
+    def insert_appointment(self, appointment_data, check_conflicts=False):
+        start = appointment_data['StartTime']
+        end = appointment_data['EndTime']
+        if isinstance(start, str):
+            start, end = parse(start), parse(end)
+        # Stored naive in UTC, the form the scheduler compares against
+        start, end = parse_timestamp(start), parse_timestamp(end)
+        return self.writer.execute(self._insert_appointment_op, appointment_data, start, end, check_conflicts)
+
+    def _insert_appointment_op(self, db, appointment_data, start, end, check_conflicts):
+        if check_conflicts:
+            conflicts = (
+                self._overlapping_appointments(db, Appointment.DoctorID, appointment_data['DoctorID'], start, end)
+                + self._overlapping_appointments(db, Appointment.PatientID, appointment_data['PatientID'], start, end)
+            )
+            if conflicts:
+                raise AppointmentConflictError([appointment.to_dict() for appointment in conflicts])
+        new_appointment = Appointment(
+            AppointmentID=appointment_data.get('AppointmentID') or self._new_record_id(db, Appointment),
+            PatientID=appointment_data['PatientID'],
+            DoctorID=appointment_data['DoctorID'],
+            AppointmentDateTime=start.date(),
+            StartTime=start,
+            EndTime=end,
+            Purpose=appointment_data.get('Purpose')
+        )
+        db.add(new_appointment)
+        db.flush()
+        self._record_change(db, 'appointments', 'insert', new_appointment.AppointmentID, new_appointment)
+        return new_appointment.AppointmentID
+
+    @track_db
+    def get_appointment_by_id(self, appointment_id):
+        with self.get_db() as db:
+            appointment = db.query(Appointment).filter(Appointment.AppointmentID == appointment_id).one_or_none()
+            return appointment.to_dict() if appointment else None
+
+    @track_db
+    def get_appointment_intervals(self, column_name, value):
+        """(AppointmentID, StartTime, EndTime) of every timed appointment of one doctor or patient."""
+        column = getattr(Appointment, column_name)
+        with self.get_db() as db:
+            return (
+                db.query(Appointment.AppointmentID, Appointment.StartTime, Appointment.EndTime)
+                .filter(column == value, Appointment.StartTime.isnot(None), Appointment.EndTime.isnot(None))
+                .order_by(Appointment.StartTime)
+                .all()
+            )
+
+    @track_db
+    def get_upcoming_appointments(self, doctor_id, now, limit=5):
+        with self.get_db() as db:
+            appointments = (
+                db.query(Appointment)
+                .filter(Appointment.DoctorID == doctor_id, Appointment.StartTime >= now)
+                .order_by(Appointment.StartTime)
+                .limit(limit)
+                .all()
+            )
+            return [appointment.to_dict() for appointment in appointments]
+
+    @track_db
+    def get_recent_patients(self, doctor_id, now, limit=5):
+        """Most recently seen distinct patients of a doctor, newest first."""
+        with self.get_db() as db:
+            rows = (
+                db.query(Patient.PatientID, Patient.Name, sqlalchemy.func.max(Appointment.StartTime))
+                .join(Appointment, Appointment.PatientID == Patient.PatientID)
+                .filter(Appointment.DoctorID == doctor_id, Appointment.StartTime < now)
+                .group_by(Patient.PatientID, Patient.Name)
+                .order_by(sqlalchemy.func.max(Appointment.StartTime).desc())
+                .limit(limit)
+                .all()
+            )
+            return [{'PatientID': patient_id, 'name': name, 'lastVisit': str(last_visit)} for patient_id, name, last_visit in rows]
 
+    @track_db
     def get_all_appointments(self):
         with self.get_db() as db:
             return db.query(Appointment).all()
  
+    @track_db
     def get_appointments_by_doctor_id(self, doctor_id):
         with self.get_db() as db:
             return db.query(Appointment).filter(Appointment.DoctorID == doctor_id).all()
@@ -27,4 +27,12 @@ class PatientDeletionError(Exception):
 class ReplicationError(Exception):
     pass
 class PatientNotFoundError(Exception):
-    pass
\ No newline at end of file
+    pass
+class ArchivedRecordError(Exception):
+    """Raised when a write targets a row that has been moved to the cold archive, where rows are read-only."""
+    pass
+class AppointmentConflictError(Exception):
+    """Raised when a booking overlaps an existing appointment of the doctor or patient."""
+    def __init__(self, conflicts):
+        super().__init__(f"Appointment overlaps {len(conflicts)} existing appointment(s)")
+        self.conflicts = conflicts
\ No newline at end of file
@@ -0,0 +1,193 @@
+#migrations.py
+
+import time
+import logging
+import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from models import SchemaMigration
+from reporting import recompute_rollups
+
+
+def create_index(name, table, *columns, unique=False):
+    def operation(conn):
+        unique_sql = 'UNIQUE ' if unique else ''
+        column_sql = ', '.join(f'"{column}"' for column in columns)
+        conn.execute(text(f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({column_sql})'))
+    operation.description = f"index {name} on {table}({', '.join(columns)})"
+    return operation
+
+
+def add_column(table, column, ddl_type):
+    def operation(conn):
+        existing = {row[1] for row in conn.execute(text(f'PRAGMA table_info("{table}")'))}
+        if column not in existing:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN "{column}" {ddl_type}'))
+    operation.description = f"column {table}.{column} {ddl_type}"
+    return operation
+
+
+def backfill_billing_rollups():
+    def operation(conn):
+        recompute_rollups(conn)
+    operation.description = 'backfill billing_rollups from billings'
+    return operation
+
+
+def execute(sql):
+    def operation(conn):
+        conn.execute(text(sql))
+    operation.description = sql
+    return operation
+
+
+class Migration:
+    def __init__(self, version, description, operations):
+        self.version = version
+        self.description = description
+        self.operations = operations
+
+
+# Append new migrations at the end with the next version number; never edit applied ones.
+# Every operation must be safe to run against a database created by create_all().
+MIGRATIONS = [
+    Migration(1, 'Secondary indexes for foreign keys and department lookups', [
+        create_index('ix_appointments_DoctorID', 'appointments', 'DoctorID'),
+        create_index('ix_appointments_PatientID', 'appointments', 'PatientID'),
+        create_index('ix_prescriptions_PatientID', 'prescriptions', 'PatientID'),
+        create_index('ix_prescriptions_DoctorID', 'prescriptions', 'DoctorID'),
+        create_index('ix_billings_PatientID', 'billings', 'PatientID'),
+        create_index('ix_doctors_DepartmentID', 'doctors', 'DepartmentID'),
+        create_index('ix_departments_DepartmentName', 'departments', 'DepartmentName'),
+    ]),
+    Migration(2, 'Billing departments and incremental revenue rollups', [
+        add_column('billings', 'DepartmentID', 'INTEGER REFERENCES departments("DepartmentID")'),
+        create_index('ix_billings_DepartmentID', 'billings', 'DepartmentID'),
+        backfill_billing_rollups(),
+    ]),
+    Migration(3, 'Appointment start and end timestamps', [
+        add_column('appointments', 'StartTime', 'DATETIME'),
+        add_column('appointments', 'EndTime', 'DATETIME'),
+        # Legacy appointments only carry a day; they are placed at the start of it
+        execute(
+            'UPDATE appointments SET "StartTime" = datetime("AppointmentDateTime"), '
+            f'"EndTime" = datetime("AppointmentDateTime", \'+{Config.APPOINTMENT_DEFAULT_MINUTES} minutes\') '
+            'WHERE "StartTime" IS NULL AND "AppointmentDateTime" IS NOT NULL'
+        ),
+        create_index('ix_appointments_DoctorID_StartTime', 'appointments', 'DoctorID', 'StartTime'),
+        create_index('ix_appointments_PatientID_StartTime', 'appointments', 'PatientID', 'StartTime'),
+    ]),
+    # replication_log, replication_positions and node_identity are new tables, created by create_all()
+    Migration(4, 'Sequenced replication log and per-origin positions', []),
+    Migration(5, 'Prescription dates and age indexes for cold-data archival', [
+        add_column('prescriptions', 'PrescribedAt', 'DATETIME'),
+        create_index('ix_prescriptions_PrescribedAt', 'prescriptions', 'PrescribedAt'),
+        create_index('ix_billings_DateOfBilling', 'billings', 'DateOfBilling'),
+        create_index('ix_appointments_StartTime', 'appointments', 'StartTime'),
+    ]),
+]
+
+# Lookups the indexes exist for; verify_query_plans() checks SQLite actually uses them
+LOOKUP_QUERIES = {
+    'appointments_by_doctor': 'SELECT * FROM appointments WHERE "DoctorID" = :value',
+    'appointments_by_patient': 'SELECT * FROM appointments WHERE "PatientID" = :value',
+    'doctor_calendar': 'SELECT "AppointmentID" FROM appointments WHERE "DoctorID" = :value AND "StartTime" >= :value ORDER BY "StartTime"',
+    'prescriptions_by_patient': 'SELECT * FROM prescriptions WHERE "PatientID" = :value',
+    'billings_by_patient': 'SELECT * FROM billings WHERE "PatientID" = :value',
+    'doctors_by_department': 'SELECT * FROM doctors WHERE "DepartmentID" = :value',
+    'department_by_name': 'SELECT "DepartmentID" FROM departments WHERE "DepartmentName" = :value',
+}
+
+
+class MigrationRunner:
+    """
+    Applies pending MIGRATIONS in version order, one transaction per migration.
+
+    Every node runs this at startup. A fresh database built by create_all()
+    already matches the models, so it is stamped with the latest version
+    instead of replaying migrations.
+    """
+
+    def __init__(self, engine, migrations=MIGRATIONS):
+        self.engine = engine
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+
+    def applied_versions(self):
+        with self.engine.connect() as conn:
+            return {row[0] for row in conn.execute(text('SELECT "Version" FROM schema_migrations'))}
+
+    def current_version(self):
+        return max(self.applied_versions(), default=0)
+
+    def pending(self):
+        applied = self.applied_versions()
+        return [migration for migration in self.migrations if migration.version not in applied]
+
+    def _record(self, conn, migration, duration_ms):
+        conn.execute(
+            SchemaMigration.__table__.insert().values(
+                Version=migration.version,
+                Description=migration.description,
+                AppliedAt=datetime.datetime.utcnow(),
+                DurationMs=duration_ms
+            )
+        )
+
+    def stamp(self):
+        """Marks every migration as applied without running it."""
+        for migration in self.pending():
+            try:
+                with self.engine.begin() as conn:
+                    self._record(conn, migration, 0.0)
+            except IntegrityError:
+                pass  # stamped concurrently by another process
+
+    def run(self):
+        applied = []
+        for migration in self.pending():
+            started = time.perf_counter()
+            try:
+                with self.engine.begin() as conn:
+                    for operation in migration.operations:
+                        logging.info(f"Migration {migration.version}: {operation.description}")
+                        operation(conn)
+                    self._record(conn, migration, (time.perf_counter() - started) * 1000)
+            except IntegrityError:
+                # Another process on the same database applied it first
+                logging.info(f"Migration {migration.version} already applied by another process")
+                continue
+            logging.info(f"Applied migration {migration.version} ({migration.description})")
+            applied.append(migration.version)
+        return applied
+
+    def status(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                'SELECT "Version", "Description", "AppliedAt", "DurationMs" FROM schema_migrations ORDER BY "Version"'
+            )).fetchall()
+        return {
+            'version': rows[-1][0] if rows else 0,
+            'latest': self.migrations[-1].version if self.migrations else 0,
+            'applied': [
+                {'version': row[0], 'description': row[1], 'applied_at': str(row[2]), 'duration_ms': row[3]}
+                for row in rows
+            ]
+        }
+
+
+def is_fresh_database(engine):
+    return not inspect(engine).has_table('users')
+
+
+def verify_query_plans(engine, queries=LOOKUP_QUERIES):
+    """Returns {name: {'plan': [...], 'uses_index': bool}} for each lookup query."""
+    results = {}
+    with engine.connect() as conn:
+        for name, sql in queries.items():
+            plan = [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'), {'value': None})]
+            uses_index = any('USING INDEX' in step or 'USING COVERING INDEX' in step for step in plan)
+            results[name] = {'plan': plan, 'uses_index': uses_index}
+            if not uses_index:
+                logging.warning(f"Lookup {name} does not use an index: {plan}")
+    return results
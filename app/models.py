@@ -1,6 +1,7 @@
 # models.py
 
-from sqlalchemy import Boolean, Column, Float, Integer, String, Text, Date, ForeignKey
+import json
+from sqlalchemy import Boolean, Column, Float, Integer, String, Text, Date, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
@@ -23,17 +24,19 @@ class User(Base):
     def get_id(self):
         return str(self.UserID)  
 
+    # A User loaded from the database is always a real, logged-in principal;
+    # the Is* columns are per-login flags and must not gate Flask-Login
     @property
     def is_authenticated(self):
-        return self.IsAuthenticated
+        return True
 
     @property
     def is_active(self):
-        return self.IsActive
+        return True
 
     @property
     def is_anonymous(self):
-        return self.IsAnonymous
+        return False
 
     def __repr__(self):
         return f"<User(Username={self.Username}, Role={self.Role})>"
@@ -78,7 +81,7 @@ class Doctor(Base):
   Name = Column(String)
   Specialization = Column(String)
   PhoneNumber = Column(Integer, unique=True)
-  DepartmentID = Column(Integer, ForeignKey('departments.DepartmentID'))
+  DepartmentID = Column(Integer, ForeignKey('departments.DepartmentID'), index=True)
 
   appointments = relationship("Appointment", backref='doctor')
   prescriptions = relationship("Prescription", backref='doctor')
@@ -101,30 +104,52 @@ class Department(Base):
     __tablename__ = 'departments'
 
     DepartmentID = Column(Integer, primary_key=True)
-    DepartmentName = Column(String)
+    DepartmentName = Column(String, index=True)
 
     doctors = relationship("Doctor", backref='department')
     nurses = relationship("Nurse", backref='department')
 
 class Appointment(Base):
     __tablename__ = 'appointments'
+    # Conflict checks and calendars read one doctor's or patient's appointments by start time
+    __table_args__ = (
+        Index('ix_appointments_DoctorID_StartTime', 'DoctorID', 'StartTime'),
+        Index('ix_appointments_PatientID_StartTime', 'PatientID', 'StartTime'),
+        # Archival selects by age across all patients
+        Index('ix_appointments_StartTime', 'StartTime'),
+    )
 
     AppointmentID = Column(Integer, primary_key=True)
-    PatientID = Column(String, ForeignKey('patients.PatientID'))
-    DoctorID = Column(String, ForeignKey('doctors.DoctorID'))
+    PatientID = Column(String, ForeignKey('patients.PatientID'), index=True)
+    DoctorID = Column(String, ForeignKey('doctors.DoctorID'), index=True)
+    # Day of the appointment, kept for older readers; StartTime/EndTime are authoritative
     AppointmentDateTime = Column(Date)
+    StartTime = Column(DateTime)
+    EndTime = Column(DateTime)
     Purpose = Column(String)
+
+    def to_dict(self):
+        return {
+            'AppointmentID': self.AppointmentID,
+            'PatientID': self.PatientID,
+            'DoctorID': self.DoctorID,
+            'AppointmentDateTime': self.AppointmentDateTime.isoformat() if self.AppointmentDateTime else None,
+            'StartTime': self.StartTime.isoformat() if self.StartTime else None,
+            'EndTime': self.EndTime.isoformat() if self.EndTime else None,
+            'Purpose': self.Purpose
+        }
 class Prescription(Base):
     __tablename__ = 'prescriptions'
 
     PrescriptionID = Column(Integer, primary_key=True)
-    PatientID = Column(String, ForeignKey('patients.PatientID'))
-    DoctorID = Column(String, ForeignKey('doctors.DoctorID'))
+    PatientID = Column(String, ForeignKey('patients.PatientID'), index=True)
+    DoctorID = Column(String, ForeignKey('doctors.DoctorID'), index=True)
     Medication = Column(String)
     Dosage = Column(String)
     Frequency = Column(String)
     Refills = Column(Integer)
     Instructions = Column(Text)
+    PrescribedAt = Column(DateTime, index=True)
     
     def __init__(self, patient_id, doctor_id, medication, dosage, frequency, refills, instructions):
         self.PatientID = patient_id  
@@ -134,12 +159,105 @@ class Prescription(Base):
         self.Frequency = frequency
         self.Refills = refills
         self.Instructions = instructions
+
+    def to_dict(self):
+        return {
+            'PrescriptionID': self.PrescriptionID,
+            'PatientID': self.PatientID,
+            'DoctorID': self.DoctorID,
+            'Medication': self.Medication,
+            'Dosage': self.Dosage,
+            'Frequency': self.Frequency,
+            'Refills': self.Refills,
+            'Instructions': self.Instructions,
+            'PrescribedAt': self.PrescribedAt.isoformat() if self.PrescribedAt else None
+        }
     
 class Billing(Base):
     __tablename__ = 'billings'
 
     BillingID = Column(Integer, primary_key=True)
-    PatientID = Column(String, ForeignKey('patients.PatientID'))
+    PatientID = Column(String, ForeignKey('patients.PatientID'), index=True)
     TotalCost = Column(Float)  
     PaymentStatus = Column(String)
-    DateOfBilling = Column(Date)
\ No newline at end of file
+    DateOfBilling = Column(Date, index=True)
+    DepartmentID = Column(Integer, ForeignKey('departments.DepartmentID'), index=True)
+
+    def to_dict(self):
+        return {
+            'BillingID': self.BillingID,
+            'PatientID': self.PatientID,
+            'TotalCost': self.TotalCost,
+            'PaymentStatus': self.PaymentStatus,
+            'DateOfBilling': self.DateOfBilling.isoformat() if self.DateOfBilling else None,
+            'DepartmentID': self.DepartmentID
+        }
+
+class BillingRollup(Base):
+    __tablename__ = 'billing_rollups'
+
+    # DepartmentID 0 collects invoices without a department
+    Day = Column(Date, primary_key=True)
+    DepartmentID = Column(Integer, primary_key=True)
+    PaymentStatus = Column(String, primary_key=True)
+    InvoiceCount = Column(Integer, nullable=False, default=0)
+    TotalAmount = Column(Float, nullable=False, default=0.0)
+
+class ChangeLogEntry(Base):
+    __tablename__ = 'change_log'
+    # AUTOINCREMENT keeps sequence numbers monotonic even after compaction
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    Seq = Column(Integer, primary_key=True)
+    TableName = Column(String, nullable=False)
+    Operation = Column(String, nullable=False)
+    RowID = Column(String, nullable=False)
+    RowImage = Column(Text)
+    CreatedAt = Column(DateTime)
+
+    def to_dict(self):
+        return {
+            'seq': self.Seq,
+            'table': self.TableName,
+            'operation': self.Operation,
+            'row_id': self.RowID,
+            'row': json.loads(self.RowImage) if self.RowImage else None,
+            'created_at': self.CreatedAt.isoformat() if self.CreatedAt else None
+        }
+
+class ChangeConsumer(Base):
+    __tablename__ = 'change_consumers'
+
+    ConsumerID = Column(String, primary_key=True)
+    AckedSeq = Column(Integer, nullable=False, default=0)
+    UpdatedAt = Column(DateTime)
+
+class ReplicationLogEntry(Base):
+    __tablename__ = 'replication_log'
+    # Sequence numbers of this node's replicated operations; never reused after trimming
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    Seq = Column(Integer, primary_key=True)
+    Message = Column(Text, nullable=False)
+    CreatedAt = Column(DateTime)
+
+class ReplicationPosition(Base):
+    __tablename__ = 'replication_positions'
+
+    Origin = Column(String, primary_key=True)
+    AppliedSeq = Column(Integer, nullable=False, default=0)
+    UpdatedAt = Column(DateTime)
+
+class NodeIdentity(Base):
+    __tablename__ = 'node_identity'
+
+    OriginID = Column(String, primary_key=True)
+    CreatedAt = Column(DateTime)
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    Version = Column(Integer, primary_key=True)
+    Description = Column(String, nullable=False)
+    AppliedAt = Column(DateTime)
+    DurationMs = Column(Float)
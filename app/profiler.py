@@ -0,0 +1,176 @@
+#profiler.py
+
+import re
+import time
+import heapq
+import logging
+import threading
+from collections import Counter, deque
+from flask import g, has_request_context, request
+from config import Config
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    """Collapses literals, parameter lists and whitespace so equivalent statements group together."""
+    sql = _STRING_LITERAL.sub('?', statement)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('IN (?)', sql)
+
+
+class QueryProfiler:
+    """
+    Opt-in SQL profiler built on SQLAlchemy engine events.
+
+    Records normalized SQL, duration, rows and the calling route for every
+    statement, keeps a rolling top-N of the slowest statements and flags N+1
+    patterns (the same statement executed many times within one request).
+    With explain enabled, slow SELECTs also capture their EXPLAIN QUERY PLAN.
+    """
+
+    def __init__(self, top_n=20, slow_ms=50, n_plus_one_threshold=5, explain=False, history=200):
+        self.engines = []
+        self.top_n = top_n
+        self.slow_seconds = slow_ms / 1000.0
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.explain = explain
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._slowest = []
+        self._slow_log = deque(maxlen=history)
+        self._n_plus_one = deque(maxlen=history)
+        self._totals = {}
+        self._sequence = 0
+        self.enabled = False
+
+    def attach(self, engine):
+        """Starts profiling statements executed through `engine`."""
+        if engine in self.engines:
+            return
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        self.engines.append(engine)
+        if not self.enabled:
+            event.listen(Session, 'do_orm_execute', self._count_orm_rows)
+            self.enabled = True
+
+    def detach_all(self):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', self._after_cursor_execute)
+        self.engines = []
+        if self.enabled:
+            event.remove(Session, 'do_orm_execute', self._count_orm_rows)
+            self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._slowest = []
+            self._slow_log.clear()
+            self._n_plus_one.clear()
+            self._totals = {}
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['profiler_started'].pop()
+        duration = time.perf_counter() - started
+        sql = normalize_sql(statement)
+        route = request.endpoint if has_request_context() else None
+        record = {
+            'sql': sql,
+            'duration_ms': round(duration * 1000, 3),
+            'rows': cursor.rowcount if cursor.rowcount >= 0 else None,
+            'route': route,
+            'at': time.time()
+        }
+        # Picked up by _count_orm_rows to fill in rows for SELECTs
+        self._local.last_record = record
+
+        with self._lock:
+            totals = self._totals.setdefault(sql, {'count': 0, 'total_ms': 0.0})
+            totals['count'] += 1
+            totals['total_ms'] += record['duration_ms']
+            self._sequence += 1
+            entry = (duration, self._sequence, record)
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, entry)
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+        if duration >= self.slow_seconds:
+            if self.explain and sql.upper().startswith('SELECT'):
+                record['plan'] = self._explain(cursor, statement, parameters)
+            self._slow_log.append(record)
+            logging.warning(f"Slow query ({record['duration_ms']} ms, route={route}): {sql}")
+
+        if has_request_context():
+            if 'profiler_statements' not in g:
+                g.profiler_statements = Counter()
+            g.profiler_statements[sql] += 1
+
+    def _count_orm_rows(self, orm_execute_state):
+        self._local.last_record = None
+        result = orm_execute_state.invoke_statement()
+        record = self._local.last_record
+        # Streaming (yield_per) results must not be buffered just to count them
+        if record is None or not orm_execute_state.is_select or orm_execute_state.execution_options.get('yield_per'):
+            return result
+        frozen = result.freeze()
+        record['rows'] = len(frozen().all())
+        return frozen()
+
+    def _explain(self, cursor, statement, parameters):
+        try:
+            plan = cursor.connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ()).fetchall()
+            return [row[-1] for row in plan]
+        except Exception as e:
+            return [f"explain failed: {e}"]
+
+    def finish_request(self, exc=None):
+        """Flags statements repeated enough times in the finished request to look like N+1 queries."""
+        statements = g.pop('profiler_statements', None)
+        if not statements:
+            return
+        for sql, count in statements.items():
+            if count >= self.n_plus_one_threshold:
+                detection = {'route': request.endpoint, 'sql': sql, 'count': count, 'at': time.time()}
+                self._n_plus_one.append(detection)
+                logging.warning(f"Possible N+1 on {request.endpoint}: {count}x {sql}")
+
+    def report(self):
+        with self._lock:
+            slowest = [record for _, _, record in sorted(self._slowest, reverse=True)]
+            totals = sorted(
+                ({'sql': sql, **values} for sql, values in self._totals.items()),
+                key=lambda item: item['total_ms'],
+                reverse=True
+            )[:self.top_n]
+        return {
+            'enabled': self.enabled,
+            'explain': self.explain,
+            'slow_threshold_ms': self.slow_seconds * 1000,
+            'slowest': slowest,
+            'by_total_time': totals,
+            'slow_log': list(self._slow_log),
+            'n_plus_one': list(self._n_plus_one)
+        }
+
+    def init_app(self, app):
+        app.teardown_request(self.finish_request)
+
+
+profiler = QueryProfiler(
+    top_n=Config.PROFILER_TOP_N,
+    slow_ms=Config.PROFILER_SLOW_QUERY_MS,
+    n_plus_one_threshold=Config.PROFILER_N_PLUS_ONE_THRESHOLD,
+    explain=Config.PROFILER_EXPLAIN
+)
@@ -0,0 +1,105 @@
+#rendering.py
+
+import os
+import gzip
+import zlib
+import time
+import logging
+from flask import Response, current_app, request, stream_with_context, render_template
+from jinja2 import FileSystemBytecodeCache
+from config import Config
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript', 'application/x-ndjson'}
+
+
+def precompile_templates(app):
+    """Compiles every template up front so the first request does not pay for it."""
+    started = time.perf_counter()
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    logging.info(f"Precompiled {len(names)} templates in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+def render_rows(template_name, **context):
+    """
+    Renders a table template, streaming it when STREAM_TEMPLATES is on.
+
+    Rows are flushed every STREAM_BUFFER_ROWS template items, so the first
+    byte goes out before the whole result list has been read or rendered.
+    """
+    if not Config.STREAM_TEMPLATES:
+        return render_template(template_name, **context)
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(template_name)
+    app.update_template_context(context)
+    stream = template.stream(context)
+    stream.enable_buffering(Config.STREAM_BUFFER_ROWS)
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress_stream(chunks, encoding):
+    # Every chunk is flushed so compression does not hold back rows already rendered
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            yield compressor.process(data) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(Config.COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+def compress_response(response):
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < Config.COMPRESSION_MIN_BYTES:
+            return response
+        if encoding == 'br':
+            response.set_data(brotli.compress(data))
+        else:
+            response.set_data(gzip.compress(data, Config.COMPRESSION_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_rendering(app):
+    # The bytecode cache must be in place before the first template is loaded;
+    # precompile_templates() runs later, as part of bootstrapping the node
+    os.makedirs(Config.TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(Config.TEMPLATE_CACHE_DIR)
+    if Config.COMPRESS_RESPONSES:
+        app.after_request(compress_response)
@@ -0,0 +1,156 @@
+#replication_log.py
+
+import json
+import uuid
+import socket
+import logging
+import datetime
+import threading
+from sqlalchemy import delete, func
+from config import Config
+from metrics import registry, REPLICATION_DEDUP_HITS
+from models import NodeIdentity, ReplicationLogEntry
+from writer import WriteBusyError
+
+REPLICATION_BUFFERED = registry.gauge('replication_buffered_messages', 'Out-of-order replication messages waiting for an earlier sequence number by origin')
+REPLICATION_APPLY_FAILURES = registry.counter('replication_apply_failures_total', 'Replicated operations skipped because they could not be applied')
+REPLICATION_RESENT = registry.counter('replication_resent_total', 'Logged operations sent again to a peer that reported a gap')
+
+
+class ReplicationLog:
+    """
+    Write-ahead log of the operations this node replicates.
+
+    Every operation gets the next sequence number of this node's origin id
+    and is stored before it is sent, so a peer that missed some of them can
+    be sent the gap again from the log. Entries older than
+    REPLICATION_LOG_RETENTION sequence numbers are trimmed as the log grows.
+    """
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self._origin = None
+        self._lock = threading.Lock()
+
+    @property
+    def origin(self):
+        # Kept in the database rather than derived from the host, so it changes
+        # exactly when the sequence numbers start over
+        if self._origin is None:
+            with self._lock:
+                if self._origin is None:
+                    self._origin = self.db_manager.writer.execute(self._origin_op)
+        return self._origin
+
+    def _origin_op(self, db):
+        identity = db.query(NodeIdentity).one_or_none()
+        if identity is None:
+            # Always suffixed: a recreated database restarts at seq 1 and must not
+            # reuse an origin whose earlier sequence numbers peers have applied
+            origin_id = f"{Config.NODE_ID or socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+            identity = NodeIdentity(OriginID=origin_id, CreatedAt=datetime.datetime.utcnow())
+            db.add(identity)
+            db.flush()
+        return identity.OriginID
+
+    def append(self, message):
+        """Logs a message ({action, object_type, data, request_id}) and returns it with origin and seq set."""
+        origin = self.origin
+        seq = self.db_manager.writer.execute(self._append_op, json.dumps(message))
+        return dict(message, origin=origin, seq=seq)
+
+    def _append_op(self, db, message):
+        entry = ReplicationLogEntry(Message=message, CreatedAt=datetime.datetime.utcnow())
+        db.add(entry)
+        db.flush()
+        if entry.Seq % Config.REPLICATION_LOG_TRIM_EVERY == 0:
+            db.execute(delete(ReplicationLogEntry).where(ReplicationLogEntry.Seq <= entry.Seq - Config.REPLICATION_LOG_RETENTION))
+        return entry.Seq
+
+    def read(self, since, until, older_than=None):
+        """Logged messages with since < seq < until, oldest first, optionally only those older than a timestamp."""
+        with self.db_manager.get_db() as db:
+            query = db.query(ReplicationLogEntry).filter(ReplicationLogEntry.Seq > since, ReplicationLogEntry.Seq < until)
+            if older_than is not None:
+                query = query.filter(ReplicationLogEntry.CreatedAt < older_than)
+            entries = query.order_by(ReplicationLogEntry.Seq).limit(Config.REPLICATION_RESEND_BATCH).all()
+            if entries and entries[0].Seq != since + 1 and since + 1 < until:
+                logging.error(f"Replication log no longer holds seq {since + 1}; the peer needs a full resync")
+            return [dict(json.loads(entry.Message), origin=self.origin, seq=entry.Seq) for entry in entries]
+
+    def latest_seq(self):
+        with self.db_manager.get_db() as db:
+            return db.query(func.max(ReplicationLogEntry.Seq)).scalar() or 0
+
+
+class ReplicationReceiver:
+    """
+    Applies replicated operations in per-origin sequence order, exactly once.
+
+    The applied position of every origin is stored with the data it covers,
+    so a redelivered operation is recognised as a duplicate even after a
+    restart. An operation that arrives before its predecessors is held in a
+    bounded per-origin buffer and applied as soon as the gap is filled; the
+    reply tells the sender the position so it can resend what is missing.
+    """
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self._positions = None
+        self._buffers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _origin_lock(self, origin):
+        with self._lock:
+            if self._positions is None:
+                self._positions = self.db_manager.get_replication_positions()
+            return self._locks.setdefault(origin, threading.Lock())
+
+    def receive(self, origin, seq, operations):
+        """Returns {'status', 'high_water'}; status is applied, duplicate, buffered, failed or busy."""
+        with self._origin_lock(origin):
+            high_water = self._positions.get(origin, 0)
+            if seq <= high_water:
+                REPLICATION_DEDUP_HITS.inc()
+                return {'status': 'duplicate', 'high_water': high_water}
+            buffer = self._buffers.setdefault(origin, {})
+            if seq > high_water + 1:
+                if seq not in buffer and len(buffer) >= Config.REPLICATION_REORDER_BUFFER:
+                    # Dropped; the sender resends it once the gap is reported
+                    return {'status': 'busy', 'high_water': high_water}
+                buffer[seq] = operations
+                REPLICATION_BUFFERED.set(len(buffer), origin=origin)
+                return {'status': 'buffered', 'high_water': high_water}
+
+            status = self._apply(origin, seq, operations)
+            if status != 'busy':
+                while (seq := self._positions[origin] + 1) in buffer:
+                    if self._apply(origin, seq, buffer[seq]) == 'busy':
+                        break
+                    del buffer[seq]
+            REPLICATION_BUFFERED.set(len(buffer), origin=origin)
+            return {'status': status, 'high_water': self._positions.get(origin, 0)}
+
+    def _apply(self, origin, seq, operations):
+        try:
+            status = self.db_manager.apply_replicated(origin, seq, operations)
+        except WriteBusyError:
+            return 'busy'
+        except Exception as e:
+            # A poison operation must not stall everything after it from the same origin
+            logging.error(f"Skipping replicated operation {origin}:{seq} that could not be applied: {e}")
+            REPLICATION_APPLY_FAILURES.inc(origin=origin)
+            try:
+                self.db_manager.apply_replicated(origin, seq, None)
+            except WriteBusyError:
+                return 'busy'
+            status = 'failed'
+        self._positions[origin] = seq
+        return status
+
+    def status(self):
+        with self._lock:
+            positions = dict(self._positions if self._positions is not None else self.db_manager.get_replication_positions())
+            buffered = {origin: sorted(buffer) for origin, buffer in self._buffers.items() if buffer}
+        return {'positions': positions, 'buffered': buffered}
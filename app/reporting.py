@@ -0,0 +1,162 @@
+#reporting.py
+
+import time
+import logging
+import datetime
+import itertools
+from array import array
+from collections import Counter, defaultdict
+from sqlalchemy import delete, func, insert, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import BillingRollup, Department
+
+# Invoices without a department are rolled up under this id
+UNASSIGNED_DEPARTMENT = 0
+
+GROUP_COLUMNS = {
+    'day': BillingRollup.Day,
+    'department': BillingRollup.DepartmentID,
+    'status': BillingRollup.PaymentStatus,
+}
+
+
+def _rollup_key(billing):
+    """(day, department, status) bucket of a billing row dict, or None if it has no date."""
+    if not billing or billing.get('DateOfBilling') is None:
+        return None
+    return (
+        billing['DateOfBilling'],
+        billing.get('DepartmentID') or UNASSIGNED_DEPARTMENT,
+        billing.get('PaymentStatus') or 'unknown'
+    )
+
+
+def _upsert_rollup(db, key, count, amount):
+    day, department_id, status = key
+    statement = sqlite_insert(BillingRollup).values(
+        Day=day, DepartmentID=department_id, PaymentStatus=status, InvoiceCount=count, TotalAmount=amount
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=['Day', 'DepartmentID', 'PaymentStatus'],
+        set_={
+            'InvoiceCount': BillingRollup.InvoiceCount + statement.excluded.InvoiceCount,
+            'TotalAmount': BillingRollup.TotalAmount + statement.excluded.TotalAmount,
+        }
+    )
+    db.execute(statement)
+
+
+def apply_billing_delta(db, before, after):
+    """
+    Moves one invoice between rollup buckets inside the caller's transaction.
+
+    `before` is the row as it was (None for an insert) and `after` the row as
+    it is now (None for a delete), both as dicts of Billing columns.
+    """
+    old_key, new_key = _rollup_key(before), _rollup_key(after)
+    old_amount = (before or {}).get('TotalCost') or 0.0
+    new_amount = (after or {}).get('TotalCost') or 0.0
+    if old_key == new_key and old_amount == new_amount:
+        return
+    if old_key is not None:
+        _upsert_rollup(db, old_key, -1, -old_amount)
+    if new_key is not None:
+        _upsert_rollup(db, new_key, 1, new_amount)
+
+
+def recompute_rollups(conn, batch_size=10000, archived=()):
+    """
+    Rebuilds billing_rollups from billings, for backfills and repair.
+
+    Billings are read in batches into typed column arrays with dictionary
+    encoded departments and statuses, then aggregated on a single composite
+    integer key per row instead of materializing ORM objects. `archived`
+    yields the same four columns for billings moved to the cold archive.
+    """
+    started = time.perf_counter()
+    days, departments, statuses, amounts = array('l'), array('l'), array('l'), array('d')
+    department_codes, status_codes = {}, {}
+
+    result = conn.execute(text(
+        'SELECT "DateOfBilling", "DepartmentID", "PaymentStatus", "TotalCost" '
+        'FROM billings WHERE "DateOfBilling" IS NOT NULL'
+    ))
+    batches = iter(lambda: result.fetchmany(batch_size), [])
+    for rows in itertools.chain(batches, [archived]):
+        for day, department_id, status, amount in rows:
+            days.append(datetime.date.fromisoformat(str(day)[:10]).toordinal())
+            departments.append(department_codes.setdefault(department_id or UNASSIGNED_DEPARTMENT, len(department_codes)))
+            statuses.append(status_codes.setdefault(status or 'unknown', len(status_codes)))
+            amounts.append(amount or 0.0)
+
+    department_count, status_count = max(len(department_codes), 1), max(len(status_codes), 1)
+    keys = array('q', (
+        (day * department_count + department) * status_count + status
+        for day, department, status in zip(days, departments, statuses)
+    ))
+    counts = Counter(keys)
+    totals = defaultdict(float)
+    for key, amount in zip(keys, amounts):
+        totals[key] += amount
+
+    department_values = {code: value for value, code in department_codes.items()}
+    status_values = {code: value for value, code in status_codes.items()}
+    rollups = []
+    for composite, count in counts.items():
+        rest, status = divmod(composite, status_count)
+        day, department = divmod(rest, department_count)
+        rollups.append({
+            'Day': datetime.date.fromordinal(day),
+            'DepartmentID': department_values[department],
+            'PaymentStatus': status_values[status],
+            'InvoiceCount': count,
+            'TotalAmount': totals[composite],
+        })
+
+    conn.execute(delete(BillingRollup))
+    if rollups:
+        conn.execute(insert(BillingRollup), rollups)
+    logging.info(
+        f"Recomputed {len(rollups)} billing rollups from {len(keys)} invoices "
+        f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return {'invoices': len(keys), 'rollups': len(rollups)}
+
+
+def revenue_report(db, start=None, end=None, group_by=('day',)):
+    """Revenue and invoice counts from the rollups, grouped by any of day, department and status."""
+    columns = [GROUP_COLUMNS[name] for name in group_by]
+    query = db.query(*columns, func.sum(BillingRollup.InvoiceCount), func.sum(BillingRollup.TotalAmount))
+    if start is not None:
+        query = query.filter(BillingRollup.Day >= start)
+    if end is not None:
+        query = query.filter(BillingRollup.Day <= end)
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+
+    department_names = dict(db.query(Department.DepartmentID, Department.DepartmentName).all())
+    rows = []
+    for values in query.all():
+        row = {}
+        for name, value in zip(group_by, values):
+            if name == 'day':
+                row['day'] = value.isoformat()
+            elif name == 'department':
+                row['department_id'] = value
+                row['department'] = department_names.get(value, 'Unassigned')
+            else:
+                row['status'] = value
+        # Empty buckets left behind by status changes are omitted
+        if not values[-2]:
+            continue
+        row['invoices'] = values[-2]
+        row['revenue'] = round(values[-1] or 0.0, 2)
+        rows.append(row)
+    return {
+        'group_by': list(group_by),
+        'from': start.isoformat() if start else None,
+        'to': end.isoformat() if end else None,
+        'rows': rows,
+        'invoices': sum(row['invoices'] for row in rows),
+        'revenue': round(sum(row['revenue'] for row in rows), 2)
+    }
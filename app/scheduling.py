@@ -0,0 +1,263 @@
+#scheduling.py
+
+import bisect
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+from config import Config
+from exceptions import AppointmentConflictError, InvalidRequestException
+from metrics import registry
+
+SCHEDULE_INDEX_LOADS = registry.counter('schedule_index_loads_total', 'Calendar interval indexes loaded from the database')
+SCHEDULE_CONFLICTS = registry.counter('schedule_conflicts_total', 'Bookings rejected because they overlapped an appointment')
+
+
+def parse_timestamp(value):
+    """Parses an ISO timestamp; offset-aware values are converted to naive UTC, as stored."""
+    if not isinstance(value, datetime.datetime):
+        try:
+            value = datetime.datetime.fromisoformat(str(value))
+        except ValueError as e:
+            raise InvalidRequestException(f"Invalid timestamp: {value}") from e
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class IntervalIndex:
+    """
+    Appointments of one doctor or patient, sorted by start time.
+
+    Every interval is at most `max_duration` long, so the intervals that can
+    overlap [start, end) all start in [start - max_duration, end) and are
+    found with two bisections instead of a scan of the whole calendar.
+    """
+
+    def __init__(self, max_duration):
+        self.max_duration = max_duration
+        self._starts = []
+        self._entries = []  # (start, end, appointment_id), parallel to _starts
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, appointment_id, start, end):
+        self.remove(appointment_id)
+        position = bisect.bisect_right(self._starts, start)
+        self._starts.insert(position, start)
+        self._entries.insert(position, (start, end, appointment_id))
+        self._positions[appointment_id] = start
+        # Legacy rows can exceed the booking limit; widen the search window rather than miss them
+        self.max_duration = max(self.max_duration, end - start)
+
+    def remove(self, appointment_id):
+        start = self._positions.pop(appointment_id, None)
+        if start is None:
+            return
+        position = bisect.bisect_left(self._starts, start)
+        while self._entries[position][2] != appointment_id:
+            position += 1
+        del self._starts[position]
+        del self._entries[position]
+
+    def overlapping(self, start, end):
+        """Returns (start, end, appointment_id) of every interval overlapping [start, end)."""
+        low = bisect.bisect_left(self._starts, start - self.max_duration)
+        high = bisect.bisect_left(self._starts, end)
+        return [entry for entry in self._entries[low:high] if entry[1] > start]
+
+    def busy(self, start, end):
+        """Merged busy periods within [start, end)."""
+        merged = []
+        for entry_start, entry_end, _ in self.overlapping(start, end):
+            entry_start, entry_end = max(entry_start, start), min(entry_end, end)
+            if merged and entry_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], entry_end)
+            else:
+                merged.append([entry_start, entry_end])
+        return merged
+
+
+class Scheduler:
+    """
+    Conflict-checked booking and free-slot search over per-calendar interval indexes.
+
+    A calendar is a doctor's or a patient's appointments. Its index is loaded
+    from SQLite the first time it is needed, kept in a bounded LRU, and kept
+    current by the change log listener, which sees local bookings as well as
+    replicated ones. Bookings touching the same calendar are serialized by a
+    per-calendar lock, and the insert re-checks the overlap inside its
+    transaction, so two nodes' indexes never have to agree for a booking to
+    be safe locally. Indexes are read from SQLite outside the shared lock;
+    changes published while a read is in flight are replayed onto it.
+    """
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.max_duration = datetime.timedelta(minutes=Config.APPOINTMENT_MAX_MINUTES)
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self._calendar_locks = {}
+        self._loading = {}  # calendar -> appointment changes published while it is being read
+        db_manager.change_log.subscribe(self.on_changes)
+
+    def _calendar_lock(self, calendar):
+        with self._lock:
+            return self._calendar_locks.setdefault(calendar, threading.Lock())
+
+    def _index(self, calendar):
+        with self._lock:
+            if (index := self._indexes.get(calendar)) is not None:
+                self._indexes.move_to_end(calendar)
+                return index
+            # Registered before the read: a change committed after the read's snapshot
+            # is published after this point, so it is buffered and replayed below
+            missed = []
+            self._loading.setdefault(calendar, []).append(missed)
+
+        # The read runs without the lock, so on_changes on the writer thread never waits for it
+        try:
+            intervals = self.db_manager.get_appointment_intervals(*calendar)
+        except Exception:
+            with self._lock:
+                self._stop_loading(calendar, missed)
+            raise
+        index = IntervalIndex(self.max_duration)
+        for appointment_id, start, end in intervals:
+            index.add(appointment_id, start, end)
+
+        with self._lock:
+            self._stop_loading(calendar, missed)
+            for change in missed:
+                self._apply_change({calendar: index}, change)
+            if (loaded := self._indexes.get(calendar)) is not None:
+                # Another request loaded it first and has been kept current since
+                index = loaded
+            else:
+                self._indexes[calendar] = index
+                SCHEDULE_INDEX_LOADS.inc(calendar=calendar[0])
+                while len(self._indexes) > Config.SCHEDULE_INDEX_CACHE_SIZE:
+                    self._indexes.popitem(last=False)
+            self._indexes.move_to_end(calendar)
+            return index
+
+    def _stop_loading(self, calendar, missed):
+        # By identity: buffers of concurrent loads can be equal
+        buffers = [buffer for buffer in self._loading[calendar] if buffer is not missed]
+        if buffers:
+            self._loading[calendar] = buffers
+        else:
+            del self._loading[calendar]
+
+    def _overlapping(self, calendar, start, end):
+        index = self._index(calendar)
+        with self._lock:
+            return index.overlapping(start, end)
+
+    def validate(self, start, end):
+        if end <= start:
+            raise InvalidRequestException('EndTime must be after StartTime')
+        if end - start > self.max_duration:
+            raise InvalidRequestException(f'Appointments cannot be longer than {Config.APPOINTMENT_MAX_MINUTES} minutes')
+
+    def book(self, appointment_data):
+        """Inserts an appointment if neither the doctor nor the patient is busy; returns its id."""
+        start = parse_timestamp(appointment_data['StartTime'])
+        if appointment_data.get('EndTime'):
+            end = parse_timestamp(appointment_data['EndTime'])
+        else:
+            minutes = int(appointment_data.get('DurationMinutes', Config.APPOINTMENT_DEFAULT_MINUTES))
+            end = start + datetime.timedelta(minutes=minutes)
+        self.validate(start, end)
+
+        # Locks are taken in a fixed order so two bookings can never deadlock
+        calendars = sorted({('DoctorID', appointment_data['DoctorID']), ('PatientID', appointment_data['PatientID'])})
+        locks = [self._calendar_lock(calendar) for calendar in calendars]
+        for lock in locks:
+            lock.acquire()
+        try:
+            conflicts = []
+            for calendar in calendars:
+                conflicts.extend(
+                    {'AppointmentID': appointment_id, calendar[0]: calendar[1],
+                     'StartTime': other_start.isoformat(), 'EndTime': other_end.isoformat()}
+                    for other_start, other_end, appointment_id in self._overlapping(calendar, start, end)
+                )
+            if conflicts:
+                SCHEDULE_CONFLICTS.inc()
+                raise AppointmentConflictError(conflicts)
+            booking = dict(appointment_data, StartTime=start, EndTime=end)
+            # The committed row reaches the indexes through on_changes
+            return self.db_manager.insert_appointment(booking, check_conflicts=True)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def availability(self, doctor_id, day, duration, patient_id=None):
+        """Free periods and bookable slot starts of a doctor (and optionally a patient) on one day."""
+        day_start = datetime.datetime.combine(day, datetime.time(Config.SCHEDULE_DAY_START_HOUR))
+        day_end = datetime.datetime.combine(day, datetime.time(Config.SCHEDULE_DAY_END_HOUR))
+        calendars = [('DoctorID', doctor_id)] + ([('PatientID', patient_id)] if patient_id else [])
+        busy = []
+        for calendar in calendars:
+            index = self._index(calendar)
+            with self._lock:
+                busy.extend(index.busy(day_start, day_end))
+        busy.sort()
+
+        free, cursor = [], day_start
+        for busy_start, busy_end in busy:
+            if busy_start > cursor:
+                free.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+        if cursor < day_end:
+            free.append((cursor, day_end))
+
+        step = datetime.timedelta(minutes=Config.SCHEDULE_SLOT_STEP_MINUTES)
+        slots = []
+        for free_start, free_end in free:
+            # Slots start on the step grid of the working day
+            offset = (free_start - day_start) % step
+            slot = free_start if not offset else free_start + (step - offset)
+            while slot + duration <= free_end:
+                slots.append(slot)
+                slot += step
+        return {
+            'date': day.isoformat(),
+            'free': [{'StartTime': s.isoformat(), 'EndTime': e.isoformat()} for s, e in free],
+            'slots': [slot.isoformat() for slot in slots]
+        }
+
+    def on_changes(self, changes):
+        # Change log listener: apply appointment changes to the indexes already loaded
+        appointment_changes = [change for change in changes if change['table'] == 'appointments']
+        if not appointment_changes:
+            return
+        with self._lock:
+            for change in appointment_changes:
+                self._apply_change(self._indexes, change)
+                for buffers in self._loading.values():
+                    for missed in buffers:
+                        missed.append(change)
+
+    @staticmethod
+    def _apply_change(indexes, change):
+        row = change['row'] or {}
+        appointment_id = int(change['row_id'])
+        if change['operation'] != 'insert':
+            # An update may have moved it to another doctor or patient
+            for index in indexes.values():
+                index.remove(appointment_id)
+        if change['operation'] == 'delete' or not row.get('StartTime') or not row.get('EndTime'):
+            return
+        for column in ('DoctorID', 'PatientID'):
+            index = indexes.get((column, row.get(column)))
+            if index is not None:
+                index.add(appointment_id, parse_timestamp(row['StartTime']), parse_timestamp(row['EndTime']))
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+        logging.info("Cleared cached appointment calendars")
@@ -0,0 +1,54 @@
+#services.py
+
+import threading
+from flask import current_app, has_app_context
+from database import DatabaseManager
+from utils import ReplicationStrategy
+from replication_log import ReplicationReceiver
+from scheduling import Scheduler
+from analytics import AnalyticsSnapshot
+from config import Config
+
+# Process-wide singletons, built on first use so importing the app does no
+# database or file I/O and every module shares one engine.
+_lock = threading.RLock()
+_instances = {}
+
+
+def _registry():
+    # An app with its own registry (a node of the in-process cluster simulator)
+    # keeps its services apart from every other app in the process
+    if has_app_context():
+        return current_app.extensions.get('services', _instances)
+    return _instances
+
+
+def _get(name, factory):
+    instances = _registry()
+    instance = instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = instances.get(name)
+            if instance is None:
+                instance = instances[name] = factory()
+    return instance
+
+
+def get_db_manager():
+    return _get('db_manager', DatabaseManager)
+
+
+def get_replication_strategy():
+    return _get('replication_strategy', lambda: ReplicationStrategy(get_db_manager()))
+
+
+def get_replication_receiver():
+    return _get('replication_receiver', lambda: ReplicationReceiver(get_db_manager()))
+
+
+def get_scheduler():
+    return _get('scheduler', lambda: Scheduler(get_db_manager()))
+
+
+def get_analytics():
+    return _get('analytics', lambda: AnalyticsSnapshot(get_db_manager(), live=Config.ANALYTICS_SNAPSHOT))
@@ -2,42 +2,64 @@ import logging
 import requests
 from abc import ABC, abstractmethod
 import json
-import os
+import time
+import asyncio
+import datetime
+import threading
+import weakref
 from config import Config
+from metrics import REPLICATION_SEND_LATENCY, REPLICATION_SEND_FAILURES, REPLICATION_PEER_APPLY_FAILURES
+from replication_log import ReplicationLog, REPLICATION_RESENT
+
+try:
+    import httpx
+except ImportError:  # optional dependency; peers are then called through requests on worker threads
+    httpx = None
+
+REPLICATION_HEADERS = {'Content-Type': 'application/json'}
+if Config.REPLICATION_TOKEN:
+    REPLICATION_HEADERS['X-Replication-Token'] = Config.REPLICATION_TOKEN
+
+def _receiver_reply(url, response):
+    """
+    The receiver status of an error reply: a message the peer could not apply is
+    answered with 422 'failed', and older peers also answer 'busy' with 503.
+    """
+    if response.status_code not in (422, 503):
+        return None
+    try:
+        reply = response.json()
+    except ValueError:
+        return None
+    if not isinstance(reply, dict) or reply.get('status') not in ('busy', 'failed'):
+        return None
+    if reply['status'] == 'failed':
+        # Delivered, but skipped by the peer; sending it again would fail the same way
+        REPLICATION_PEER_APPLY_FAILURES.inc(peer=url)
+        logging.error(f"{url} could not apply a replicated message and skipped it (position {reply.get('high_water')})")
+    return reply
+
+def _delivered(reply):
+    return reply is not None and reply.get('status') != 'failed'
 
 class ReplicationStrategy(ABC):
 
-    def __init__(self) -> None:
-        self.message_queue_url = Config.NODES
-        self.processed_requests = set() 
-        self.data_file = os.path.join(Config.DATA_DIR, "processed_requests.json")
-
-        # Load existing data (optional)
-        try:
-            self._load_data()
-        except FileNotFoundError:
-            self._create_empty_file()
-    def _create_empty_file(self):
-        with open(self.data_file, 'w') as file:
-            json.dump([], file)
-    def _load_data(self):
-        with open(self.data_file, 'r') as f:  
-             self.processed_requests = set(json.loads(f.read()))
-
-    def _save_data(self):
-        with open(self.data_file, 'w') as f:  
-             f.write(json.dumps(list(self.processed_requests)))
+    def __init__(self, db_manager, nodes=None, transport=None) -> None:
+        self.message_queue_url = Config.NODES if nodes is None else nodes
+        # Delivers to peers instead of HTTP when set: an object whose post(url, data) returns a
+        # requests.Response or raises a requests exception, so replies are handled as over HTTP
+        self.transport = transport
+        # Sequences every outgoing message per origin; peers dedupe and order by (origin, seq)
+        self.log = ReplicationLog(db_manager)
+        # Pooled httpx clients, one per event loop: a client's connections belong to the loop that opened them
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_clients_lock = threading.Lock()
 
     @abstractmethod
     def send_message(self, data: str) -> None:
         pass
 
-    def replicate(self, action: str, data: str, object_type: str, request_id: str) -> None:
-        """
-        Replicates an operation to message queue nodes.
-        Validates data, checks for duplicates, and sends the message.
-        """
-
+    def _prepare(self, action: str, data: str, object_type: str, request_id: str):
         message = {
             "action": action,
             "data": data,
@@ -50,10 +72,33 @@ class ReplicationStrategy(ABC):
             self._validate_message_data(message)
         except (ValueError, json.JSONDecodeError) as e:
             logging.error(f"Error validating message data: {e}")
+            return None
+        # Logged before it is sent, so a peer that misses it can be sent it again
+        return json.dumps(self.log.append(message))
+
+    def _log_replicated(self, action, data, object_type, request_id):
+        if Config.LOG_REPLICATION_PAYLOADS:
+            logging.debug("Replicated %s operation for %s: %s (Request ID: %s)", action, object_type, data, request_id)
+        else:
+            logging.info("Replicated %s operation for %s (Request ID: %s)", action, object_type, request_id)
+
+    def replicate(self, action: str, data: str, object_type: str, request_id: str) -> None:
+        """
+        Replicates an operation to message queue nodes.
+        Validates data, checks for duplicates, and sends the message.
+        """
+        if (message := self._prepare(action, data, object_type, request_id)) is None:
             return
+        self.send_message(message)
+        self._log_replicated(action, data, object_type, request_id)
 
-        self.send_message(json.dumps(message))
-        logging.info(f"Replicated {action} operation for {object_type}: {data} (Request ID: {request_id})")
+    async def replicate_async(self, action: str, data: str, object_type: str, request_id: str) -> None:
+        """Like replicate(), but sends to every peer concurrently without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        if (message := await loop.run_in_executor(None, self._prepare, action, data, object_type, request_id)) is None:
+            return
+        await self.send_message_async(message)
+        self._log_replicated(action, data, object_type, request_id)
 
     def _validate_message_data(self, message: dict) -> None:
         """
@@ -71,40 +116,105 @@ class ReplicationStrategy(ABC):
         #if not isinstance(message['object_type'], str):
         #    raise ValueError("Invalid data type for 'object_type'")
 
+    def _resend_gap(self, url: str, reply, seq: int) -> None:
+        """
+        Sends a peer the logged messages it reported missing before `seq`, then
+        `seq` itself if the peer answered busy, since it dropped the message.
+        """
+        if not reply or reply.get('status') not in ('buffered', 'busy'):
+            return
+        # Messages logged moments ago are most likely still in flight from another request
+        older_than = datetime.datetime.utcnow() - datetime.timedelta(seconds=Config.REPLICATION_RESEND_GRACE_SECONDS)
+        try:
+            for message in self.log.read(reply.get('high_water', 0), seq, older_than):
+                REPLICATION_RESENT.inc(peer=url)
+                if self._post(url, json.dumps(message)) is None:
+                    return
+            if reply['status'] == 'busy':
+                # Once: if the peer is still busy, the next message from this origin reports the gap again
+                for message in self.log.read(seq - 1, seq + 1):
+                    REPLICATION_RESENT.inc(peer=url)
+                    self._post(url, json.dumps(message))
+        except Exception as e:
+            # The gap is reported again with the next message
+            logging.error(f"Error resending replication log to {url}: {e}")
+
+    def _post(self, url: str, data: str):
+        """Posts one message to a peer; returns its JSON reply, or None if delivery failed."""
+        started = time.perf_counter()
+        try:
+            if self.transport is not None:
+                response = self.transport.post(url, data)
+            else:
+                response = requests.post(
+                    f"{url}/replicate",
+                    data=data,
+                    headers=REPLICATION_HEADERS,
+                    timeout=Config.REPLICATION_TIMEOUT_SECONDS,
+                    allow_redirects=False
+                )
+            if (reply := _receiver_reply(url, response)) is not None:
+                return reply
+            response.raise_for_status()  # Raise exception for non-2xx status codes
+            logging.debug("Successfully sent message to %s", url)
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            REPLICATION_SEND_FAILURES.inc(peer=url)
+            logging.error(f"Error sending message to {url}: {e}")
+            return None
+        finally:
+            REPLICATION_SEND_LATENCY.observe(time.perf_counter() - started, peer=url)
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._async_clients_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = httpx.AsyncClient(
+                    timeout=Config.REPLICATION_TIMEOUT_SECONDS, follow_redirects=False
+                )
+        return client
+
+    async def _post_async(self, client, url: str, data: str):
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"{url}/replicate", content=data, headers=REPLICATION_HEADERS)
+            if (reply := _receiver_reply(url, response)) is not None:
+                return reply
+            response.raise_for_status()
+            logging.debug("Successfully sent message to %s", url)
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            REPLICATION_SEND_FAILURES.inc(peer=url)
+            logging.error(f"Error sending message to {url}: {e}")
+            return None
+        finally:
+            REPLICATION_SEND_LATENCY.observe(time.perf_counter() - started, peer=url)
+
     def send_message(self, data: str) -> bool:
         """
         Sends the message to all message queue nodes, handling potential errors.
-        Checks for duplicates, updates the set, and saves data after successful processing.
+        A peer that reports a gap before this message is sent the missing ones from the log.
         """
-
-        headers = {'Content-Type': 'application/json'}
-
-        try:
-            message = json.loads(data)
-            message_id = message['request_id']
-
-            if message_id in self.processed_requests:
-                logging.info(f"Ignoring duplicate request {message_id}")
-                return False
-
-            self.processed_requests.add(message_id)
-
-            success = True
-            for url in self.message_queue_url:  
-                modified_url = f"{url}/replicate"
-                try:
-                    response = requests.post(modified_url, data=data, headers=headers)
-                    response.raise_for_status()  # Raise exception for non-2xx status codes
-                    logging.info(f"Successfully sent message to {url}")
-                except requests.exceptions.RequestException as e:
-                    logging.error(f"Error sending message to {url}: {e}")
-                    success = False
-
-            if success:
-                self._save_data()
-
-        except (json.JSONDecodeError, ValueError) as e:
-            logging.error(f"Error processing request: {e}")
-            return False
-
-        return True
+        seq = json.loads(data)['seq']
+        replies = []
+        for url in self.message_queue_url:
+            reply = self._post(url, data)
+            self._resend_gap(url, reply, seq)
+            replies.append(reply)
+        return all(_delivered(reply) for reply in replies)
+
+    async def send_message_async(self, data: str) -> bool:
+        """send_message() with all peers contacted at once; the slowest peer bounds the latency."""
+        seq = json.loads(data)['seq']
+        loop = asyncio.get_running_loop()
+        if httpx is not None and self.transport is None:
+            client = self._async_client()
+            replies = await asyncio.gather(*(self._post_async(client, url, data) for url in self.message_queue_url))
+        else:
+            replies = await asyncio.gather(*(loop.run_in_executor(None, self._post, url, data) for url in self.message_queue_url))
+        # Gaps are rare; the resend reads the log and posts on a worker thread
+        for url, reply in zip(self.message_queue_url, replies):
+            if reply and reply.get('status') in ('buffered', 'busy'):
+                await loop.run_in_executor(None, self._resend_gap, url, reply, seq)
+        return all(_delivered(reply) for reply in replies)
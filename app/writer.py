@@ -0,0 +1,164 @@
+#writer.py
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from metrics import registry
+
+WRITE_GROUP_SIZE = registry.histogram('db_write_group_size', 'Write operations committed together in one transaction', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+WRITE_COMMIT_DURATION = registry.histogram('db_write_commit_seconds', 'Time to run and commit one write group')
+WRITE_QUEUE_DEPTH = registry.gauge('db_write_queue_depth', 'Write operations waiting for the writer thread')
+WRITE_REJECTED = registry.counter('db_write_rejected_total', 'Write operations rejected because the queue was full or the wait timed out')
+
+# Queued by stop(): the writer commits what was queued before it, then exits
+_STOP = object()
+
+
+class WriteBusyError(Exception):
+    """Raised when a write was rejected or withdrawn before it ran, so it was not committed; the caller should retry later."""
+    pass
+
+
+class WriteCoordinator:
+    """
+    Single writer thread with group commit.
+
+    Callers submit operations, callables taking an open session, and block
+    until their group has committed. The writer runs every queued operation
+    of a group in its own SAVEPOINT, so one failing operation is rolled back
+    and reported to its caller alone, then commits the whole group at once:
+    one fsync and one acquisition of SQLite's write lock for many requests.
+    Change log entries are published after the commit, before any caller is
+    released.
+    """
+
+    def __init__(self, db_manager, max_batch, max_wait, queue_limit, timeout):
+        self.db_manager = db_manager
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=queue_limit)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Started on first use so constructing a DatabaseManager starts no threads
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                    self._thread.start()
+
+    def execute(self, operation, *args):
+        """Runs operation(db, *args) in the next write group and returns its result."""
+        if threading.current_thread() is self._thread:
+            # A change listener writing from the writer thread cannot wait for itself
+            return self._execute_alone(operation, args)
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((operation, args, future))
+        except queue.Full:
+            WRITE_REJECTED.inc(reason='queue_full')
+            raise WriteBusyError('Write queue is full')
+        WRITE_QUEUE_DEPTH.set(self._queue.qsize())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError as e:
+            # Withdrawn while still queued, so it can never commit; once the writer
+            # has started it, wait for the real outcome rather than report a guess
+            if not future.cancel():
+                return future.result()
+            WRITE_REJECTED.inc(reason='timeout')
+            raise WriteBusyError('Write did not complete in time') from e
+
+    def _execute_alone(self, operation, args):
+        db = self.db_manager.get_session()
+        try:
+            result = operation(db, *args)
+            self.db_manager._commit(db)
+            return result
+        finally:
+            db.close()
+
+    def stop(self, timeout=None):
+        """Ends the writer thread once the operations queued so far are committed; a later execute() starts a new one."""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _next_group(self):
+        """Returns (operations, whether stop() was requested)."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        group = [first]
+        deadline = time.monotonic() + self.max_wait
+        stopping = False
+        while len(group) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            group.append(item)
+        WRITE_QUEUE_DEPTH.set(self._queue.qsize())
+        return group, stopping
+
+    def _run(self):
+        while True:
+            group, stopping = self._next_group()
+            if group:
+                try:
+                    self._commit_group(group)
+                except Exception as e:
+                    logging.error(f"Write group failed: {e}")
+                    for _, _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+            if stopping:
+                return
+
+    def _commit_group(self, group):
+        started = time.perf_counter()
+        outcomes = []
+        db = self.db_manager.get_session()
+        try:
+            pending = db.info.setdefault('pending_changes', [])
+            for operation, args, future in group:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                mark = len(pending)
+                try:
+                    with db.begin_nested():
+                        outcomes.append((future, operation(db, *args), None))
+                except Exception as e:
+                    # Only this operation's changes were rolled back with its savepoint
+                    del pending[mark:]
+                    outcomes.append((future, None, e))
+            try:
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logging.error(f"Group commit of {len(outcomes)} writes failed: {e}")
+                outcomes = [(future, None, error or e) for future, _, error in outcomes]
+            else:
+                self.db_manager.change_log.publish(db.info.pop('pending_changes', []))
+        finally:
+            db.close()
+            WRITE_GROUP_SIZE.observe(len(group))
+            WRITE_COMMIT_DURATION.observe(time.perf_counter() - started)
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
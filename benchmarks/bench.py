@@ -0,0 +1,282 @@
+#bench.py
+"""
+Load generator and benchmark suite for a local cluster.
+
+    python benchmarks/bench.py --nodes 3 --ops 500 --concurrency 16 > result.json
+
+Starts the nodes, runs every selected workload and prints one JSON document
+with throughput, latency percentiles and replication convergence time, so
+results can be diffed between commits.
+"""
+
+import json
+import time
+import random
+import argparse
+import functools
+import itertools
+import threading
+import subprocess
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+from cluster import LocalCluster, REPLICATION_TOKEN, REPO_ROOT
+
+ADMIN_CREDENTIALS = {'Username': 'admin', 'Password': 'admin123'}
+DEPARTMENTS = ['Emergency', 'Surgery', 'Gynecology', 'Pediatrics', 'Radiology', 'Pathology', 'Neurology']
+SEARCH_TERMS = ['a', 'e', 'bench', 'patient', 'zz']
+
+_phone_numbers = itertools.count(700000000)
+_phone_lock = threading.Lock()
+
+
+def next_phone_number():
+    with _phone_lock:
+        return next(_phone_numbers)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        # Requests refused by admission control (429/503), reported apart from failures
+        self.shed = 0
+
+    def timed(self, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = func(*args, **kwargs)
+            ok = response.status_code < 400
+        except requests.exceptions.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies.append(elapsed)
+            if response is not None and response.status_code in (429, 503):
+                self.shed += 1
+            elif not ok:
+                self.errors += 1
+        return response
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+        return {
+            'ops': len(latencies),
+            'errors': self.errors,
+            'shed': self.shed,
+            'duration_s': round(duration, 3),
+            'throughput_ops_s': round(len(latencies) / duration, 2) if duration else None,
+            'latency_ms': {
+                'p50': to_ms(percentile(latencies, 0.50)),
+                'p95': to_ms(percentile(latencies, 0.95)),
+                'p99': to_ms(percentile(latencies, 0.99)),
+                'max': to_ms(latencies[-1] if latencies else None)
+            }
+        }
+
+
+def login(node):
+    session = requests.Session()
+    response = session.post(f"{node.url}/login", data=ADMIN_CREDENTIALS, timeout=10)
+    response.raise_for_status()
+    return session
+
+
+def run_parallel(nodes, ops, concurrency, operation):
+    """Runs `ops` calls of operation(session, node, i, recorder) spread over nodes and threads."""
+    recorder = Recorder()
+    counter = itertools.count()
+    sessions = threading.local()
+
+    def worker(worker_index):
+        node = nodes[worker_index % len(nodes)]
+        if not hasattr(sessions, 'session'):
+            sessions.session = login(node)
+        while (i := next(counter)) < ops:
+            operation(sessions.session, node, i, recorder)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return recorder.summary(time.perf_counter() - started)
+
+
+def register_patient(session, node, i, recorder):
+    username = f"bench-{uuid4().hex[:12]}"
+    response = recorder.timed(
+        session.post, f"{node.url}/users",
+        json={'Username': username, 'Password': 'secret', 'Role': 'patient'}, timeout=30
+    )
+    if response is None or response.status_code >= 400:
+        return
+    recorder.timed(
+        session.post, f"{node.url}/patients",
+        json={
+            'PatientID': response.json()['UserID'],
+            'Name': f"Bench Patient {i}",
+            'DateOfBirth': f"19{random.randint(40, 99)}-0{random.randint(1, 9)}-1{random.randint(0, 9)}",
+            'Gender': random.choice(['Male', 'Female']),
+            'PhoneNumber': next_phone_number()
+        },
+        timeout=30
+    )
+
+
+def register_doctor(session, node, i, recorder):
+    username = f"bench-doc-{uuid4().hex[:12]}"
+    response = recorder.timed(
+        session.post, f"{node.url}/users",
+        json={'Username': username, 'Password': 'secret', 'Role': 'doctor'}, timeout=30
+    )
+    if response is None or response.status_code >= 400:
+        return
+    recorder.timed(
+        session.post, f"{node.url}/doctors",
+        json={
+            'DoctorID': response.json()['UserID'],
+            'DoctorName': f"Dr Bench {i}",
+            'Specialization': 'General',
+            'PhoneNumber': next_phone_number(),
+            'DepartmentName': random.choice(DEPARTMENTS)
+        },
+        timeout=30
+    )
+
+
+READ_MIX = [
+    ('/patients', 40),
+    ('/patients/display', 20),
+    ('/doctors/display', 20),
+    ('/user/info', 15),
+    ('/dashboard/admin', 5),
+]
+
+
+def dashboard_read(session, node, i, recorder):
+    paths, weights = zip(*READ_MIX)
+    path = random.choices(paths, weights)[0]
+    recorder.timed(session.get, f"{node.url}{path}", timeout=30)
+
+
+def search(session, node, i, recorder):
+    term = random.choice(SEARCH_TERMS)
+    recorder.timed(session.get, f"{node.url}/patients/search", params={'query': term}, timeout=30)
+
+
+def replication_storm(peers, session, node, i, recorder):
+    # Acts as an origin node fanning writes out to every peer's /replicate at once
+    user_id = f"p{uuid4().hex[:10]}"
+    headers = {'X-Replication-Token': REPLICATION_TOKEN}
+    messages = [
+        {
+            'action': 'insert', 'object_type': 'user', 'request_id': uuid4().hex,
+            'data': {'UserID': user_id, 'Username': f"storm-{user_id}", 'Password': 'secret', 'Role': 'patient'}
+        },
+        {
+            'action': 'insert', 'object_type': 'patient', 'request_id': uuid4().hex,
+            'data': {
+                'PatientID': user_id, 'Name': f"Storm {i}", 'DateOfBirth': '1980-01-01',
+                'Gender': 'Female', 'PhoneNumber': next_phone_number()
+            }
+        }
+    ]
+    for message in messages:
+        for peer in peers:
+            recorder.timed(requests.post, f"{peer.url}/replicate", headers=headers, json=message, timeout=30)
+
+
+def login_burst(session, node, i, recorder):
+    recorder.timed(requests.post, f"{node.url}/login", data=ADMIN_CREDENTIALS, timeout=30)
+
+
+def patient_counts(sessions, nodes):
+    counts = []
+    for session, node in zip(sessions, nodes):
+        response = session.get(f"{node.url}/patients", timeout=30)
+        counts.append(len(response.json()) if response.status_code == 200 else None)
+    return counts
+
+
+def measure_convergence(nodes, timeout):
+    """Seconds until every node reports the same patient count, or None on timeout."""
+    sessions = [login(node) for node in nodes]
+    started = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        counts = patient_counts(sessions, nodes)
+        if None not in counts and len(set(counts)) == 1:
+            return {'seconds': round(time.perf_counter() - started, 3), 'patients': counts[0]}
+        time.sleep(0.05)
+    return {'seconds': None, 'patients': patient_counts(sessions, nodes)}
+
+
+WORKLOADS = {
+    'patient_registration': register_patient,
+    'doctor_registration': register_doctor,
+    'dashboard_reads': dashboard_read,
+    'search': search,
+    'replication_storm': replication_storm,
+    'login_burst': login_burst,
+}
+WRITE_WORKLOADS = {'patient_registration', 'doctor_registration', 'replication_storm'}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    selected = args.workloads or list(WORKLOADS)
+    report = {
+        'revision': git_revision(),
+        'nodes': args.nodes,
+        'ops': args.ops,
+        'concurrency': args.concurrency,
+        'workloads': {}
+    }
+    with LocalCluster(args.nodes, keep=args.keep) as cluster:
+        report['node_ready_s'] = [round(node.ready_seconds, 3) for node in cluster.nodes]
+        for name in selected:
+            operation = WORKLOADS[name]
+            if name == 'replication_storm':
+                operation = functools.partial(operation, cluster.nodes)
+            result = run_parallel(cluster.nodes, args.ops, args.concurrency, operation)
+            if name in WRITE_WORKLOADS:
+                result['convergence'] = measure_convergence(cluster.nodes, args.convergence_timeout)
+            report['workloads'][name] = result
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--ops', type=int, default=200, help='operations per workload')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workloads', nargs='*', choices=sorted(WORKLOADS))
+    parser.add_argument('--convergence-timeout', type=float, default=30)
+    parser.add_argument('--keep', action='store_true', help='keep node databases and logs')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
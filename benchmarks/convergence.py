@@ -0,0 +1,249 @@
+#convergence.py
+"""
+Replication convergence and failover scenarios on an in-process cluster.
+
+    python benchmarks/convergence.py --nodes 3 --ops 300 --scenarios lossy partition > result.json
+
+Runs a write workload against a fresh SimulatedCluster per scenario while
+the scenario's faults are active, then heals the network and reports
+whether and how fast every node converged, with the replication messages
+sent per client write, so changes to the replication path can be compared
+between commits without real containers.
+"""
+
+import ast
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import Recorder, git_revision, next_phone_number
+from simulator import SimulatedCluster, Faults
+from config import Config
+
+# name -> (Faults arguments, [(fraction of ops done, action, node index)])
+SCENARIOS = {
+    'baseline': ({}, []),
+    'slow_links': ({'latency_ms': 5, 'jitter_ms': 20}, []),
+    'lossy': ({'drop': 0.1, 'duplicate': 0.05}, []),
+    'reordering': ({'late': 0.15, 'late_ms': 150}, []),
+    'partition': ({}, [(0.3, 'partition', 0), (0.7, 'heal', None)]),
+    'failover': ({}, [(0.3, 'fail', 0), (0.7, 'recover', 0)]),
+    # Reordering into a reorder buffer that fills up: peers answer busy and must be resent the gap
+    'small_buffer': ({'late': 0.15, 'late_ms': 150}, []),
+}
+
+# name -> Config settings applied to every node for that scenario only (after --set)
+SCENARIO_SETTINGS = {
+    'small_buffer': {'REPLICATION_REORDER_BUFFER': 2},
+}
+
+# Client writes: registering a patient, billing one, deleting one (a compound operation)
+WRITE_MIX = [('register', 60), ('bill', 25), ('delete', 15)]
+
+def register_patient(client, owned, recorder):
+    patient_id = f"p{uuid4().hex[:10]}"
+    response = recorder.timed(client.post, '/patients', json={
+        'PatientID': patient_id,
+        'Name': f"Sim Patient {patient_id}",
+        'DateOfBirth': f"19{random.randint(40, 99)}-0{random.randint(1, 9)}-1{random.randint(0, 9)}",
+        'Gender': random.choice(['Male', 'Female']),
+        'PhoneNumber': next_phone_number()
+    })
+    if response is not None and response.status_code < 400:
+        owned.append(patient_id)
+
+
+def bill_patient(client, owned, recorder):
+    if not owned:
+        return register_patient(client, owned, recorder)
+    recorder.timed(client.post, '/billings', json={
+        'PatientID': random.choice(owned),
+        'TotalCost': round(random.uniform(10, 500), 2),
+        'DepartmentName': random.choice(['Emergency', 'Surgery', 'Radiology'])
+    })
+
+
+def delete_patient(client, owned, recorder):
+    if not owned:
+        return register_patient(client, owned, recorder)
+    recorder.timed(client.delete, f"/patients/{owned.pop(random.randrange(len(owned)))}")
+
+
+OPERATIONS = {'register': register_patient, 'bill': bill_patient, 'delete': delete_patient}
+
+
+class EventSchedule:
+    """Fires scenario events once each, in order, as the workload passes their fraction of ops."""
+
+    def __init__(self, cluster, events, ops):
+        self.cluster = cluster
+        self.pending = sorted((int(fraction * ops), action, index) for fraction, action, index in events)
+        self.fired = []
+        self._lock = threading.Lock()
+
+    def advance(self, done):
+        with self._lock:
+            while self.pending and self.pending[0][0] <= done:
+                at, action, index = self.pending.pop(0)
+                node = self.cluster.nodes[index] if index is not None else None
+                started = time.perf_counter()
+                if action == 'partition':
+                    self.cluster.partition([node])
+                elif action == 'heal':
+                    self.cluster.heal()
+                elif action == 'fail':
+                    self.cluster.fail(node)
+                elif action == 'recover':
+                    self.cluster.recover(node)
+                self.fired.append({'at_op': at, 'action': action, 'node': node.name if node else None,
+                                   'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
+
+
+def run_workload(cluster, ops, concurrency, schedule):
+    """Runs `ops` client writes spread over the live nodes; patients are written to through the node that created them."""
+    recorder = Recorder()
+    counter = itertools.count()
+    owned = {node.name: [] for node in cluster.nodes}
+    operations, weights = zip(*WRITE_MIX)
+
+    def worker(worker_index):
+        clients = {}
+        while (i := next(counter)) < ops:
+            schedule.advance(i)
+            live = cluster.live_nodes()
+            node = live[(worker_index + i) % len(live)]
+            # A restarted node is a new app, so its clients log in again
+            if clients.get(node.name, (None,))[0] is not node.app:
+                clients[node.name] = (node.app, cluster.client(node))
+            operation = random.choices(operations, weights)[0]
+            OPERATIONS[operation](clients[node.name][1], owned[node.name], recorder)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    schedule.advance(ops)
+    return recorder.summary(time.perf_counter() - started)
+
+
+def measure_convergence(cluster, timeout, probe_interval):
+    """
+    Heals every fault and waits until all nodes hold the same rows.
+
+    A node only repairs a gap when the next message from the same origin
+    arrives, so every probe_interval each node makes one more write until
+    the cluster converges or `timeout` passes.
+    """
+    cluster.heal()
+    for node in cluster.nodes:
+        if node.name in cluster.faults.down:
+            cluster.recover(node)
+    faults = cluster.faults
+    faults.drop = faults.duplicate = faults.late = 0.0
+
+    clients = [cluster.client(node) for node in cluster.nodes]
+    started = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    next_probe = time.monotonic() + probe_interval
+    probes = 0
+    while True:
+        converged, diverged = cluster.converged()
+        if converged:
+            return {'seconds': round(time.perf_counter() - started, 3), 'probe_rounds': probes}
+        if time.monotonic() >= deadline:
+            return {'seconds': None, 'probe_rounds': probes, 'diverged_row_counts': diverged}
+        if time.monotonic() >= next_probe:
+            probes += 1
+            for client in clients:
+                register_patient(client, [], Recorder())
+            next_probe = time.monotonic() + probe_interval
+        time.sleep(0.05)
+
+
+def run_scenario(name, args):
+    fault_args, events = SCENARIOS[name]
+    settings = SCENARIO_SETTINGS.get(name, {})
+    previous = {setting: getattr(Config, setting) for setting in settings}
+    for setting, value in settings.items():
+        setattr(Config, setting, value)
+    try:
+        return _run_scenario(fault_args, events, settings, args)
+    finally:
+        for setting, value in previous.items():
+            setattr(Config, setting, value)
+
+
+def _run_scenario(fault_args, events, settings, args):
+    with SimulatedCluster(args.nodes, Faults(seed=args.seed, **fault_args)) as cluster:
+        schedule = EventSchedule(cluster, events, args.ops)
+        writes = run_workload(cluster, args.ops, args.concurrency, schedule)
+        messages = dict(cluster.stats)
+        ok_writes = writes['ops'] - writes['errors'] - writes['shed']
+        messages['per_write'] = round(messages.get('sent', 0) / ok_writes, 2) if ok_writes else None
+
+        cluster.reset_stats()
+        convergence = measure_convergence(cluster, args.convergence_timeout, args.probe_interval)
+        convergence['messages'] = dict(cluster.stats)
+        return {
+            'faults': fault_args,
+            'settings': settings,
+            'events': schedule.fired,
+            'writes': writes,
+            'messages': messages,
+            'convergence': convergence
+        }
+
+
+def _setting(assignment):
+    name, _, value = assignment.partition('=')
+    if not hasattr(Config, name):
+        raise argparse.ArgumentTypeError(f"Unknown setting {name}")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--ops', type=int, default=200, help='client writes per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--scenarios', nargs='*', choices=sorted(SCENARIOS))
+    parser.add_argument('--seed', type=int, help='seed for the fault and workload random choices')
+    parser.add_argument('--convergence-timeout', type=float, default=30)
+    parser.add_argument('--probe-interval', type=float,
+                        help='seconds between probe writes while converging (default: resend grace + 0.25)')
+    parser.add_argument('--set', dest='settings', action='append', type=_setting, default=[], metavar='NAME=VALUE',
+                        help='override a Config setting for every node, e.g. REPLICATION_RESEND_GRACE_SECONDS=0')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args(argv)
+
+    for name, value in args.settings:
+        setattr(Config, name, value)
+    if args.probe_interval is None:
+        args.probe_interval = Config.REPLICATION_RESEND_GRACE_SECONDS + 0.25
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    report = {
+        'revision': git_revision(),
+        'nodes': args.nodes,
+        'ops': args.ops,
+        'concurrency': args.concurrency,
+        'settings': dict(args.settings),
+        'scenarios': {name: run_scenario(name, args) for name in args.scenarios or SCENARIOS}
+    }
+    report = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
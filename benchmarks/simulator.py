@@ -0,0 +1,330 @@
+#simulator.py
+"""
+In-process cluster of app nodes joined by a fault-injecting replication transport.
+
+Every node is a separate Flask app with its own SQLite file and its own
+database manager, writer, replication log and receiver, running in this
+process. Peers are reached through FaultyTransport instead of HTTP, so
+latency, dropped and duplicated messages, late (reordered) delivery,
+partitions and node failures can be switched on while a workload runs.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from cluster import REPO_ROOT, SEED_SCRIPT, REPLICATION_TOKEN
+
+# Read by the app's Config at import; peers are given to each node explicitly
+os.environ.setdefault('REPLICATION_TOKEN', REPLICATION_TOKEN)
+os.environ.setdefault('NODES', '')
+sys.path.insert(0, os.path.join(REPO_ROOT, 'app'))
+
+import requests  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+from app import create_app, bootstrap  # noqa: E402
+from config import app_config  # noqa: E402
+from database import DatabaseManager  # noqa: E402
+from utils import ReplicationStrategy, REPLICATION_HEADERS  # noqa: E402
+
+# Tables compared between nodes; users are left out because every node creates its own admin
+CONVERGENCE_TABLES = ('patients', 'billings', 'billing_rollups')
+
+
+def _normalise(value):
+    # Rollup sums accumulated in a different order differ in the last bits
+    return round(value, 6) if isinstance(value, float) else value
+
+
+class Faults:
+    """
+    Link behaviour applied to every replication message, changeable while a workload runs.
+
+    Probabilities are per message and per peer. A late message is reported
+    to the sender as failed, like a timeout, and delivered late_ms later,
+    after messages sent in the meantime.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, drop=0.0, duplicate=0.0, late=0.0, late_ms=200, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.drop = drop
+        self.duplicate = duplicate
+        self.late = late
+        self.late_ms = late_ms
+        self.partitions = set()  # frozenset({name, name}) pairs that cannot reach each other
+        self.down = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self, probability):
+        with self._lock:
+            return probability > 0 and self._random.random() < probability
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+        return (self.latency_ms + jitter) / 1000
+
+    def partition(self, group, others):
+        with self._lock:
+            self.partitions.update(frozenset((a, b)) for a in group for b in others)
+
+    def heal(self):
+        with self._lock:
+            self.partitions.clear()
+
+    def blocked(self, source, target):
+        with self._lock:
+            return source in self.down or target in self.down or frozenset((source, target)) in self.partitions
+
+
+class FaultyTransport:
+    """
+    ReplicationStrategy transport of one node: posts to a peer's /replicate through its test client.
+
+    Delivery runs on the cluster's pool rather than the sending thread, so
+    the peer's request does not run inside the sender's app context or
+    event loop. The peer's reply is returned as a requests.Response and a
+    lost message raises requests.Timeout, so the sender handles both
+    exactly as it would over HTTP. Every attempt is counted; a message
+    posted again to the same peer (a gap resend) is counted as resent.
+    """
+
+    def __init__(self, cluster, source):
+        self.cluster = cluster
+        self.source = source
+
+    def post(self, url, data):
+        cluster, faults = self.cluster, self.cluster.faults
+        target = cluster.by_url[url]
+        message = json.loads(data)
+        cluster.count('sent', self.source.name, target.name, message)
+        time.sleep(faults.delay())
+
+        if faults.blocked(self.source.name, target.name):
+            cluster.count('blocked')
+            raise requests.Timeout(f"{target.name} is unreachable from {self.source.name}")
+        if faults.roll(faults.drop):
+            cluster.count('dropped')
+            raise requests.Timeout(f"Message to {target.name} was dropped")
+        if faults.roll(faults.late):
+            cluster.count('late')
+            timer = threading.Timer(faults.late_ms / 1000, cluster.deliver, (self.source, target, data))
+            timer.daemon = True
+            timer.start()
+            raise requests.Timeout(f"Message to {target.name} is delayed")
+        response = cluster.deliver(self.source, target, data)
+        if faults.roll(faults.duplicate):
+            cluster.count('duplicated')
+            cluster.deliver(self.source, target, data)
+        if response is None:
+            raise requests.Timeout(f"{target.name} became unreachable from {self.source.name}")
+        return response
+
+
+class SimulatedNode:
+    def __init__(self, index, work_dir):
+        self.index = index
+        self.name = f"node{index}"
+        self.url = f"sim://{self.name}"
+        self.data_dir = os.path.join(work_dir, self.name)
+        self.db_path = os.path.join(self.data_dir, 'ntsoekhe.db')
+        self.app = None
+        self.db_manager = None
+
+    def start(self, cluster, peers):
+        """Builds the node's app and services; called again to restart it on the same database."""
+        os.makedirs(self.data_dir, exist_ok=True)
+        # A restarted process keeps nothing of the old one, including its writer thread
+        self.stop()
+        started = time.perf_counter()
+        # Admission control keeps process-wide state, which the nodes would share
+        config = type(f"{self.name.title()}Config", (type(app_config),), {
+            'ADMISSION_CONTROL': False,
+            'SECRET_KEY': f"simulated-{self.name}",
+        })()
+        app = create_app(config)
+        db_manager = DatabaseManager(f"sqlite:///{self.db_path}")
+        app.extensions['services'] = {
+            'db_manager': db_manager,
+            'replication_strategy': ReplicationStrategy(
+                db_manager,
+                nodes=[peer.url for peer in peers],
+                transport=FaultyTransport(cluster, self)
+            ),
+        }
+        with app.app_context():
+            bootstrap(app)
+        self.seed(db_manager)
+        self.app, self.db_manager = app, db_manager
+        self.ready_seconds = time.perf_counter() - started
+
+    def stop(self):
+        """Stops the current incarnation's writer thread and closes its connections."""
+        if self.db_manager is not None:
+            self.db_manager.writer.stop()
+            self.db_manager.engine.dispose()
+
+    def seed(self, db_manager):
+        # Departments are reference data every node needs
+        with db_manager.engine.connect() as conn:
+            if conn.execute(text('SELECT COUNT(*) FROM departments')).scalar():
+                return
+        raw = db_manager.engine.raw_connection()
+        try:
+            with open(SEED_SCRIPT) as f:
+                raw.executescript(f.read())
+        finally:
+            raw.close()
+
+    def receive(self, data):
+        """Serves one /replicate request; the reply is returned as a requests.Response for the sender to interpret."""
+        reply = self.app.test_client().post('/replicate', data=data, headers=REPLICATION_HEADERS)
+        response = requests.Response()
+        response.status_code = reply.status_code
+        response.headers.update(reply.headers)
+        response._content = reply.get_data()
+        response.url = f"{self.url}/replicate"
+        return response
+
+    def fingerprints(self):
+        """{table: (row count, digest of the sorted rows)} for CONVERGENCE_TABLES."""
+        result = {}
+        with self.db_manager.engine.connect() as conn:
+            for table in CONVERGENCE_TABLES:
+                rows = sorted(repr(tuple(map(_normalise, row))) for row in conn.execute(text(f'SELECT * FROM {table}')))
+                result[table] = (len(rows), hashlib.sha1('\n'.join(rows).encode('utf-8')).hexdigest())
+        return result
+
+
+class SimulatedCluster:
+    """
+    N nodes in this process, replicating to each other through FaultyTransport.
+
+        with SimulatedCluster(3, Faults(drop=0.1)) as cluster:
+            client = cluster.client(cluster.nodes[0])
+
+    Process-wide state the app keeps outside its services (the response and
+    session caches, metrics) is shared by the nodes, so convergence is
+    checked against each node's database, not through cached endpoints.
+    """
+
+    def __init__(self, size=3, faults=None, work_dir=None, keep=False, delivery_workers=32):
+        self.size = size
+        self.faults = faults or Faults()
+        self.keep = keep
+        self._tmp = None if work_dir else tempfile.TemporaryDirectory(prefix='ntsoekhe-sim-')
+        self.work_dir = work_dir or self._tmp.name
+        self.nodes = [SimulatedNode(i, self.work_dir) for i in range(size)]
+        self.by_url = {node.url: node for node in self.nodes}
+        self._pool = ThreadPoolExecutor(max_workers=delivery_workers, thread_name_prefix='sim-delivery')
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def _peers(self, node):
+        return [peer for peer in self.nodes if peer is not node]
+
+    def start(self):
+        for node in self.nodes:
+            node.start(self, self._peers(node))
+        logging.info(f"Started {self.size} simulated nodes in {self.work_dir}")
+        return self
+
+    def stop(self):
+        self._pool.shutdown(wait=True)
+        for node in self.nodes:
+            node.stop()
+        if self._tmp and not self.keep:
+            self._tmp.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Transport bookkeeping
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = Counter()
+            self._posted = set()
+
+    def count(self, event, source=None, target=None, message=None):
+        with self._stats_lock:
+            self.stats[event] += 1
+            if message is not None and 'seq' in message:
+                key = (target, message.get('origin'), message['seq'])
+                if key in self._posted:
+                    self.stats['resent'] += 1
+                self._posted.add(key)
+
+    def deliver(self, source, target, data):
+        # Checked again at delivery time: a late message must not cross a partition made since
+        if self.faults.blocked(source.name, target.name):
+            self.count('blocked')
+            return None
+        try:
+            response = self._pool.submit(target.receive, data).result()
+        except RuntimeError:
+            return None  # a late message outlived the cluster
+        self.count('delivered' if response.ok else 'rejected')
+        try:
+            reply = response.json()
+        except ValueError:
+            reply = None
+        if isinstance(reply, dict):
+            self.count(f"reply_{reply.get('status', 'legacy')}")
+        return response
+
+    # Failures
+
+    def partition(self, group):
+        """Cuts the nodes in `group` off from the rest of the cluster."""
+        names = {node.name for node in group}
+        self.faults.partition(names, {node.name for node in self.nodes} - names)
+
+    def heal(self):
+        self.faults.heal()
+
+    def fail(self, node):
+        """Takes a node off the network; clients should stop routing to it."""
+        self.faults.down.add(node.name)
+
+    def recover(self, node, restart=True):
+        """Brings a failed node back, by default as a fresh process state on the same database."""
+        if restart:
+            node.start(self, self._peers(node))
+        self.faults.down.discard(node.name)
+
+    def live_nodes(self):
+        return [node for node in self.nodes if node.name not in self.faults.down]
+
+    # Observation
+
+    def client(self, node, credentials=None):
+        """A logged-in test client of `node`."""
+        client = node.app.test_client()
+        response = client.post('/login', data=credentials or {'Username': 'admin', 'Password': 'admin123'})
+        if response.status_code != 200:
+            raise RuntimeError(f"Login to {node.name} failed with {response.status_code}")
+        return client
+
+    def converged(self):
+        """(True, {}) when every node holds the same rows, else (False, {table: per-node row counts})."""
+        prints = [node.fingerprints() for node in self.nodes]
+        diverged = {
+            table: [fingerprint[table][0] for fingerprint in prints]
+            for table in CONVERGENCE_TABLES
+            if len({fingerprint[table] for fingerprint in prints}) > 1
+        }
+        return not diverged, diverged
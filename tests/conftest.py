@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+
+# Config reads the environment at import time, so these are set before any app module is imported
+_DATA_DIR = tempfile.mkdtemp(prefix='ntsoekhe-tests-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_DATA_DIR, 'default.db')}")
+os.environ.setdefault('DATA_DIR', _DATA_DIR)
+os.environ['NODES'] = ''
+os.environ['ADMISSION_CONTROL'] = '0'
+os.environ['AUTH_SCRYPT_N'] = '1024'
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+import pytest
+
+from database import DatabaseManager
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    """A DatabaseManager on its own SQLite file with the schema at the latest migration."""
+    manager = DatabaseManager(f"sqlite:///{tmp_path / 'test.db'}")
+    manager.ensure_schema()
+    yield manager
+    manager.writer.stop(timeout=5)
+    manager.engine.dispose()
+
+
+@pytest.fixture
+def app(db_manager):
+    """A node's Flask app with its own services on the db_manager database, bootstrapped."""
+    from app import bootstrap, create_app
+    from config import app_config
+    from utils import ReplicationStrategy
+
+    node_app = create_app(app_config)
+    node_app.config['TESTING'] = True
+    node_app.extensions['services'] = {
+        'db_manager': db_manager,
+        'replication_strategy': ReplicationStrategy(db_manager, nodes=[]),
+    }
+    with node_app.app_context():
+        bootstrap(node_app)
+    return node_app
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'Username': 'admin', 'Password': 'admin123'})
+    assert response.status_code == 200
+    return client
+
+
+@pytest.fixture
+def patient():
+    """Builds the insert payload of a patient."""
+    def build(patient_id, phone_number=None):
+        return {
+            'PatientID': patient_id,
+            'Name': f'Patient {patient_id}',
+            'DateOfBirth': '1990-01-01',
+            'Gender': 'F',
+            'PhoneNumber': phone_number,
+        }
+    return build
+
+
+@pytest.fixture
+def peer_manager(tmp_path):
+    """A second node's DatabaseManager, for rows created on two nodes."""
+    manager = DatabaseManager(f"sqlite:///{tmp_path / 'peer.db'}")
+    manager.ensure_schema()
+    yield manager
+    manager.writer.stop(timeout=5)
+    manager.engine.dispose()
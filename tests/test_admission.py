@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+import admission as admission_module
+from admission import AdmissionController, RateLimiter, route_class
+
+LIMITS = {
+    'interactive': (2, 4, 1),
+    'write': (2, 4, 1),
+    'replication': (2, 4, 1),
+    'bulk': (1, 1, 0.1),
+    'long_poll': (2, 2, 0.1),
+}
+RATES = {name: (1000, 1000) for name in LIMITS}
+
+
+@pytest.fixture
+def admitted_client(db_manager, monkeypatch):
+    """An admin session on an app with admission control on, using private limiters."""
+    from app import bootstrap, create_app
+    from config import app_config
+    from utils import ReplicationStrategy
+
+    monkeypatch.setattr(admission_module, 'rate_limiter', RateLimiter(RATES, 100))
+    monkeypatch.setattr(admission_module, 'admission', AdmissionController(4, LIMITS))
+    config = type('AdmittedConfig', (type(app_config),), {'ADMISSION_CONTROL': True})()
+    app = create_app(config)
+    app.extensions['services'] = {
+        'db_manager': db_manager,
+        'replication_strategy': ReplicationStrategy(db_manager, nodes=[]),
+    }
+    with app.app_context():
+        bootstrap(app)
+    client = app.test_client()
+    assert client.post('/login', data={'Username': 'admin', 'Password': 'admin123'}).status_code == 200
+    return client
+
+
+def test_route_classes():
+    assert route_class('api.get_patient_chart', 'GET') == 'interactive'
+    assert route_class('api.create_billing', 'POST') == 'write'
+    assert route_class('api.handle_replicate', 'POST') == 'replication'
+    assert route_class('api.get_changes', 'GET') == 'long_poll'
+    assert route_class('api.get_revenue_report', 'GET') == 'bulk'
+
+
+def test_rate_limited_client_gets_429(admitted_client, monkeypatch):
+    monkeypatch.setattr(admission_module, 'rate_limiter', RateLimiter(dict(RATES, interactive=(0.5, 1)), 100))
+
+    assert admitted_client.get('/user/info').status_code == 200
+    response = admitted_client.get('/user/info')
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+
+
+def test_request_that_waits_too_long_gets_503(admitted_client):
+    controller = admission_module.admission
+    assert controller.acquire('bulk') is None
+    try:
+        response = admitted_client.get('/patients')
+    finally:
+        controller.release('bulk')
+
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert admitted_client.get('/patients').status_code == 200
+
+
+def test_full_queue_is_shed_at_once():
+    controller = AdmissionController(4, LIMITS)
+    assert controller.acquire('bulk') is None
+    waiter = threading.Thread(target=controller.acquire, args=('bulk',))
+    waiter.start()
+    while controller._queued_by_class['bulk'] == 0:
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    assert controller.acquire('bulk') == 'queue_full'
+    assert time.monotonic() - started < 0.05
+    waiter.join()
+
+
+def test_interactive_waiters_are_admitted_before_bulk():
+    controller = AdmissionController(1, dict(LIMITS, bulk=(1, 4, 5), interactive=(1, 4, 5)))
+    assert controller.acquire('write') is None
+    admitted = []
+
+    def wait(request_class):
+        assert controller.acquire(request_class) is None
+        admitted.append(request_class)
+        controller.release(request_class)
+
+    bulk = threading.Thread(target=wait, args=('bulk',))
+    bulk.start()
+    while controller._queued_by_class['bulk'] == 0:
+        time.sleep(0.01)
+    interactive = threading.Thread(target=wait, args=('interactive',))
+    interactive.start()
+    while controller._queued_by_class['interactive'] == 0:
+        time.sleep(0.01)
+
+    controller.release('write')
+    bulk.join(5)
+    interactive.join(5)
+    assert admitted == ['interactive', 'bulk']
+
+
+def test_long_polls_do_not_take_shared_slots():
+    controller = AdmissionController(1, LIMITS)
+    assert controller.acquire('long_poll') is None
+    assert controller.acquire('long_poll') is None
+
+    assert controller.acquire('replication') is None
+    # Capped by their own class
+    assert controller.acquire('long_poll') == 'timeout'
+
+
+def test_capped_class_does_not_block_other_classes():
+    controller = AdmissionController(4, LIMITS)
+    assert controller.acquire('bulk') is None
+
+    assert controller.acquire('bulk') == 'timeout'
+    assert controller.acquire('interactive') is None
@@ -0,0 +1,36 @@
+from analytics import AnalyticsSnapshot
+from replication_log import ReplicationReceiver
+
+
+def _genders(snapshot):
+    return {row['gender']: row['count'] for row in snapshot.patient_distribution()['rows']}
+
+
+def test_live_snapshot_follows_local_and_replicated_writes(db_manager, patient, monkeypatch):
+    snapshot = AnalyticsSnapshot(db_manager)
+    loads = []
+    load = snapshot._load
+    monkeypatch.setattr(snapshot, '_load', lambda name: loads.append(name) or load(name))
+    db_manager.insert_patient(patient('P1'))
+    assert _genders(snapshot) == {'F': 1}
+
+    db_manager.insert_patient(dict(patient('P2'), Gender='M'))
+    db_manager.update_patient('P1', {'Gender': 'M'})
+    replicated = [{'action': 'insert', 'object_type': 'patient', 'data': patient('P3')}]
+    assert ReplicationReceiver(db_manager).receive('peer', 1, replicated)['status'] == 'applied'
+
+    assert _genders(snapshot) == {'F': 1, 'M': 2}
+    assert loads == ['patients']
+    assert snapshot.patient_distribution() | {'elapsed_ms': 0} == \
+        AnalyticsSnapshot(db_manager, live=False).patient_distribution() | {'elapsed_ms': 0}
+
+
+def test_snapshot_groups_by_several_fields(db_manager, patient):
+    db_manager.insert_patient(patient('P1'))
+    db_manager.insert_patient(dict(patient('P2'), Gender=None))
+
+    result = AnalyticsSnapshot(db_manager).patient_distribution(group_by=('gender', 'age_band'))
+
+    assert result['total'] == 2
+    assert [(row['gender'], row['count']) for row in result['rows']] == [('F', 1), ('unknown', 1)]
+    assert result['rows'][0]['age_band'] == result['rows'][1]['age_band'] != 'unknown'
@@ -0,0 +1,77 @@
+import pytest
+
+from archive import ArchiveStore
+from exceptions import ArchivedRecordError
+from models import Billing
+
+
+@pytest.fixture
+def archived(db_manager, patient, tmp_path):
+    """A db_manager with two of a patient's three billings moved to a test archive directory."""
+    db_manager.archive = ArchiveStore(db_manager, directory=str(tmp_path / 'archive'))
+    db_manager.insert_patient(patient('P1'))
+    db_manager.insert_billing({'BillingID': 1, 'PatientID': 'P1', 'TotalCost': 10.0, 'DateOfBilling': '2000-03-01'})
+    db_manager.insert_billing({'BillingID': 2, 'PatientID': 'P1', 'TotalCost': 20.0, 'DateOfBilling': '2001-03-01'})
+    # The row holding the highest id always stays hot
+    db_manager.insert_billing({'BillingID': 3, 'PatientID': 'P1', 'TotalCost': 40.0, 'DateOfBilling': '2000-06-01'})
+    report = db_manager.get_revenue_report()
+    result = db_manager.archive.archive()
+    assert result['moved']['billings'] == 2
+    assert result['periods'] == ['2000', '2001']
+    return db_manager, report
+
+
+def _hot_ids(db_manager):
+    with db_manager.get_db() as db:
+        return {billing_id for (billing_id,) in db.query(Billing.BillingID)}
+
+
+def _chart_billing_ids(db_manager, **kwargs):
+    chart = db_manager.get_patient_chart('P1', sections=['billings'], **kwargs)
+    return [row['BillingID'] for row in chart['billings']['items']]
+
+
+def test_archived_rows_leave_the_hot_database(archived):
+    db_manager, _ = archived
+
+    assert _hot_ids(db_manager) == {3}
+    assert db_manager.archive.contains('billings', 1)
+    assert db_manager.archive.contains('billings', 2)
+    assert not db_manager.archive.contains('billings', 3)
+
+
+def test_chart_reads_archived_rows_back(archived):
+    db_manager, _ = archived
+
+    assert _chart_billing_ids(db_manager) == [3, 2, 1]
+    assert _chart_billing_ids(db_manager, limit=2) == [3, 2]
+    assert _chart_billing_ids(db_manager, limit=2, offsets={'billings': 2}) == [1]
+
+
+def test_rollup_rebuild_counts_archived_rows(archived):
+    db_manager, report = archived
+
+    db_manager.rebuild_billing_rollups()
+
+    assert db_manager.get_revenue_report() == report
+    assert db_manager.get_revenue_report()['revenue'] == 70.0
+
+
+def test_archived_rows_cannot_be_changed(archived):
+    db_manager, _ = archived
+
+    with pytest.raises(ArchivedRecordError):
+        db_manager.update_billing(1, {'TotalCost': 99})
+    with pytest.raises(ArchivedRecordError):
+        db_manager.delete_billing(2)
+    assert db_manager.update_billing(12345, {'TotalCost': 99}) is None
+
+
+def test_row_in_both_places_is_read_once(archived):
+    db_manager, report = archived
+    # What a crash between the archive insert and the hot delete leaves behind
+    db_manager.insert_billing({'BillingID': 1, 'PatientID': 'P1', 'TotalCost': 10.0, 'DateOfBilling': '2000-03-01'})
+
+    assert sorted(_chart_billing_ids(db_manager)) == [1, 2, 3]
+    db_manager.rebuild_billing_rollups()
+    assert db_manager.get_revenue_report() == report
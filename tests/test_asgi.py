@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+from config import Config
+
+
+async def _get(application, path, query, headers):
+    sent = []
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if requested:
+            await asyncio.sleep(3600)
+        requested = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': [(name.encode(), value.encode()) for name, value in headers.items()],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    await application(scope, receive, send)
+    return sent[0]['status']
+
+
+def test_requests_are_served_concurrently(monkeypatch):
+    from asgi import application
+
+    monkeypatch.setattr(Config, 'REPLICATION_TOKEN', 'peer-secret')
+    headers = {'X-Replication-Token': 'peer-secret'}
+
+    async def long_polls(count):
+        return await asyncio.gather(*(_get(application, '/changes', 'since=999999&wait=0.5', headers) for _ in range(count)))
+
+    assert asyncio.run(long_polls(1)) == [200]
+    started = time.monotonic()
+    statuses = asyncio.run(long_polls(4))
+
+    assert statuses == [200] * 4
+    # One after another they would take 2 seconds
+    assert time.monotonic() - started < 1.5
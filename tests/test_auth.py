@@ -0,0 +1,140 @@
+import hashlib
+import time
+
+import pytest
+
+from auth import AuthBusyError, PasswordHasher, SessionCache, password_hasher, session_cache
+from exceptions import InvalidRequestException
+from models import User
+
+
+def _hasher(n=1024, **bounds):
+    return PasswordHasher(n=n, r=8, p=1, workers=1, queue_limit=1, timeout=10, **bounds)
+
+
+def _stored_password(db_manager, user_id):
+    with db_manager.get_db() as db:
+        return db.get(User, user_id).Password
+
+
+def _add_user(db_manager, user_id, username, password_hash):
+    db_manager.writer.execute(db_manager._insert_user_op, user_id, username, password_hash, 'doctor')
+
+
+def test_hash_round_trip():
+    hasher = _hasher()
+    stored = hasher.hash('s3cret')
+
+    assert stored.startswith('scrypt$1024$8$1$')
+    assert hasher.verify('s3cret', stored) == (True, False)
+    assert hasher.verify('wrong', stored) == (False, False)
+    assert hasher.hash('s3cret') != stored
+
+
+def test_weaker_and_legacy_hashes_verify_and_ask_for_a_rehash():
+    hasher = _hasher()
+
+    assert hasher.verify('s3cret', _hasher(n=512).hash('s3cret')) == (True, True)
+    assert hasher.verify('s3cret', hashlib.sha256(b's3cret').digest()) == (True, True)
+    assert hasher.verify('wrong', hashlib.sha256(b's3cret').digest()) == (False, False)
+
+
+def test_hashes_with_out_of_bounds_cost_are_refused():
+    stored = _hasher(n=4096).hash('s3cret')
+    hasher = _hasher(max_n=2048)
+
+    assert hasher.is_valid(stored) is False
+    assert hasher.verify('s3cret', stored) == (False, False)
+    assert hasher.is_valid('scrypt$1024$8$1$not-base64$x') is False
+
+
+def test_saturated_pool_rejects_instead_of_queueing():
+    hasher = PasswordHasher(n=1024, r=8, p=1, workers=1, queue_limit=0, timeout=10)
+    hasher._slots.acquire()
+
+    with pytest.raises(AuthBusyError):
+        hasher.hash('s3cret')
+
+
+def test_login_upgrades_a_legacy_hash(db_manager):
+    _add_user(db_manager, 'd00001', 'legacy', hashlib.sha256(b's3cret').digest())
+
+    assert db_manager.authenticate_user('legacy', 's3cret').UserID == 'd00001'
+
+    upgraded = _stored_password(db_manager, 'd00001')
+    assert upgraded.startswith(f'scrypt${password_hasher.n}$')
+    assert password_hasher.verify('s3cret', upgraded) == (True, False)
+    assert db_manager.authenticate_user('legacy', 'wrong') is None
+
+
+def test_login_upgrades_a_weaker_scrypt_hash(db_manager):
+    _add_user(db_manager, 'd00001', 'weak', _hasher(n=512).hash('s3cret'))
+
+    assert db_manager.authenticate_user('weak', 's3cret') is not None
+
+    assert _stored_password(db_manager, 'd00001').startswith(f'scrypt${password_hasher.n}$')
+
+
+def test_replicated_hash_with_unbounded_cost_is_not_stored(db_manager):
+    stored = f'scrypt${2 ** 30}$8$1$c2FsdA==$aGFzaA=='
+
+    with pytest.raises(InvalidRequestException):
+        _add_user(db_manager, 'd00001', 'expensive', stored)
+
+
+def test_session_cache_hits_until_expiry():
+    cache = SessionCache(max_size=10, ttl=0.2)
+    session_user = cache.create(User('d00001', 'doc', None, 'doctor'))
+
+    assert cache.get(session_user.session_id) is session_user
+    time.sleep(0.3)
+    assert cache.get(session_user.session_id) is None
+
+
+def test_session_cache_restores_a_miss_with_one_lookup():
+    cache = SessionCache(max_size=10, ttl=60)
+    lookups = []
+
+    def load_user(user_id):
+        lookups.append(user_id)
+        return User(user_id, 'doc', None, 'doctor')
+
+    first = cache.resolve('d00001:token', load_user)
+    second = cache.resolve('d00001:token', load_user)
+
+    assert lookups == ['d00001']
+    assert first is second and first.Role == 'doctor'
+    assert cache.resolve('no-separator', load_user) is None
+
+
+def test_session_cache_evicts_least_recently_used():
+    cache = SessionCache(max_size=2, ttl=60)
+    first, second = (cache.create(User(f'd0000{i}', f'doc{i}', None, 'doctor')) for i in (1, 2))
+    cache.get(first.session_id)
+    cache.create(User('d00003', 'doc3', None, 'doctor'))
+
+    assert cache.get(first.session_id) is first
+    assert cache.get(second.session_id) is None
+
+
+def test_user_changes_invalidate_cached_sessions(db_manager):
+    _add_user(db_manager, 'd00001', 'doc', password_hasher.hash('s3cret'))
+    session_user = session_cache.create(User('d00001', 'doc', None, 'doctor'))
+
+    db_manager.update_user_password('d00001', password_hasher.hash('changed'))
+
+    assert session_cache.get(session_user.session_id) is None
+
+
+def test_authenticated_requests_do_not_load_the_user(app, db_manager, monkeypatch):
+    client = app.test_client()
+    assert client.post('/login', data={'Username': 'admin', 'Password': 'admin123'}).status_code == 200
+
+    def load_user(user_id):
+        raise AssertionError('session should have come from the cache')
+
+    monkeypatch.setattr(db_manager, 'load_user', load_user)
+    response = client.get('/user/info')
+
+    assert response.status_code == 200
+    assert response.get_json()['username'] == 'admin'
@@ -0,0 +1,56 @@
+import pytest
+
+from exceptions import DatabaseIntegrityError, InvalidRequestException
+from models import Patient
+
+
+def _step(action, object_type, data):
+    return {'action': action, 'object_type': object_type, 'data': data}
+
+
+def test_batch_commits_every_step(db_manager, patient):
+    result = db_manager.apply_batch([
+        _step('insert', 'patient', patient('P1', 1)),
+        _step('update', 'patient', {'PatientID': 'P1', 'Name': 'Renamed'}),
+        _step('insert', 'appointment', {'PatientID': 'P1', 'DoctorID': 'D1',
+                                        'StartTime': '2030-01-07T09:00:00', 'EndTime': '2030-01-07T09:30:00'}),
+    ])
+
+    assert result[0] == 'P1'
+    with db_manager.get_db() as db:
+        assert db.get(Patient, 'P1').Name == 'Renamed'
+    assert len(db_manager.get_appointments_by_doctor_id('D1')) == 1
+
+
+def test_failing_step_rolls_back_the_steps_before_it(db_manager, patient):
+    published = []
+    db_manager.change_log.subscribe(published.extend)
+
+    with pytest.raises(DatabaseIntegrityError):
+        db_manager.apply_batch([
+            _step('insert', 'patient', patient('P1', 1)),
+            _step('insert', 'appointment', {'PatientID': 'P1', 'DoctorID': 'D1',
+                                            'StartTime': '2030-01-07T09:00:00', 'EndTime': '2030-01-07T09:30:00'}),
+            # Same phone number as P1
+            _step('insert', 'patient', patient('P2', 1)),
+        ])
+
+    assert not db_manager.patient_exists('P1')
+    assert not db_manager.patient_exists('P2')
+    assert db_manager.get_appointments_by_doctor_id('D1') == []
+    assert published == []
+
+
+def test_failed_batch_does_not_affect_concurrent_writes(db_manager, patient):
+    with pytest.raises(DatabaseIntegrityError):
+        db_manager.apply_batch([_step('insert', 'patient', patient('P1', 1)), _step('insert', 'patient', patient('P1', 2))])
+
+    assert db_manager.insert_patient(patient('P3', 3)) == 'P3'
+    assert not db_manager.patient_exists('P1')
+
+
+def test_unsupported_step_is_rejected_before_anything_runs(db_manager, patient):
+    with pytest.raises(InvalidRequestException):
+        db_manager.apply_batch([_step('insert', 'patient', patient('P1', 1)), _step('drop', 'patient', {})])
+
+    assert not db_manager.patient_exists('P1')
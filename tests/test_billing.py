@@ -0,0 +1,33 @@
+from database import RECORD_ID_RANGE
+from models import Billing
+from replication_log import ReplicationReceiver
+
+
+def _billings(db_manager):
+    with db_manager.get_db() as db:
+        return {billing.BillingID: billing.TotalCost for billing in db.query(Billing)}
+
+
+def _replicated(billing_data, billing_id):
+    return [{'action': 'insert', 'object_type': 'billing', 'data': dict(billing_data, BillingID=billing_id)}]
+
+
+def test_billing_ids_are_not_the_local_autoincrement(db_manager):
+    billing_id = db_manager.insert_billing({'PatientID': 'P1', 'TotalCost': '10'})
+
+    assert RECORD_ID_RANGE[0] <= billing_id < RECORD_ID_RANGE[1]
+    assert db_manager.insert_billing({'PatientID': 'P1', 'TotalCost': 5, 'BillingID': 7}) == 7
+
+
+def test_invoices_created_on_two_nodes_replicate_to_both(db_manager, peer_manager):
+    local = {'PatientID': 'P1', 'TotalCost': 10.0}
+    remote = {'PatientID': 'P2', 'TotalCost': 20.0}
+    local_id = db_manager.insert_billing(local)
+    remote_id = peer_manager.insert_billing(remote)
+
+    assert ReplicationReceiver(db_manager).receive('peer', 1, _replicated(remote, remote_id))['status'] == 'applied'
+    assert ReplicationReceiver(peer_manager).receive('local', 1, _replicated(local, local_id))['status'] == 'applied'
+
+    assert _billings(db_manager) == _billings(peer_manager) == {local_id: 10.0, remote_id: 20.0}
+    assert db_manager.get_revenue_report() == peer_manager.get_revenue_report()
+    assert db_manager.get_revenue_report()['revenue'] == 30.0
@@ -0,0 +1,77 @@
+import pytest
+
+from cache import response_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_response_cache():
+    # The cache is process-wide; entries of an earlier test's database must not answer here
+    response_cache.clear()
+    yield
+    response_cache.clear()
+
+
+@pytest.fixture
+def counted_reads(db_manager, monkeypatch):
+    """Counts the patient list reads that reach the database."""
+    reads = []
+    get_all_patients = db_manager.get_all_patients
+
+    def counted():
+        reads.append(1)
+        return get_all_patients()
+
+    monkeypatch.setattr(db_manager, 'get_all_patients', counted)
+    return reads
+
+
+def test_matching_etag_is_answered_with_304_without_reading(admin_client, counted_reads):
+    first = admin_client.get('/patients')
+    etag = first.headers['ETag']
+
+    revalidated = admin_client.get('/patients', headers={'If-None-Match': etag})
+
+    assert first.status_code == 200 and etag
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+    assert revalidated.headers['ETag'] == etag
+    assert len(counted_reads) == 1
+
+
+def test_repeated_request_is_served_from_the_cache(admin_client, counted_reads):
+    first = admin_client.get('/patients')
+    second = admin_client.get('/patients')
+
+    assert second.status_code == 200
+    assert second.get_data() == first.get_data()
+    assert len(counted_reads) == 1
+
+
+def test_write_changes_the_etag(db_manager, admin_client, counted_reads, patient):
+    etag = admin_client.get('/patients').headers['ETag']
+
+    db_manager.insert_patient(patient('P1', 1))
+    response = admin_client.get('/patients', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert [row['PatientID'] for row in response.get_json()] == ['P1']
+    assert len(counted_reads) == 2
+
+
+def test_if_modified_since_alone_does_not_revalidate(admin_client):
+    first = admin_client.get('/patients')
+
+    response = admin_client.get('/patients', headers={'If-Modified-Since': first.headers['Last-Modified']})
+
+    assert response.status_code == 200
+    assert response.get_data() == first.get_data()
+
+
+def test_etag_differs_by_query_string(admin_client):
+    plain = admin_client.get('/patients/search').headers['ETag']
+    filtered = admin_client.get('/patients/search?query=x')
+
+    assert admin_client.get('/patients/search?query=x', headers={'If-None-Match': plain}).status_code == 200
+    assert filtered.headers['ETag'] != plain
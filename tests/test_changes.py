@@ -0,0 +1,68 @@
+import json
+import threading
+import time
+
+from config import Config
+
+
+def test_change_feed_returns_committed_writes(db_manager, admin_client, patient):
+    since = db_manager.change_log.latest_seq()
+    db_manager.insert_patient(patient('P1', 1))
+
+    response = admin_client.get(f'/changes?since={since}')
+
+    assert response.status_code == 200
+    changes = response.get_json()['changes']
+    assert [(change['table'], change['operation'], change['row_id']) for change in changes] == [('patients', 'insert', 'P1')]
+    assert response.get_json()['next'] == changes[-1]['seq']
+
+
+def test_stream_ends_when_idle(db_manager, admin_client, patient, monkeypatch):
+    monkeypatch.setattr(Config, 'CDC_STREAM_IDLE_SECONDS', 0.3)
+    since = db_manager.change_log.latest_seq()
+    db_manager.insert_patient(patient('P1', 1))
+
+    started = time.monotonic()
+    response = admin_client.get(f'/changes?since={since}&stream=1')
+    lines = response.get_data(as_text=True).splitlines()
+
+    assert time.monotonic() - started < 5
+    assert json.loads(lines[0])['row_id'] == 'P1'
+    assert all(line == '' for line in lines[1:])
+
+
+def test_stream_ends_at_its_maximum_duration(db_manager, admin_client, patient, monkeypatch):
+    monkeypatch.setattr(Config, 'CDC_STREAM_MAX_SECONDS', 0.5)
+    monkeypatch.setattr(Config, 'CDC_MAX_WAIT_SECONDS', 0.1)
+    done = threading.Event()
+
+    def keep_writing():
+        # Never idle, so only the maximum duration can end the stream
+        for i in range(1000):
+            if done.wait(0.05):
+                return
+            db_manager.insert_patient(patient(f'P{i}', i))
+
+    writer = threading.Thread(target=keep_writing)
+    writer.start()
+    try:
+        started = time.monotonic()
+        response = admin_client.get(f'/changes?since={db_manager.change_log.latest_seq()}&stream=1')
+        body = response.get_data(as_text=True)
+    finally:
+        done.set()
+        writer.join()
+
+    assert time.monotonic() - started < 5
+    assert '"patients"' in body
+
+
+def test_peers_read_and_ack_the_feed_with_the_replication_token(app, monkeypatch):
+    monkeypatch.setattr(Config, 'REPLICATION_TOKEN', 'peer-secret')
+    client = app.test_client()
+
+    assert client.get('/changes', headers={'X-Replication-Token': 'peer-secret'}).status_code == 200
+    ack = client.post('/changes/ack', json={'consumer': 'peer', 'seq': 1}, headers={'X-Replication-Token': 'peer-secret'})
+    assert ack.status_code == 200
+    assert client.get('/changes', headers={'X-Replication-Token': 'wrong'}).status_code in (302, 401)
+    assert client.post('/changes/ack', json={'consumer': 'peer', 'seq': 1}).status_code in (302, 401)
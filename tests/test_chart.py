@@ -0,0 +1,68 @@
+import pytest
+
+from cache import response_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_response_cache():
+    # The cache is process-wide; entries of an earlier test's database must not answer here
+    response_cache.clear()
+    yield
+    response_cache.clear()
+
+
+@pytest.fixture
+def patient_client(app, db_manager):
+    """Logs a patient user in, creating the user with the patient's id."""
+    def login(patient_id):
+        username = patient_id.lower()
+        db_manager.insert_user({'UserID': patient_id, 'Username': username, 'Password': 'secret', 'Role': 'patient'})
+        client = app.test_client()
+        assert client.post('/login', data={'Username': username, 'Password': 'secret'}).status_code == 200
+        return client
+    return login
+
+
+@pytest.fixture
+def charts(db_manager, patient, patient_client):
+    """Two patients with a billing each, and a login for the first of them."""
+    for patient_id, cost in (('P1', 10.0), ('P2', 20.0)):
+        db_manager.insert_patient(patient(patient_id))
+        db_manager.insert_billing({'PatientID': patient_id, 'TotalCost': cost})
+    return patient_client('P1')
+
+
+def test_chart_loads_every_section(admin_client, charts):
+    response = admin_client.get('/patients/P1/chart')
+
+    chart = response.get_json()
+    assert response.status_code == 200
+    assert chart['patient']['PatientID'] == 'P1'
+    assert [row['TotalCost'] for row in chart['billings']['items']] == [10.0]
+    assert chart['appointments'] == {'items': [], 'offset': 0, 'has_more': False}
+
+
+def test_fields_select_sections(admin_client, charts):
+    chart = admin_client.get('/patients/P1/chart?fields=billings').get_json()
+
+    assert set(chart) == {'patient', 'billings'}
+    assert chart['patient'] == {'PatientID': 'P1'}
+
+
+def test_patient_reads_only_their_own_chart(charts):
+    assert charts.get('/patients/P1/chart').status_code == 200
+    assert charts.get('/patients/P2/chart').status_code == 403
+
+
+def test_cached_chart_is_not_served_to_another_patient(charts, patient_client):
+    # Cached under the patient role, which both patients share
+    assert patient_client('P2').get('/patients/P2/chart').status_code == 200
+
+    response = charts.get('/patients/P2/chart')
+
+    assert response.status_code == 403
+    assert 'billings' not in response.get_json()
+
+
+def test_missing_patient_is_404(admin_client, charts):
+    assert admin_client.get('/patients/P9/chart').status_code == 404
@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy import inspect, text
+
+from database import DatabaseManager
+from migrations import LOOKUP_QUERIES, MIGRATIONS, Migration, MigrationRunner, execute, verify_query_plans
+
+LATEST = MIGRATIONS[-1].version
+
+
+def _indexes(engine, table):
+    return {index['name'] for index in inspect(engine).get_indexes(table)}
+
+
+@pytest.fixture
+def legacy_manager(tmp_path):
+    """A database as a node created it before schema_migrations and the lookup indexes existed."""
+    manager = DatabaseManager(f"sqlite:///{tmp_path / 'legacy.db'}")
+    manager.create_tables()
+    with manager.engine.begin() as conn:
+        for (name,) in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'"
+        )).fetchall():
+            conn.execute(text(f'DROP INDEX {name}'))
+        conn.execute(text('DROP TABLE schema_migrations'))
+        conn.execute(text('ALTER TABLE appointments DROP COLUMN "StartTime"'))
+        conn.execute(text('ALTER TABLE appointments DROP COLUMN "EndTime"'))
+        conn.execute(text('ALTER TABLE prescriptions DROP COLUMN "PrescribedAt"'))
+        conn.execute(text(
+            'INSERT INTO appointments ("AppointmentID", "PatientID", "DoctorID", "AppointmentDateTime") '
+            "VALUES (1, 'P1', 'D1', '2024-03-01')"
+        ))
+    # Pooled connections cache prepared statements compiled against the dropped indexes
+    manager.engine.dispose()
+    yield manager
+    manager.writer.stop(timeout=5)
+    manager.engine.dispose()
+
+
+def test_fresh_database_is_stamped_at_latest_version(db_manager):
+    runner = MigrationRunner(db_manager.engine)
+
+    assert runner.current_version() == LATEST
+    assert runner.pending() == []
+    assert all(entry['duration_ms'] == 0.0 for entry in runner.status()['applied'])
+    assert db_manager.ensure_schema() == 'current'
+
+
+def test_fresh_database_lookups_use_indexes(db_manager):
+    plans = verify_query_plans(db_manager.engine)
+
+    assert set(plans) == set(LOOKUP_QUERIES)
+    assert {name for name, result in plans.items() if not result['uses_index']} == set()
+
+
+def test_legacy_database_is_migrated(legacy_manager):
+    assert verify_query_plans(legacy_manager.engine)['appointments_by_doctor']['uses_index'] is False
+
+    assert legacy_manager.ensure_schema() == 'migrated'
+
+    runner = MigrationRunner(legacy_manager.engine)
+    assert runner.current_version() == LATEST
+    assert [entry['version'] for entry in runner.status()['applied']] == [migration.version for migration in MIGRATIONS]
+    assert {'ix_appointments_DoctorID_StartTime', 'ix_appointments_PatientID_StartTime',
+            'ix_appointments_StartTime'} <= _indexes(legacy_manager.engine, 'appointments')
+    assert {'ix_billings_PatientID', 'ix_billings_DepartmentID', 'ix_billings_DateOfBilling'} <= _indexes(legacy_manager.engine, 'billings')
+    assert all(result['uses_index'] for result in verify_query_plans(legacy_manager.engine).values())
+
+    with legacy_manager.engine.connect() as conn:
+        start, end = conn.execute(text('SELECT "StartTime", "EndTime" FROM appointments WHERE "AppointmentID" = 1')).one()
+    assert start == '2024-03-01 00:00:00'
+    assert end == '2024-03-01 00:30:00'
+
+
+def test_migrating_again_is_a_no_op(legacy_manager):
+    legacy_manager.ensure_schema()
+
+    assert legacy_manager.ensure_schema() == 'current'
+    assert MigrationRunner(legacy_manager.engine).run() == []
+
+
+def test_failed_migration_is_rolled_back_and_not_recorded(db_manager):
+    runner = MigrationRunner(db_manager.engine, MIGRATIONS + [
+        Migration(LATEST + 1, 'Broken', [
+            execute('CREATE TABLE half_done (id INTEGER)'),
+            execute('ALTER TABLE no_such_table ADD COLUMN x INTEGER'),
+        ]),
+    ])
+
+    with pytest.raises(Exception):
+        runner.run()
+
+    assert runner.current_version() == LATEST
+    assert [migration.version for migration in runner.pending()] == [LATEST + 1]
+    assert not inspect(db_manager.engine).has_table('half_done')
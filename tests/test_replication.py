@@ -0,0 +1,178 @@
+import json
+
+import pytest
+import requests
+
+from config import Config
+from models import Patient
+from replication_log import ReplicationReceiver
+from utils import ReplicationStrategy
+
+
+@pytest.fixture
+def receiver(db_manager):
+    return ReplicationReceiver(db_manager)
+
+
+@pytest.fixture
+def insert(patient):
+    """The operations of a replicated patient insert."""
+    def build(patient_id, phone_number):
+        return [{'action': 'insert', 'object_type': 'patient', 'data': patient(patient_id, phone_number)}]
+    return build
+
+
+def test_in_order_messages_are_applied(db_manager, receiver, insert):
+    assert receiver.receive('node-a', 1, insert('P1', 1)) == {'status': 'applied', 'high_water': 1}
+    assert receiver.receive('node-a', 2, insert('P2', 2)) == {'status': 'applied', 'high_water': 2}
+    assert db_manager.get_replication_positions() == {'node-a': 2}
+
+
+def test_out_of_order_message_waits_for_the_gap(db_manager, receiver, insert):
+    assert receiver.receive('node-a', 3, insert('P3', 3)) == {'status': 'buffered', 'high_water': 0}
+    assert receiver.receive('node-a', 2, insert('P2', 2)) == {'status': 'buffered', 'high_water': 0}
+    assert not db_manager.patient_exists('P2') and not db_manager.patient_exists('P3')
+    assert receiver.status()['buffered'] == {'node-a': [2, 3]}
+
+    assert receiver.receive('node-a', 1, insert('P1', 1)) == {'status': 'applied', 'high_water': 3}
+
+    assert all(db_manager.patient_exists(patient_id) for patient_id in ('P1', 'P2', 'P3'))
+    assert receiver.status() == {'positions': {'node-a': 3}, 'buffered': {}}
+
+
+def test_buffered_messages_apply_in_sequence_order(db_manager, receiver):
+    def rename(name):
+        return [{'action': 'update', 'object_type': 'patient', 'data': {'PatientID': 'P1', 'Name': name}}]
+
+    receiver.receive('node-a', 3, rename('third'))
+    receiver.receive('node-a', 2, rename('second'))
+    receiver.receive('node-a', 1, [{'action': 'insert', 'object_type': 'patient', 'data': {
+        'PatientID': 'P1', 'Name': 'first', 'DateOfBirth': '1990-01-01', 'Gender': 'F', 'PhoneNumber': 1}}])
+
+    with db_manager.get_db() as db:
+        assert db.get(Patient, 'P1').Name == 'third'
+
+
+def test_redelivered_message_is_a_duplicate(db_manager, receiver, insert):
+    receiver.receive('node-a', 1, insert('P1', 1))
+
+    assert receiver.receive('node-a', 1, insert('P1', 1)) == {'status': 'duplicate', 'high_water': 1}
+    # Positions are stored with the data, so a restarted node still recognises it
+    assert ReplicationReceiver(db_manager).receive('node-a', 1, insert('P1', 1)) == {'status': 'duplicate', 'high_water': 1}
+
+
+def test_duplicate_is_detected_in_the_apply_transaction(db_manager, insert):
+    assert db_manager.apply_replicated('node-a', 1, insert('P1', 1)) == 'applied'
+    assert db_manager.apply_replicated('node-a', 1, insert('P1', 1)) == 'duplicate'
+
+
+def test_origins_are_ordered_independently(db_manager, receiver, insert):
+    assert receiver.receive('node-a', 2, insert('A2', 2))['status'] == 'buffered'
+    assert receiver.receive('node-b', 1, insert('B1', 11)) == {'status': 'applied', 'high_water': 1}
+    assert receiver.receive('node-b', 2, insert('B2', 12)) == {'status': 'applied', 'high_water': 2}
+
+    assert not db_manager.patient_exists('A2')
+    assert db_manager.get_replication_positions() == {'node-b': 2}
+
+
+def test_full_reorder_buffer_answers_busy(db_manager, receiver, insert, monkeypatch):
+    monkeypatch.setattr(Config, 'REPLICATION_REORDER_BUFFER', 1)
+
+    assert receiver.receive('node-a', 2, insert('P2', 2))['status'] == 'buffered'
+    assert receiver.receive('node-a', 3, insert('P3', 3)) == {'status': 'busy', 'high_water': 0}
+    # A resent message that is already buffered still fits
+    assert receiver.receive('node-a', 2, insert('P2', 2))['status'] == 'buffered'
+
+    receiver.receive('node-a', 1, insert('P1', 1))
+    assert receiver.receive('node-a', 3, insert('P3', 3)) == {'status': 'applied', 'high_water': 3}
+
+
+def test_operation_that_cannot_be_applied_is_skipped(db_manager, receiver, insert):
+    assert receiver.receive('node-a', 2, insert('P2', 2))['status'] == 'buffered'
+
+    poison = [{'action': 'insert', 'object_type': 'patient', 'data': {'PatientID': 'P1'}}]
+    assert receiver.receive('node-a', 1, poison) == {'status': 'failed', 'high_water': 2}
+
+    assert not db_manager.patient_exists('P1')
+    assert db_manager.patient_exists('P2')
+    assert db_manager.get_replication_positions() == {'node-a': 2}
+
+
+def _sequenced(origin, seq, operations):
+    return {'action': 'apply', 'object_type': 'batch', 'data': {'operations': operations},
+            'request_id': f'{origin}-{seq}', 'origin': origin, 'seq': seq}
+
+
+def test_replicate_reply_codes(admin_client, insert):
+    poison = [{'action': 'insert', 'object_type': 'patient', 'data': {'PatientID': 'P1'}}]
+
+    buffered = admin_client.post('/replicate', json=_sequenced('node-a', 3, insert('P3', 3)))
+    failed = admin_client.post('/replicate', json=_sequenced('node-a', 1, poison))
+    applied = admin_client.post('/replicate', json=_sequenced('node-a', 2, insert('P2', 2)))
+    duplicate = admin_client.post('/replicate', json=_sequenced('node-a', 2, insert('P2', 2)))
+
+    assert (buffered.status_code, buffered.get_json()['status']) == (202, 'buffered')
+    assert (failed.status_code, failed.get_json()) == (422, {'status': 'failed', 'high_water': 1})
+    assert (applied.status_code, applied.get_json()) == (201, {'status': 'applied', 'high_water': 3})
+    assert (duplicate.status_code, duplicate.get_json()['status']) == (200, 'duplicate')
+
+
+class _Replies:
+    """Transport answering every post with a fixed status code and body."""
+
+    def __init__(self, status_code, body):
+        self.status_code, self.body = status_code, body
+        self.posts = []
+
+    def post(self, url, data):
+        self.posts.append(json.loads(data))
+        response = requests.Response()
+        response.status_code = self.status_code
+        response._content = json.dumps(self.body).encode('utf-8')
+        return response
+
+
+def test_sender_sees_a_message_the_peer_could_not_apply(db_manager):
+    failing = _Replies(422, {'status': 'failed', 'high_water': 1})
+    strategy = ReplicationStrategy(db_manager, nodes=['http://peer'], transport=failing)
+
+    assert strategy.send_message(strategy._prepare('insert', {'PatientID': 'P1'}, 'patient', 'request-1')) is False
+    # Not resent: the peer has already stepped over it
+    assert [post['seq'] for post in failing.posts] == [1]
+
+    strategy.transport = _Replies(201, {'status': 'applied', 'high_water': 2})
+    assert strategy.send_message(strategy._prepare('insert', {'PatientID': 'P2'}, 'patient', 'request-2')) is True
+
+
+class _ReceiverTransport:
+    """Transport delivering straight to a peer's ReplicationReceiver."""
+
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def post(self, url, data):
+        message = json.loads(data)
+        operations = [{key: message[key] for key in ('action', 'object_type', 'data')}]
+        reply = self.receiver.receive(message['origin'], message['seq'], operations)
+        response = requests.Response()
+        response.status_code = {'applied': 201, 'duplicate': 200, 'failed': 422}.get(reply['status'], 202)
+        response._content = json.dumps(reply).encode('utf-8')
+        return response
+
+
+def test_message_dropped_by_a_busy_peer_is_resent(db_manager, peer_manager, patient, monkeypatch):
+    monkeypatch.setattr(Config, 'REPLICATION_REORDER_BUFFER', 1)
+    monkeypatch.setattr(Config, 'REPLICATION_RESEND_GRACE_SECONDS', 0)
+    receiver = ReplicationReceiver(peer_manager)
+    strategy = ReplicationStrategy(db_manager, nodes=['http://peer'], transport=_ReceiverTransport(receiver))
+    # Logged but lost on the way to the peer
+    strategy._prepare('insert', patient('P1', 1), 'patient', 'request-1')
+    second = strategy._prepare('insert', patient('P2', 2), 'patient', 'request-2')
+    third = strategy._prepare('insert', patient('P3', 3), 'patient', 'request-3')
+
+    assert strategy._post('http://peer', second)['status'] == 'buffered'
+    # The buffer is full, so the peer drops this one; the sender resends the gap and then it
+    strategy.send_message(third)
+
+    assert receiver.status() == {'positions': {strategy.log.origin: 3}, 'buffered': {}}
+    assert all(peer_manager.patient_exists(patient_id) for patient_id in ('P1', 'P2', 'P3'))
@@ -0,0 +1,98 @@
+import datetime
+
+import pytest
+
+from exceptions import AppointmentConflictError, InvalidRequestException
+from database import RECORD_ID_RANGE
+from replication_log import ReplicationReceiver
+from scheduling import Scheduler, parse_timestamp
+
+
+@pytest.fixture
+def scheduler(db_manager):
+    return Scheduler(db_manager)
+
+
+def _booking(patient_id, doctor_id, start, end):
+    return {'PatientID': patient_id, 'DoctorID': doctor_id, 'StartTime': start, 'EndTime': end}
+
+
+def test_overlapping_booking_of_a_doctor_is_rejected(scheduler):
+    first = scheduler.book(_booking('P1', 'D1', '2030-01-07T09:00:00', '2030-01-07T09:30:00'))
+
+    with pytest.raises(AppointmentConflictError) as conflict:
+        scheduler.book(_booking('P2', 'D1', '2030-01-07T09:15:00', '2030-01-07T09:45:00'))
+
+    assert [entry['AppointmentID'] for entry in conflict.value.conflicts] == [first]
+    assert conflict.value.conflicts[0]['DoctorID'] == 'D1'
+
+
+def test_adjacent_bookings_do_not_conflict(scheduler):
+    scheduler.book(_booking('P1', 'D1', '2030-01-07T09:00:00', '2030-01-07T09:30:00'))
+
+    assert scheduler.book(_booking('P2', 'D1', '2030-01-07T09:30:00', '2030-01-07T10:00:00'))
+    assert scheduler.book(_booking('P3', 'D1', '2030-01-07T08:30:00', '2030-01-07T09:00:00'))
+
+
+def test_patient_cannot_be_booked_with_two_doctors_at_once(scheduler):
+    scheduler.book(_booking('P1', 'D1', '2030-01-07T09:00:00', '2030-01-07T10:00:00'))
+
+    with pytest.raises(AppointmentConflictError) as conflict:
+        scheduler.book(_booking('P1', 'D2', '2030-01-07T09:45:00', '2030-01-07T10:15:00'))
+
+    assert conflict.value.conflicts[0]['PatientID'] == 'P1'
+
+
+def test_offset_aware_times_are_compared_in_utc(scheduler):
+    scheduler.book(_booking('P1', 'D1', '2030-01-07T09:00:00', '2030-01-07T09:30:00'))
+
+    with pytest.raises(AppointmentConflictError):
+        scheduler.book(_booking('P2', 'D1', '2030-01-07T11:10:00+02:00', '2030-01-07T11:40:00+02:00'))
+    assert scheduler.book(_booking('P2', 'D1', '2030-01-07T11:30:00+02:00', '2030-01-07T12:00:00+02:00'))
+
+
+def test_bookings_written_elsewhere_reach_a_loaded_calendar(db_manager, scheduler):
+    scheduler.book(_booking('P1', 'D1', '2030-01-07T09:00:00', '2030-01-07T09:30:00'))
+    # Bypasses the scheduler, as a replicated booking does; the change log keeps the index current
+    db_manager.insert_appointment(_booking('P2', 'D1', '2030-01-07T10:00:00', '2030-01-07T10:30:00'))
+
+    with pytest.raises(AppointmentConflictError):
+        scheduler.book(_booking('P3', 'D1', '2030-01-07T10:15:00', '2030-01-07T10:45:00'))
+
+
+def test_insert_rechecks_conflicts_in_its_transaction(db_manager):
+    db_manager.insert_appointment(_booking('P1', 'D1', '2030-01-07T09:00:00', '2030-01-07T09:30:00'))
+
+    with pytest.raises(AppointmentConflictError):
+        db_manager.insert_appointment(
+            _booking('P2', 'D1', '2030-01-07T09:10:00', '2030-01-07T09:20:00'), check_conflicts=True
+        )
+
+
+def test_invalid_intervals_are_rejected(scheduler):
+    with pytest.raises(InvalidRequestException):
+        scheduler.book(_booking('P1', 'D1', '2030-01-07T09:00:00', '2030-01-07T09:00:00'))
+    with pytest.raises(InvalidRequestException):
+        scheduler.book(_booking('P1', 'D1', '2030-01-07T00:00:00', '2030-01-08T00:00:00'))
+
+
+def test_parse_timestamp_normalises_to_naive_utc():
+    assert parse_timestamp('2030-01-07T11:00:00+02:00') == datetime.datetime(2030, 1, 7, 9, 0)
+    assert parse_timestamp('2030-01-07T09:00:00') == datetime.datetime(2030, 1, 7, 9, 0)
+    with pytest.raises(InvalidRequestException):
+        parse_timestamp('not a time')
+
+
+def test_bookings_made_on_two_nodes_replicate_to_both(db_manager, peer_manager):
+    local_id = Scheduler(db_manager).book(_booking('P1', 'D1', '2030-01-07T09:00:00', '2030-01-07T09:30:00'))
+    remote_id = Scheduler(peer_manager).book(_booking('P2', 'D2', '2030-01-07T09:00:00', '2030-01-07T09:30:00'))
+    assert local_id != remote_id
+    assert RECORD_ID_RANGE[0] <= local_id < RECORD_ID_RANGE[1]
+
+    for source, target, origin, appointment_id in ((peer_manager, db_manager, 'peer', remote_id),
+                                                   (db_manager, peer_manager, 'local', local_id)):
+        operations = [{'action': 'insert', 'object_type': 'appointment', 'data': source.get_appointment_by_id(appointment_id)}]
+        assert ReplicationReceiver(target).receive(origin, 1, operations)['status'] == 'applied'
+
+    for manager in (db_manager, peer_manager):
+        assert {appointment.AppointmentID for appointment in manager.get_all_appointments()} == {local_id, remote_id}
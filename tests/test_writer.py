@@ -0,0 +1,129 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from writer import WriteBusyError, WriteCoordinator
+
+
+class Boom(Exception):
+    pass
+
+
+def _fail_after_insert(db_manager, patient):
+    def operation(db):
+        db_manager._insert_patient_op(db, patient)
+        raise Boom('rejected after writing')
+    return operation
+
+
+def test_failing_operation_is_rolled_back_alone(db_manager, patient):
+    published = []
+    db_manager.change_log.subscribe(published.extend)
+    group = [
+        (db_manager._insert_patient_op, (patient('P1', 1),), Future()),
+        (_fail_after_insert(db_manager, patient('P2', 2)), (), Future()),
+        (db_manager._insert_patient_op, (patient('P3', 3),), Future()),
+    ]
+
+    db_manager.writer._commit_group(group)
+
+    first, failed, last = (future for _, _, future in group)
+    assert first.result() == 'P1'
+    assert last.result() == 'P3'
+    assert isinstance(failed.exception(), Boom)
+    assert db_manager.patient_exists('P1') and db_manager.patient_exists('P3')
+    assert not db_manager.patient_exists('P2')
+    assert sorted(change['row_id'] for change in published) == ['P1', 'P3']
+
+
+def test_failed_group_commit_fails_every_operation(db_manager, patient, monkeypatch):
+    original = db_manager.get_session
+
+    def commit():
+        raise Boom('disk full')
+
+    def get_session():
+        db = original()
+        monkeypatch.setattr(db, 'commit', commit)
+        return db
+
+    monkeypatch.setattr(db_manager, 'get_session', get_session)
+    group = [(db_manager._insert_patient_op, (patient(f'P{i}', i),), Future()) for i in range(3)]
+
+    db_manager.writer._commit_group(group)
+
+    assert all(isinstance(future.exception(), Boom) for _, _, future in group)
+    monkeypatch.undo()
+    assert not any(db_manager.patient_exists(f'P{i}') for i in range(3))
+
+
+def test_concurrent_writes_commit_together(db_manager, patient):
+    writer = db_manager.writer = WriteCoordinator(db_manager, max_batch=64, max_wait=0.05, queue_limit=64, timeout=10)
+    threads = [threading.Thread(target=db_manager.insert_patient, args=(patient(f'P{i}', i),)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.stop(timeout=5)
+
+    assert all(db_manager.patient_exists(f'P{i}') for i in range(8))
+
+
+def test_write_that_times_out_in_the_queue_never_commits(db_manager, patient):
+    writer = db_manager.writer = WriteCoordinator(db_manager, max_batch=1, max_wait=0, queue_limit=8, timeout=0.2)
+    started, release = threading.Event(), threading.Event()
+
+    def blocking(db):
+        started.set()
+        release.wait(5)
+
+    blocker = threading.Thread(target=writer.execute, args=(blocking,))
+    blocker.start()
+    assert started.wait(5)
+
+    with pytest.raises(WriteBusyError):
+        writer.execute(db_manager._insert_patient_op, patient('P1', 1))
+
+    release.set()
+    blocker.join(5)
+    writer.stop(timeout=5)
+    assert not db_manager.patient_exists('P1')
+
+
+def test_write_that_started_before_the_timeout_reports_its_outcome(db_manager):
+    writer = db_manager.writer = WriteCoordinator(db_manager, max_batch=1, max_wait=0, queue_limit=8, timeout=0.1)
+
+    def slow(db):
+        threading.Event().wait(0.3)
+        return 'done'
+
+    assert writer.execute(slow) == 'done'
+    writer.stop(timeout=5)
+
+
+def test_full_queue_rejects_writes(db_manager, patient):
+    writer = db_manager.writer = WriteCoordinator(db_manager, max_batch=1, max_wait=0, queue_limit=1, timeout=5)
+    started, release = threading.Event(), threading.Event()
+
+    def blocking(db):
+        started.set()
+        release.wait(5)
+
+    threads = [threading.Thread(target=writer.execute, args=(blocking,))]
+    threads[0].start()
+    assert started.wait(5)
+    # Fills the single queue slot behind the running operation
+    threads.append(threading.Thread(target=writer.execute, args=(lambda db: None,)))
+    threads[1].start()
+    while writer._queue.qsize() < 1:
+        threading.Event().wait(0.01)
+
+    with pytest.raises(WriteBusyError):
+        writer.execute(db_manager._insert_patient_op, patient('P1', 1))
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    writer.stop(timeout=5)
+    assert not db_manager.patient_exists('P1')